@@ -13,14 +13,14 @@ def create_ai_integration():
     # 1. Celery tasks for background AI processing
     tasks_content = '''
 from celery import shared_task
-from django.core.mail import send_mail
-from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
 import logging
+import time
 
-from .models import Equipment, Booking, User
+from .models import Equipment, User
 from .ai_services import ai_service
+from .notifications import send_booking_emails, send_maintenance_digest
 
 logger = logging.getLogger(__name__)
 
@@ -57,150 +57,117 @@ def generate_equipment_ai_content(equipment_id):
 @shared_task
 def send_booking_notification(booking_id, status_change):
     """Gửi email thông báo với nội dung AI"""
+    return send_booking_notifications([booking_id], status_change)
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def send_booking_notifications(self, booking_ids, status_change):
+    """Gửi email cho cả lô đơn qua một kết nối SMTP"""
     try:
-        booking = Booking.objects.get(id=booking_id)
-        
-        # Generate AI email content
-        email_content = ai_service.generate_smart_email(booking, status_change)
-        
-        # Email subject
-        status_map = {
-            'approved': 'Đặt lịch được duyệt',
-            'rejected': 'Đặt lịch bị từ chối',
-            'completed': 'Đặt lịch hoàn thành',
-            'cancelled': 'Đặt lịch bị hủy'
-        }
-        
-        subject = f"[DNU Lab] {status_map.get(status_change, 'Cập nhật đặt lịch')}"
-        
-        # Send email
-        send_mail(
-            subject=subject,
-            message=email_content,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[booking.user.email],
-            fail_silently=False
-        )
-        
-        logger.info(f"Sent notification email for booking {booking_id}")
-        
-    except Booking.DoesNotExist:
-        logger.error(f"Booking {booking_id} not found")
+        return send_booking_emails(booking_ids, status_change)
     except Exception as e:
-        logger.error(f"Failed to send notification for booking {booking_id}: {e}")
+        # Chỉ retry các đơn chưa gửi, tránh gửi trùng email đã đi
+        unsent = getattr(e, 'unsent_ids', None)
+        unsent = booking_ids if unsent is None else unsent
+        logger.error(f"Failed to send notifications for bookings {unsent}: {e}")
+        raise self.retry(args=[unsent, status_change], exc=e)
 
 @shared_task
 def analyze_booking_patterns():
     """Phân tích pattern đặt lịch để cải thiện hệ thống"""
     try:
-        # Get recent bookings
-        recent_bookings = Booking.objects.filter(
-            created_at__gte=timezone.now() - timedelta(days=30)
-        ).select_related('user', 'equipment')
-        
-        # Analyze patterns
-        patterns = {}
-        for booking in recent_bookings:
-            key = f"{booking.equipment.department.name}_{booking.user.userprofile.role}"
-            if key not in patterns:
-                patterns[key] = {
-                    'count': 0,
-                    'avg_duration': 0,
-                    'success_rate': 0,
-                    'equipment_types': set()
-                }
-            
-            patterns[key]['count'] += 1
-            patterns[key]['avg_duration'] += booking.duration_hours
-            patterns[key]['equipment_types'].add(booking.equipment.name)
-            
-            if booking.status in ['approved', 'completed']:
-                patterns[key]['success_rate'] += 1
+        from .analytics import take_snapshot
         
-        # Calculate averages
-        for pattern in patterns.values():
-            if pattern['count'] > 0:
-                pattern['avg_duration'] /= pattern['count']
-                pattern['success_rate'] = (pattern['success_rate'] / pattern['count']) * 100
-                pattern['equipment_types'] = list(pattern['equipment_types'])
-        
-        # TODO: Store patterns in database or cache for AI recommendations
-        logger.info(f"Analyzed {len(patterns)} booking patterns")
+        # GROUP BY trên DB, lưu vào BookingPatternSnapshot cho AI recommendations
+        snapshot = take_snapshot(days=30)
+        logger.info(
+            f"Analyzed {len(snapshot.stats['patterns'])} booking patterns "
+            f"from {snapshot.booking_count} bookings (snapshot {snapshot.id})"
+        )
+        return snapshot.id
         
     except Exception as e:
         logger.error(f"Failed to analyze booking patterns: {e}")
 
 @shared_task
 def send_maintenance_reminders():
-    """Gửi nhắc nhở bảo trì thiết bị"""
+    """Gửi email tổng hợp nhắc nhở bảo trì thiết bị, mỗi admin một email"""
     try:
+        started = time.perf_counter()
         # Find equipment needing maintenance
-        equipment_list = Equipment.objects.filter(
-            status='available',
-            warranty_date__lte=timezone.now().date() + timedelta(days=30)
+        equipment_list = list(
+            Equipment.objects.filter(
+                status='available',
+                warranty_date__lte=timezone.now().date() + timedelta(days=30)
+            ).select_related('department').order_by('name', 'code')
         )
         
-        if not equipment_list:
-            return
-        
         # Get admin users
-        admin_users = User.objects.filter(
-            userprofile__role__in=['admin', 'teacher']
+        recipients = list(
+            User.objects.filter(userprofile__role__in=['admin', 'teacher'])
+            .exclude(email='').values_list('email', flat=True).distinct()
         )
+        query_time = time.perf_counter() - started
         
-        for equipment in equipment_list:
-            # Generate AI maintenance recommendation
-            maintenance_advice = ai_service.chat_assistant(
-                f"Tạo lời khuyên bảo trì cho thiết bị {equipment.name}. "
-                f"Thiết bị đã mua từ {equipment.purchase_date}, "
-                f"bảo hành đến {equipment.warranty_date}. "
-                f"Mô tả: {equipment.description}"
-            )
-            
-            # Send to admins
-            for admin in admin_users:
-                send_mail(
-                    subject=f"[DNU Lab] Nhắc nhở bảo trì thiết bị {equipment.name}",
-                    message=f"""
-Thiết bị cần được kiểm tra bảo trì:
-
-Tên thiết bị: {equipment.name}
-Mã thiết bị: {equipment.code}
-Khoa: {equipment.department.name}
-Ngày mua: {equipment.purchase_date}
-Hết bảo hành: {equipment.warranty_date}
-
-Lời khuyên từ AI:
-{maintenance_advice}
-
-Vui lòng kiểm tra và cập nhật trạng thái thiết bị.
-                    """,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[admin.email],
-                    fail_silently=True
-                )
+        if not equipment_list or not recipients:
+            return
         
-        logger.info(f"Sent maintenance reminders for {len(equipment_list)} equipment")
+        report = send_maintenance_digest(equipment_list, recipients)
+        report['timings']['query'] = round(query_time, 3)
+        logger.info(
+            f"Sent maintenance digest for {report['equipment']} equipment "
+            f"({report['types']} types) to {report['sent']}/{report['recipients']} recipients, "
+            f"timings: {report['timings']}"
+        )
+        return report
         
     except Exception as e:
         logger.error(f"Failed to send maintenance reminders: {e}")
 
 @shared_task
-def cleanup_old_ai_chats():
-    """Dọn dẹp chat AI cũ"""
+def refresh_usage_rollups():
+    """Tính lại rollup sử dụng theo ngày cho các ngày có đơn thay đổi"""
     try:
-        from .models import AIChat
+        from .rollups import refresh_dirty
         
-        # Delete chats older than 90 days
-        old_chats = AIChat.objects.filter(
-            created_at__lt=timezone.now() - timedelta(days=90)
-        )
+        days = refresh_dirty()
+        logger.info(f"Refreshed usage rollups for {days} days")
+        return days
+    except Exception as e:
+        logger.error(f"Failed to refresh usage rollups: {e}")
+
+@shared_task
+def reconcile_dashboard_counters():
+    """Đối chiếu bộ đếm dashboard trong cache với DB"""
+    try:
+        from .counters import dashboard_counters
         
-        count = old_chats.count()
-        old_chats.delete()
+        counts = dashboard_counters.reconcile()
+        logger.info(f"Reconciled dashboard counters: {counts}")
         
-        logger.info(f"Cleaned up {count} old AI chat records")
+    except Exception as e:
+        logger.error(f"Failed to reconcile dashboard counters: {e}")
+
+@shared_task
+def summarize_chat_history(user_id):
+    """Gộp các lượt chat đã ra khỏi cửa sổ ngữ cảnh vào bản tóm tắt"""
+    try:
+        from .chat_context import summarize_pending
         
+        turns = summarize_pending(user_id)
+        logger.info(f"Summarized {turns} chat turns for user {user_id}")
+        return turns
+    except Exception as e:
+        logger.error(f"Failed to summarize chat history for user {user_id}: {e}")
+
+@shared_task
+def cleanup_old_ai_chats():
+    """Dọn dẹp chat AI cũ (theo lô, dừng khi hết AI_CHAT_PURGE_TIME_BUDGET)"""
+    try:
+        from .retention import purge_old_chats
+        
+        report = purge_old_chats()
+        logger.info(f"Cleaned up old AI chat records: {report.as_dict()}")
+        return report.as_dict()
     except Exception as e:
         logger.error(f"Failed to cleanup old AI chats: {e}")
 '''
@@ -224,11 +191,16 @@ def cleanup_old_ai_chats():
     # AI management command
     ai_command_content = '''
 from django.core.management.base import BaseCommand
+from django.db.models import Q
 from django.utils import timezone
 from lab_management.models import Equipment, Booking
-from lab_management.ai_services import ai_service
-from lab_management.tasks import generate_equipment_ai_content
-import time
+from lab_management.ai_cache import ai_cache
+from lab_management.catalog import bump_generation
+from lab_management.recommendations import recommender
+from lab_management.ai_services import ai_service, equipment_description_prompt, usage_tips_prompt
+from lab_management.ai_batch import AsyncGenerationEngine, GenerationJob
+from lab_management.analytics import booking_pattern_stats
+from lab_management.rollups import monthly_usage
 
 class Command(BaseCommand):
     help = 'AI operations for lab management system'
@@ -252,8 +224,32 @@ class Command(BaseCommand):
         parser.add_argument(
             '--batch-size',
             type=int,
-            default=10,
-            help='Batch size for processing (default: 10)'
+            default=200,
+            help='Equipment per generation/bulk_update batch (default: 200)'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Concurrent LLM requests (default: 8)'
+        )
+        parser.add_argument(
+            '--rpm',
+            type=int,
+            default=500,
+            help='Requests per minute limit (default: 500)'
+        )
+        parser.add_argument(
+            '--tpm',
+            type=int,
+            default=90000,
+            help='Tokens per minute limit (default: 90000)'
+        )
+        parser.add_argument(
+            '--max-retries',
+            type=int,
+            default=5,
+            help='Retries per request on rate limit/transient errors (default: 5)'
         )
     
     def handle(self, *args, **options):
@@ -275,7 +271,7 @@ class Command(BaseCommand):
         else:
             # Only process equipment without AI descriptions
             equipment_qs = equipment_qs.filter(
-                models.Q(ai_description='') | models.Q(ai_description__isnull=True)
+                Q(ai_description='') | Q(ai_description__isnull=True)
             )
         
         total = equipment_qs.count()
@@ -285,120 +281,122 @@ class Command(BaseCommand):
         
         self.stdout.write(f'Found {total} equipment to process')
         
+        engine = AsyncGenerationEngine(
+            concurrency=options['concurrency'],
+            requests_per_minute=options['rpm'],
+            tokens_per_minute=options['tpm'],
+            max_retries=options['max_retries'],
+        )
         batch_size = options['batch_size']
+        equipment_qs = equipment_qs.order_by('id').only(
+            'id', 'name', 'description', 'specifications', 'ai_description', 'usage_tips'
+        )
         processed = 0
+        last_id = 0
         
-        for equipment in equipment_qs.iterator(chunk_size=batch_size):
-            try:
-                self.stdout.write(f'Processing: {equipment.name}')
-                
-                # Generate description
+        while True:
+            batch = list(equipment_qs.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            
+            jobs = []
+            for equipment in batch:
                 if not equipment.ai_description:
-                    description = ai_service.generate_equipment_description(
-                        equipment.name,
-                        equipment.specifications
-                    )
-                    equipment.ai_description = description
-                    self.stdout.write(f'  ✅ Generated description')
-                
-                # Generate usage tips
+                    jobs.append(GenerationJob(
+                        (equipment.id, 'ai_description'),
+                        equipment_description_prompt(equipment.name, equipment.specifications),
+                        cache_key=ai_service.cache_key(
+                            'equipment_description', equipment.name, equipment.specifications
+                        ),
+                        kind='equipment_description',
+                    ))
                 if not equipment.usage_tips:
-                    tips = ai_service.generate_usage_tips(
-                        equipment.name,
-                        equipment.description
-                    )
-                    equipment.usage_tips = tips
-                    self.stdout.write(f'  ✅ Generated usage tips')
-                
-                equipment.save()
-                processed += 1
-                
-                # Rate limiting
-                time.sleep(1)  # Wait 1 second between requests
-                
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(f'  ❌ Error processing {equipment.name}: {e}')
-                )
-                continue
-        
+                    jobs.append(GenerationJob(
+                        (equipment.id, 'usage_tips'),
+                        usage_tips_prompt(equipment.name, equipment.description),
+                        cache_key=ai_service.cache_key(
+                            'usage_tips', equipment.name, equipment.description
+                        ),
+                        kind='usage_tips',
+                    ))
+            
+            results = engine.run_sync(jobs)
+            
+            now = timezone.now()
+            updated = []
+            for equipment in batch:
+                changed = False
+                for field in ('ai_description', 'usage_tips'):
+                    text = results.get((equipment.id, field))
+                    if text:
+                        setattr(equipment, field, text)
+                        changed = True
+                if changed:
+                    equipment.updated_at = now
+                    updated.append(equipment)
+            
+            Equipment.objects.bulk_update(updated, ['ai_description', 'usage_tips', 'updated_at'])
+            if updated:
+                # bulk_update bypasses signals
+                bump_generation()
+                recommender.update([equipment.id for equipment in updated])
+            processed += len(updated)
+            self.stdout.write(f'  ✅ {processed}/{total} equipment updated')
+        
+        self.stdout.write('\\n📊 Generation metrics:')
+        for line in engine.metrics.summary():
+            self.stdout.write(f'  {line}')
+        cache_stats = ai_cache.stats()
         self.stdout.write(
-            self.style.SUCCESS(f'✅ Processed {processed}/{total} equipment')
+            f"  Cache: {cache_stats['backend']}, {cache_stats['entries']} entries, "
+            f"hit rate {cache_stats['hit_rate']:.0%}, {cache_stats['evictions']} evictions"
         )
+        
+        style = self.style.SUCCESS if engine.metrics.failed == 0 else self.style.WARNING
+        self.stdout.write(style(f'✅ Processed {processed}/{total} equipment'))
     
     def analyze_bookings(self):
         """Analyze booking patterns"""
         self.stdout.write('📊 Analyzing booking patterns...')
         
-        # Get recent bookings
-        recent_bookings = Booking.objects.filter(
-            created_at__gte=timezone.now() - timezone.timedelta(days=30)
-        ).select_related('user', 'equipment', 'equipment__department')
+        # Aggregated in SQL, one GROUP BY query per dimension
+        stats = booking_pattern_stats(timezone.now() - timezone.timedelta(days=30))
         
-        if not recent_bookings.exists():
+        if not stats['total']:
             self.stdout.write(self.style.WARNING('No recent bookings found'))
             return
         
-        # Analyze by department
-        dept_stats = {}
-        user_stats = {}
-        equipment_stats = {}
-        
-        for booking in recent_bookings:
-            dept_name = booking.equipment.department.name
-            user_role = booking.user.userprofile.role
-            equipment_name = booking.equipment.name
-            
-            # Department stats
-            if dept_name not in dept_stats:
-                dept_stats[dept_name] = {'total': 0, 'approved': 0, 'avg_duration': 0}
-            dept_stats[dept_name]['total'] += 1
-            dept_stats[dept_name]['avg_duration'] += booking.duration_hours
-            if booking.status in ['approved', 'completed']:
-                dept_stats[dept_name]['approved'] += 1
-            
-            # User role stats
-            if user_role not in user_stats:
-                user_stats[user_role] = {'total': 0, 'approved': 0}
-            user_stats[user_role]['total'] += 1
-            if booking.status in ['approved', 'completed']:
-                user_stats[user_role]['approved'] += 1
-            
-            # Equipment stats
-            if equipment_name not in equipment_stats:
-                equipment_stats[equipment_name] = {'total': 0, 'avg_duration': 0}
-            equipment_stats[equipment_name]['total'] += 1
-            equipment_stats[equipment_name]['avg_duration'] += booking.duration_hours
-        
-        # Calculate averages and display results
         self.stdout.write('\\n📈 Department Statistics:')
-        for dept, stats in dept_stats.items():
-            avg_duration = stats['avg_duration'] / stats['total']
-            approval_rate = (stats['approved'] / stats['total']) * 100
+        for row in stats['departments']:
             self.stdout.write(
-                f'  {dept}: {stats["total"]} bookings, '
-                f'{approval_rate:.1f}% approved, '
-                f'{avg_duration:.1f}h avg duration'
+                f'  {row["department"]}: {row["total"]} bookings, '
+                f'{row["approval_rate"]:.1f}% approved, '
+                f'{row["avg_duration_hours"]:.1f}h avg duration'
             )
         
         self.stdout.write('\\n👥 User Role Statistics:')
-        for role, stats in user_stats.items():
-            approval_rate = (stats['approved'] / stats['total']) * 100
+        for row in stats['roles']:
             self.stdout.write(
-                f'  {role}: {stats["total"]} bookings, {approval_rate:.1f}% approved'
+                f'  {row["role"] or "unknown"}: {row["total"]} bookings, '
+                f'{row["approval_rate"]:.1f}% approved'
             )
         
         self.stdout.write('\\n🔧 Most Popular Equipment:')
-        sorted_equipment = sorted(
-            equipment_stats.items(), 
-            key=lambda x: x[1]['total'], 
-            reverse=True
-        )[:10]
+        for row in stats['equipment'][:10]:
+            self.stdout.write(
+                f'  {row["equipment_name"]}: {row["total"]} bookings, '
+                f'{row["avg_duration_hours"]:.1f}h avg'
+            )
         
-        for equipment, stats in sorted_equipment:
-            avg_duration = stats['avg_duration'] / stats['total']
+        # Month-over-month usage comes from the daily rollup tables
+        today = timezone.localdate()
+        start = (today - timezone.timedelta(days=155)).replace(day=1)
+        self.stdout.write('\\n📅 Monthly Usage (last 6 months):')
+        for row in monthly_usage(start, today + timezone.timedelta(days=1)):
             self.stdout.write(
-                f'  {equipment}: {stats["total"]} bookings, {avg_duration:.1f}h avg'
+                f'  {row["month"]:%m/%Y} {row["name"]}: {row["total"]} bookings, '
+                f'{row["hours"]}h, {row["utilization"]}% utilization'
             )
         
         self.stdout.write(self.style.SUCCESS('✅ Analysis complete'))
@@ -407,7 +405,354 @@ class Command(BaseCommand):
     with open(f'{commands_dir}/ai_operations.py', 'w', encoding='utf-8') as f:
         f.write(ai_command_content.strip())
     
-    # 3. Celery configuration
+    # 3. Async batch generation engine
+    ai_batch_content = '''
+"""
+Engine sinh nội dung AI bất đồng bộ theo lô.
+
+Chạy nhiều request song song (giới hạn bởi semaphore), điều tiết bằng hai
+token bucket (request/phút và token/phút), retry các lỗi tạm thời với
+exponential backoff + jitter, và thu thập số liệu throughput/lỗi.
+Job có cache_key được tra trong ai_cache trước và gộp nếu trùng key.
+Trỏ OPENAI_BASE_URL tới `manage.py fake_llm_server` để test không tốn phí.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+
+from django.conf import settings
+from openai import (
+    AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError,
+)
+
+from .ai_cache import ai_cache
+from .ai_services import build_messages
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+
+class TokenBucket:
+    """Token bucket bất đồng bộ, nạp lại đều `per_minute` đơn vị mỗi phút"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def refund(self, amount):
+        """Trả lại phần ước lượng dư (hoặc trừ thêm nếu amount < 0)"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+@dataclass
+class GenerationJob:
+    key: Any
+    prompt: str
+    max_tokens: int = 250
+    cache_key: str = None
+    kind: str = 'default'
+
+    @property
+    def estimated_tokens(self):
+        # Ước lượng thô ~4 ký tự/token cho prompt, cộng max_tokens cho output
+        return len(self.prompt) // 4 + self.max_tokens
+
+
+@dataclass
+class GenerationMetrics:
+    succeeded: int = 0
+    failed: int = 0
+    retries: int = 0
+    cache_hits: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    elapsed: float = 0.0
+    latencies: list = field(default_factory=list)
+    errors: Counter = field(default_factory=Counter)
+
+    @property
+    def requests(self):
+        return self.succeeded + self.failed
+
+    def percentile(self, q):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self):
+        elapsed = self.elapsed or 1e-9
+        lines = [
+            f'Requests: {self.requests} ({self.succeeded} ok, {self.failed} failed, {self.retries} retries), '
+            f'{self.cache_hits} served from cache',
+            f'Elapsed: {self.elapsed:.1f}s, {self.requests / elapsed:.2f} req/s, '
+            f'{(self.prompt_tokens + self.completion_tokens) / elapsed:.0f} tokens/s',
+            f'Tokens: {self.prompt_tokens} prompt + {self.completion_tokens} completion',
+            f'Latency: p50={self.percentile(0.5):.2f}s p95={self.percentile(0.95):.2f}s '
+            f'max={max(self.latencies, default=0):.2f}s',
+        ]
+        if self.errors:
+            lines.append('Errors: ' + ', '.join(f'{name}={n}' for name, n in self.errors.most_common()))
+        return lines
+
+
+class AsyncGenerationEngine:
+    """Chạy danh sách GenerationJob với concurrency và rate limit giới hạn"""
+
+    def __init__(self, concurrency=8, requests_per_minute=500, tokens_per_minute=90000,
+                 max_retries=5, base_delay=1.0, max_delay=30.0):
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = GenerationMetrics()
+
+    @property
+    def model(self):
+        return getattr(settings, 'OPENAI_MODEL', 'gpt-3.5-turbo')
+
+    def _backoff(self, attempt, error):
+        retry_after = getattr(getattr(error, 'response', None), 'headers', {}).get('retry-after')
+        if retry_after:
+            try:
+                return float(retry_after) + random.uniform(0, self.base_delay)
+            except ValueError:
+                pass
+        # Full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def _run_job(self, client, job, semaphore, request_bucket, token_bucket):
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                estimate = job.estimated_tokens
+                await request_bucket.acquire()
+                await token_bucket.acquire(estimate)
+                started = time.perf_counter()
+                try:
+                    response = await client.chat.completions.create(
+                        model=self.model,
+                        messages=build_messages(job.prompt),
+                        max_tokens=job.max_tokens,
+                    )
+                except RETRYABLE_ERRORS as e:
+                    token_bucket.refund(estimate)
+                    if attempt == self.max_retries:
+                        self.metrics.failed += 1
+                        self.metrics.errors[type(e).__name__] += 1
+                        logger.warning(f"AI job {job.key} failed after {attempt + 1} attempts: {e}")
+                        return job.key, None
+                    self.metrics.retries += 1
+                    await asyncio.sleep(self._backoff(attempt, e))
+                    continue
+                except Exception as e:
+                    self.metrics.failed += 1
+                    self.metrics.errors[type(e).__name__] += 1
+                    logger.warning(f"AI job {job.key} failed: {e}")
+                    return job.key, None
+
+                self.metrics.latencies.append(time.perf_counter() - started)
+                usage = response.usage
+                if usage:
+                    self.metrics.prompt_tokens += usage.prompt_tokens
+                    self.metrics.completion_tokens += usage.completion_tokens
+                    token_bucket.refund(estimate - usage.total_tokens)
+                self.metrics.succeeded += 1
+                text = response.choices[0].message.content.strip()
+                if job.cache_key:
+                    ai_cache.set(job.cache_key, text)
+                return job.key, text
+
+    def _split_cached(self, jobs):
+        """Tách job đã có trong cache; gộp các job trùng cache_key"""
+        results, pending, duplicates = {}, {}, {}
+        for job in jobs:
+            if not job.cache_key:
+                pending[id(job)] = job
+            elif job.cache_key in duplicates:
+                duplicates[job.cache_key].append(job.key)
+            else:
+                cached = ai_cache.get(job.cache_key, job.kind)
+                if cached is not None:
+                    results[job.key] = cached
+                    self.metrics.cache_hits += 1
+                else:
+                    pending[job.cache_key] = job
+                    duplicates[job.cache_key] = []
+        return results, list(pending.values()), duplicates
+
+    async def run(self, jobs):
+        """Chạy các job, trả về {key: text}; job lỗi không có trong kết quả"""
+        results, jobs, duplicates = self._split_cached(jobs)
+        if not jobs:
+            return results
+        semaphore = asyncio.Semaphore(self.concurrency)
+        request_bucket = TokenBucket(self.requests_per_minute)
+        token_bucket = TokenBucket(self.tokens_per_minute)
+        client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=getattr(settings, 'OPENAI_BASE_URL', None),
+            max_retries=0,  # retry do engine tự xử lý
+        )
+        started = time.perf_counter()
+        try:
+            completed = await asyncio.gather(*(
+                self._run_job(client, job, semaphore, request_bucket, token_bucket)
+                for job in jobs
+            ))
+        finally:
+            self.metrics.elapsed += time.perf_counter() - started
+            await client.close()
+
+        for job, (key, text) in zip(jobs, completed):
+            if text is None:
+                continue
+            results[key] = text
+            for duplicate_key in duplicates.get(job.cache_key, ()):
+                results[duplicate_key] = text
+                self.metrics.cache_hits += 1
+        return results
+
+    def run_sync(self, jobs):
+        return asyncio.run(self.run(list(jobs)))
+'''
+    
+    with open('dnu_lab_system/lab_management/ai_batch.py', 'w', encoding='utf-8') as f:
+        f.write(ai_batch_content.strip())
+    
+    # 4. Fake OpenAI-compatible server for load testing
+    fake_llm_command_content = '''
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake OpenAI-compatible chat completions server (set OPENAI_BASE_URL=http://127.0.0.1:<port>/v1)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765, help='Port (default: 8765)')
+        parser.add_argument('--latency', type=float, default=0.5, help='Seconds per response (default: 0.5)')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of 429/500 responses (default: 0)')
+
+    def handle(self, *args, **options):
+        latency, error_rate = options['latency'], options['error_rate']
+        stdout = self.stdout
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status, payload, headers=None):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_stream(self, request, content):
+                """Trả về từng token dạng SSE như API thật khi stream=True"""
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                tokens = content.split(' ')
+                for i, token in enumerate(tokens):
+                    chunk = {
+                        'id': f'fake-{time.time_ns()}',
+                        'object': 'chat.completion.chunk',
+                        'created': int(time.time()),
+                        'model': request.get('model', 'fake'),
+                        'choices': [{
+                            'index': 0,
+                            'delta': {'content': token if i == 0 else ' ' + token},
+                            'finish_reason': None,
+                        }],
+                    }
+                    self.wfile.write(f'data: {json.dumps(chunk)}\\n\\n'.encode())
+                    self.wfile.flush()
+                    time.sleep(latency / len(tokens))
+                self.wfile.write(b'data: [DONE]\\n\\n')
+                self.wfile.flush()
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if not request.get('stream'):
+                    time.sleep(latency * random.uniform(0.5, 1.5))
+
+                if random.random() < error_rate:
+                    if random.random() < 0.5:
+                        return self.send_json(429, {'error': {'message': 'Rate limit'}}, {'Retry-After': '0.1'})
+                    return self.send_json(500, {'error': {'message': 'Server error'}})
+
+                prompt = request.get('messages', [{}])[-1].get('content', '')
+                content = f'[fake] {prompt[:80]}'
+                if request.get('stream'):
+                    return self.send_stream(request, content)
+                prompt_tokens = max(1, len(prompt) // 4)
+                completion_tokens = max(1, len(content) // 4)
+                self.send_json(200, {
+                    'id': f'fake-{time.time_ns()}',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': request.get('model', 'fake'),
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': content},
+                        'finish_reason': 'stop',
+                    }],
+                    'usage': {
+                        'prompt_tokens': prompt_tokens,
+                        'completion_tokens': completion_tokens,
+                        'total_tokens': prompt_tokens + completion_tokens,
+                    },
+                })
+
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), Handler)
+        server.daemon_threads = True
+        stdout.write(f'Fake LLM server on http://127.0.0.1:{options["port"]}/v1 '
+                     f'(latency={latency}s, error_rate={error_rate})')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+'''
+    
+    with open(f'{commands_dir}/fake_llm_server.py', 'w', encoding='utf-8') as f:
+        f.write(fake_llm_command_content.strip())
+    
+    # 5. Celery configuration
     celery_content = '''
 import os
 from celery import Celery
@@ -436,7 +781,15 @@ app.conf.beat_schedule = {
     },
     'cleanup-old-ai-chats': {
         'task': 'lab_management.tasks.cleanup_old_ai_chats',
-        'schedule': 86400.0,  # Run daily
+        'schedule': 3600.0,  # Run hourly, each run bounded by AI_CHAT_PURGE_TIME_BUDGET
+    },
+    'reconcile-dashboard-counters': {
+        'task': 'lab_management.tasks.reconcile_dashboard_counters',
+        'schedule': 900.0,  # Run every 15 minutes
+    },
+    'refresh-usage-rollups': {
+        'task': 'lab_management.tasks.refresh_usage_rollups',
+        'schedule': 300.0,  # Run every 5 minutes
     },
 }
 
@@ -450,7 +803,7 @@ def debug_task(self):
     with open('dnu_lab_system/dnu_lab_system/celery.py', 'w', encoding='utf-8') as f:
         f.write(celery_content.strip())
     
-    # 4. Update __init__.py for Celery
+    # 6. Update __init__.py for Celery
     init_content = '''
 # This will make sure the app is always imported when
 # Django starts so that shared_task will use this app.
@@ -462,7 +815,7 @@ __all__ = ('celery_app',)
     with open('dnu_lab_system/dnu_lab_system/__init__.py', 'w', encoding='utf-8') as f:
         f.write(init_content.strip())
     
-    # 5. Create translation files
+    # 7. Create translation files
     create_translation_files()
     
     print("✅ Tạo Celery tasks và management commands")
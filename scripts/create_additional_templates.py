@@ -50,6 +50,20 @@ MY_BOOKINGS_TEMPLATE = '''
             </div>
         {% endfor %}
     </div>
+    {% if page.has_previous or page.has_next %}
+        <nav class="d-flex justify-content-between">
+            {% if page.has_previous %}
+                <a href="?before={{ page.prev_cursor }}" class="btn btn-outline-primary">
+                    <i class="fas fa-chevron-left me-1"></i>Mới hơn
+                </a>
+            {% else %}<span></span>{% endif %}
+            {% if page.has_next %}
+                <a href="?after={{ page.next_cursor }}" class="btn btn-outline-primary">
+                    Cũ hơn<i class="fas fa-chevron-right ms-1"></i>
+                </a>
+            {% endif %}
+        </nav>
+    {% endif %}
 {% else %}
     <div class="text-center py-5">
         <i class="fas fa-calendar-times fa-4x text-muted mb-3"></i>
@@ -125,6 +139,19 @@ CREATE_BOOKING_TEMPLATE = '''
                     {% if form.non_field_errors %}
                         <div class="alert alert-danger">{{ form.non_field_errors }}</div>
                     {% endif %}
+                    {% if alternatives %}
+                        <div class="alert alert-info">
+                            <i class="fas fa-lightbulb me-1"></i>Thiết bị tương tự còn trống trong khoảng thời gian này:
+                            <ul class="mb-0">
+                                {% for alternative in alternatives %}
+                                    <li>
+                                        <a href="{% url 'create_booking' alternative.id %}">{{ alternative.name }}</a>
+                                        <small class="text-muted">({{ alternative.code }}, {{ alternative.department.name }})</small>
+                                    </li>
+                                {% endfor %}
+                            </ul>
+                        </div>
+                    {% endif %}
                     <div class="d-flex justify-content-between">
                         <a href="{% url 'equipment_list' %}" class="btn btn-secondary">
                             <i class="fas fa-arrow-left me-1"></i>Quay lại
@@ -141,6 +168,165 @@ CREATE_BOOKING_TEMPLATE = '''
 {% endblock %}
 '''
 
+# Pending bookings template (bulk moderation)
+PENDING_BOOKINGS_TEMPLATE = '''
+{% extends 'base.html' %}
+
+{% block title %}Đơn chờ duyệt{% endblock %}
+
+{% block content %}
+<div class="d-flex justify-content-between align-items-center mb-4">
+    <h2><i class="fas fa-clock me-2"></i>Đơn chờ duyệt</h2>
+    <span class="badge bg-warning fs-6">{{ bookings|length }} đơn</span>
+</div>
+
+{% if bookings %}
+    <form method="post" action="{% url 'bulk_moderate_bookings' %}">
+        {% csrf_token %}
+        <div class="card mb-3">
+            <div class="card-body d-flex flex-wrap gap-2 align-items-center">
+                <div class="form-check me-3">
+                    <input class="form-check-input" type="checkbox" id="select-all">
+                    <label class="form-check-label" for="select-all">Chọn tất cả</label>
+                </div>
+                <input type="text" name="notes" class="form-control w-auto flex-grow-1" placeholder="Ghi chú cho sinh viên (tùy chọn)">
+                <button type="submit" name="action" value="approve" class="btn btn-success">
+                    <i class="fas fa-check me-1"></i>Duyệt đã chọn
+                </button>
+                <button type="submit" name="action" value="reject" class="btn btn-danger">
+                    <i class="fas fa-times me-1"></i>Từ chối đã chọn
+                </button>
+            </div>
+        </div>
+
+        <div class="table-responsive">
+            <table class="table table-hover align-middle">
+                <thead>
+                    <tr>
+                        <th></th>
+                        <th>Sinh viên</th>
+                        <th>Thiết bị</th>
+                        <th>Thời gian nhận</th>
+                        <th>Thời gian trả</th>
+                        <th>Mục đích</th>
+                        <th></th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {% for booking in bookings %}
+                        <tr>
+                            <td><input class="form-check-input booking-check" type="checkbox" name="ids" value="{{ booking.id }}"></td>
+                            <td>{{ booking.user.get_full_name|default:booking.user.username }}</td>
+                            <td>{{ booking.equipment.name }}</td>
+                            <td>{{ booking.pickup_time|date:"d/m/Y H:i" }}</td>
+                            <td>{{ booking.return_time|date:"d/m/Y H:i" }}</td>
+                            <td>{{ booking.purpose|truncatewords:10 }}</td>
+                            <td>
+                                <a href="{% url 'approve_booking' booking.id %}" class="btn btn-sm btn-outline-primary">Chi tiết</a>
+                            </td>
+                        </tr>
+                    {% endfor %}
+                </tbody>
+            </table>
+        </div>
+    </form>
+{% else %}
+    <div class="text-center py-5">
+        <i class="fas fa-check-circle fa-3x text-success mb-3"></i>
+        <h4>Không có đơn nào chờ duyệt</h4>
+    </div>
+{% endif %}
+{% endblock %}
+
+{% block extra_js %}
+<script>
+document.getElementById('select-all')?.addEventListener('change', function() {
+    document.querySelectorAll('.booking-check').forEach(box => box.checked = this.checked);
+});
+</script>
+{% endblock %}
+'''
+
+# All bookings template
+ALL_BOOKINGS_TEMPLATE = '''
+{% extends 'base.html' %}
+
+{% block title %}Tất cả đơn đặt lịch{% endblock %}
+
+{% block content %}
+<div class="d-flex justify-content-between align-items-center mb-4">
+    <h2><i class="fas fa-list me-2"></i>Tất cả đơn đặt lịch</h2>
+    <form method="get" class="d-flex gap-2">
+        <select name="status" class="form-select" onchange="this.form.submit()">
+            <option value="">Tất cả trạng thái</option>
+            {% for value, label in status_choices %}
+                <option value="{{ value }}" {% if value == status_filter %}selected{% endif %}>{{ label }}</option>
+            {% endfor %}
+        </select>
+    </form>
+</div>
+
+{% if bookings %}
+    <div class="table-responsive">
+        <table class="table table-hover align-middle">
+            <thead>
+                <tr>
+                    <th>Sinh viên</th>
+                    <th>Thiết bị</th>
+                    <th>Thời gian nhận</th>
+                    <th>Thời gian trả</th>
+                    <th>Trạng thái</th>
+                    <th>Đặt lúc</th>
+                    <th></th>
+                </tr>
+            </thead>
+            <tbody>
+                {% for booking in bookings %}
+                    <tr>
+                        <td>{{ booking.user.get_full_name|default:booking.user.username }}</td>
+                        <td>{{ booking.equipment.name }}</td>
+                        <td>{{ booking.pickup_time|date:"d/m/Y H:i" }}</td>
+                        <td>{{ booking.return_time|date:"d/m/Y H:i" }}</td>
+                        <td>
+                            <span class="badge bg-{% if booking.status == 'pending' %}warning{% elif booking.status == 'approved' %}success{% elif booking.status == 'rejected' %}danger{% else %}secondary{% endif %}">
+                                {{ booking.get_status_display }}
+                            </span>
+                        </td>
+                        <td>{{ booking.created_at|date:"d/m/Y H:i" }}</td>
+                        <td>
+                            <a href="{% url 'approve_booking' booking.id %}" class="btn btn-sm btn-outline-primary">Chi tiết</a>
+                        </td>
+                    </tr>
+                {% endfor %}
+            </tbody>
+        </table>
+    </div>
+    {% if page.has_previous or page.has_next %}
+        <nav class="d-flex justify-content-between">
+            {% if page.has_previous %}
+                <a href="?{% if status_filter %}status={{ status_filter|urlencode }}&{% endif %}before={{ page.prev_cursor }}" class="btn btn-outline-primary">
+                    <i class="fas fa-chevron-left me-1"></i>Mới hơn
+                </a>
+            {% else %}<span></span>{% endif %}
+            {% if page.has_next %}
+                <a href="?{% if status_filter %}status={{ status_filter|urlencode }}&{% endif %}after={{ page.next_cursor }}" class="btn btn-outline-primary">
+                    Cũ hơn<i class="fas fa-chevron-right ms-1"></i>
+                </a>
+            {% endif %}
+        </nav>
+    {% endif %}
+{% else %}
+    <div class="text-center py-5">
+        <i class="fas fa-calendar-times fa-4x text-muted mb-3"></i>
+        <h4>Không có đơn đặt lịch nào</h4>
+        {% if status_filter %}
+            <a href="{% url 'all_bookings' %}" class="btn btn-outline-primary">Xem tất cả trạng thái</a>
+        {% endif %}
+    </div>
+{% endif %}
+{% endblock %}
+'''
+
 # Admin dashboard template
 ADMIN_DASHBOARD_TEMPLATE = '''
 {% extends 'base.html' %}
@@ -227,10 +413,39 @@ ADMIN_DASHBOARD_TEMPLATE = '''
     <div class="col-lg-8">
         <div class="card">
             <div class="card-header">
-                <h5><i class="fas fa-chart-line me-2"></i>Hoạt động gần đây</h5>
+                <h5><i class="fas fa-chart-line me-2"></i>Sử dụng theo tháng</h5>
             </div>
             <div class="card-body">
-                <p class="text-muted">Biểu đồ thống kê sẽ được thêm trong phiên bản tiếp theo.</p>
+                {% if monthly_usage %}
+                    <div class="table-responsive">
+                        <table class="table table-sm">
+                            <thead>
+                                <tr>
+                                    <th>Tháng</th>
+                                    <th>Phòng ban</th>
+                                    <th class="text-end">Số đơn</th>
+                                    <th class="text-end">Tỷ lệ duyệt</th>
+                                    <th class="text-end">Giờ sử dụng</th>
+                                    <th class="text-end">Công suất</th>
+                                </tr>
+                            </thead>
+                            <tbody>
+                                {% for row in monthly_usage %}
+                                    <tr>
+                                        <td>{{ row.month|date:"m/Y" }}</td>
+                                        <td>{{ row.name }}</td>
+                                        <td class="text-end">{{ row.total }}</td>
+                                        <td class="text-end">{{ row.approval_rate }}%</td>
+                                        <td class="text-end">{{ row.hours }}</td>
+                                        <td class="text-end">{{ row.utilization }}%</td>
+                                    </tr>
+                                {% endfor %}
+                            </tbody>
+                        </table>
+                    </div>
+                {% else %}
+                    <p class="text-muted">Chưa có dữ liệu tổng hợp.</p>
+                {% endif %}
             </div>
         </div>
     </div>
@@ -438,6 +653,8 @@ def create_additional_files():
         'lab_management/templates/booking/my_bookings.html': MY_BOOKINGS_TEMPLATE,
         'lab_management/templates/booking/create_booking.html': CREATE_BOOKING_TEMPLATE,
         'lab_management/templates/booking/admin_dashboard.html': ADMIN_DASHBOARD_TEMPLATE,
+        'lab_management/templates/booking/pending_bookings.html': PENDING_BOOKINGS_TEMPLATE,
+        'lab_management/templates/booking/all_bookings.html': ALL_BOOKINGS_TEMPLATE,
         'lab_management/seed_data.py': SEED_DATA_SCRIPT,
     }
     
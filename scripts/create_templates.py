@@ -240,8 +240,18 @@ BASE_TEMPLATE = '''
             input.value = '';
             messagesDiv.scrollTop = messagesDiv.scrollHeight;
 
-            // Send to AI
-            fetch('{% url "ai_chat" %}', {
+            // Send to AI (nhận từng token qua Server-Sent Events)
+            const bubble = document.createElement('div');
+            bubble.className = 'mb-2';
+            bubble.innerHTML = `
+                <div class="bg-light rounded p-2 d-inline-block" style="max-width: 80%;">
+                    <small><i class="fas fa-robot me-1"></i><span class="ai-text"></span></small>
+                </div>
+            `;
+            messagesDiv.appendChild(bubble);
+            const textSpan = bubble.querySelector('.ai-text');
+
+            fetch('{% url "ai_chat_stream" %}', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -249,19 +259,34 @@ BASE_TEMPLATE = '''
                 },
                 body: JSON.stringify({message: message})
             })
-            .then(response => response.json())
-            .then(data => {
-                messagesDiv.innerHTML += `
-                    <div class="mb-2">
-                        <div class="bg-light rounded p-2 d-inline-block" style="max-width: 80%;">
-                            <small><i class="fas fa-robot me-1"></i>${data.response}</small>
-                        </div>
-                    </div>
-                `;
-                messagesDiv.scrollTop = messagesDiv.scrollHeight;
+            .then(async response => {
+                if (!response.ok || !response.body) {
+                    throw new Error(response.statusText);
+                }
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                while (true) {
+                    const {value, done} = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, {stream: true});
+                    const events = buffer.split('\\n\\n');
+                    buffer = events.pop();
+                    for (const event of events) {
+                        const dataLine = event.split('\\n').find(line => line.startsWith('data: '));
+                        if (!dataLine) continue;
+                        const data = JSON.parse(dataLine.slice(6));
+                        if (data.error) throw new Error(data.error);
+                        if (data.token) {
+                            textSpan.textContent += data.token;
+                            messagesDiv.scrollTop = messagesDiv.scrollHeight;
+                        }
+                    }
+                }
             })
             .catch(error => {
                 console.error('Error:', error);
+                bubble.remove();
                 messagesDiv.innerHTML += `
                     <div class="mb-2">
                         <div class="bg-danger text-white rounded p-2 d-inline-block" style="max-width: 80%;">
@@ -346,7 +371,7 @@ HOME_TEMPLATE = '''
                     <div class="d-flex justify-content-between align-items-center mb-2">
                         <div>
                             <strong>{{ booking.equipment.name }}</strong><br>
-                            <small class="text-muted">{{ booking.student.get_full_name|default:booking.student.username }}</small>
+                            <small class="text-muted">{{ booking.user.get_full_name|default:booking.user.username }}</small>
                         </div>
                         <span class="badge bg-success">Đã duyệt</span>
                     </div>
@@ -379,6 +404,7 @@ HOME_TEMPLATE = '''
 # Equipment list template
 EQUIPMENT_LIST_TEMPLATE = '''
 {% extends 'base.html' %}
+{% load cache %}
 
 {% block title %}Danh sách thiết bị{% endblock %}
 
@@ -387,17 +413,21 @@ EQUIPMENT_LIST_TEMPLATE = '''
     <h2><i class="fas fa-microscope me-2"></i>Danh sách thiết bị</h2>
     
     <form method="get" class="d-flex">
+        <input type="search" name="q" value="{{ search_query }}" class="form-control me-2" placeholder="Tìm thiết bị..."
+               list="equipmentSuggestions" autocomplete="off" id="equipmentSearch">
+        <datalist id="equipmentSuggestions"></datalist>
         <select name="department" class="form-select me-2" onchange="this.form.submit()">
             <option value="">Tất cả phòng ban</option>
-            {% for department in departments %}
-                <option value="{{ department.id }}" {% if selected_department == department.id %}selected{% endif %}>
-                    {{ department.name }}
+            {% for department_id, department_name in departments %}
+                <option value="{{ department_id }}" {% if selected_department == department_id %}selected{% endif %}>
+                    {{ department_name }}
                 </option>
             {% endfor %}
         </select>
     </form>
 </div>
 
+{% cache catalog_timeout equipment_cards catalog_generation selected_department search_query %}
 <div class="row">
     {% for equipment in equipments %}
         <div class="col-lg-4 col-md-6 mb-4">
@@ -435,7 +465,9 @@ EQUIPMENT_LIST_TEMPLATE = '''
         <div class="col-12">
             <div class="alert alert-info text-center">
                 <i class="fas fa-info-circle me-2"></i>
-                {% if selected_department %}
+                {% if search_query %}
+                    Không tìm thấy thiết bị nào khớp "{{ search_query }}".
+                {% elif selected_department %}
                     Không có thiết bị nào trong phòng ban này.
                 {% else %}
                     Chưa có thiết bị nào được thêm.
@@ -444,6 +476,37 @@ EQUIPMENT_LIST_TEMPLATE = '''
         </div>
     {% endfor %}
 </div>
+{% endcache %}
+{% endblock %}
+
+{% block extra_js %}
+<script>
+    // Gợi ý mã/tên thiết bị khi gõ
+    (function() {
+        const input = document.getElementById('equipmentSearch');
+        const list = document.getElementById('equipmentSuggestions');
+        let timer = null;
+        input.addEventListener('input', function() {
+            clearTimeout(timer);
+            const query = input.value.trim();
+            if (!query) return;
+            timer = setTimeout(function() {
+                fetch('{% url "autocomplete" %}?source=equipment&q=' + encodeURIComponent(query))
+                    .then(response => response.json())
+                    .then(data => {
+                        list.innerHTML = '';
+                        for (const item of data.results || []) {
+                            const option = document.createElement('option');
+                            option.value = item.name;
+                            option.label = item.code;
+                            list.appendChild(option);
+                        }
+                    })
+                    .catch(error => console.error('Error:', error));
+            }, 150);
+        });
+    })();
+</script>
 {% endblock %}
 '''
 
@@ -3,6 +3,8 @@ Django Lab Management System - Complete Setup
 Hệ thống Quản lý Phòng Lab DNU
 """
 
+import os
+
 # dnu_lab_system/dnu_lab_system/settings.py
 SETTINGS_PY = '''
 import os
@@ -35,6 +37,8 @@ if DEBUG:
     INSTALLED_APPS.append('debug_toolbar')
 
 MIDDLEWARE = [
+    'lab_management.middleware.MetricsMiddleware',
+    'lab_management.middleware.QueryLogMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',  # For i18n
@@ -43,6 +47,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'lab_management.middleware.RateLimitMiddleware',
 ]
 
 if DEBUG:
@@ -68,6 +73,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'dnu_lab_system.wsgi.application'
+# Chạy bằng ASGI (uvicorn dnu_lab_system.asgi:application) để stream chat AI
+ASGI_APPLICATION = 'dnu_lab_system.asgi.application'
 
 # Database
 DATABASE_URL = os.getenv('DATABASE_URL')
@@ -125,6 +132,22 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cache (dùng chung giữa các worker khi có CACHE_URL, ví dụ redis://localhost:6379/1)
+CACHE_URL = os.getenv('CACHE_URL')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Email configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
@@ -133,6 +156,82 @@ EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True').lower() == 'true'
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', '10'))
+# 'celery' hoặc 'local' (hàng đợi trong process, không cần broker)
+NOTIFICATION_BACKEND = os.getenv('NOTIFICATION_BACKEND', 'celery')
+
+# Số đơn tối đa cho một lần duyệt hàng loạt
+BULK_MODERATION_MAX = int(os.getenv('BULK_MODERATION_MAX', '1000'))
+
+# Thời gian giữ cache trang danh sách thiết bị (bị làm mới khi có thay đổi)
+CATALOG_CACHE_TIMEOUT = 3600
+
+# API lịch trống: độ phân giải bitmap và giới hạn mỗi request
+AVAILABILITY_SLOT_MINUTES = 15
+AVAILABILITY_CACHE_TTL = 3600
+AVAILABILITY_MAX_DAYS = 31
+AVAILABILITY_MAX_EQUIPMENT = 500
+
+# Autocomplete trong bộ nhớ: chu kỳ kiểm tra thay đổi từ process khác (qua cache
+# mặc định, nên nhiều worker cần CACHE_URL dùng chung)
+AUTOCOMPLETE_VERSION_CHECK_SECONDS = 5
+
+# Chat AI: số tin mỗi trang lịch sử và dọn dữ liệu cũ (theo lô, có giới hạn thời gian)
+AI_CHAT_HISTORY_PER_PAGE = 20
+AI_CHAT_RETENTION_DAYS = 90
+AI_CHAT_PURGE_BATCH_SIZE = 1000
+AI_CHAT_PURGE_TIME_BUDGET = 30
+# Ngữ cảnh hội thoại: ngân sách token của prompt, số lượt gần nhất giữ nguyên văn,
+# độ dài tóm tắt và số lượt cũ tích lũy trước mỗi lần tóm tắt
+AI_CHAT_PROMPT_TOKENS = 2000
+AI_CHAT_HISTORY_TURNS = 6
+AI_CHAT_SUMMARY_TOKENS = 300
+AI_CHAT_SUMMARY_MIN_TURNS = 4
+AI_CHAT_SUMMARY_MAX_TURNS = 20
+
+# Giới hạn tần suất theo URL name trong lab_management/urls.py: 'số request/khoảng'
+# (s, m, h, d; ví dụ '100/10m'). Bộ đếm nằm trong RATE_LIMIT_CACHE, nên với
+# locmem giới hạn tính riêng cho từng process, với Redis dùng chung.
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+RATE_LIMIT_CACHE = 'default'
+RATE_LIMIT_TRUST_X_FORWARDED_FOR = os.getenv('RATE_LIMIT_TRUST_X_FORWARDED_FOR', 'False').lower() == 'true'
+RATE_LIMITS = {
+    'ai_chat': {'rate': '20/m', 'methods': ['POST'], 'group': 'ai_chat'},
+    'ai_chat_stream': {'rate': '20/m', 'methods': ['POST'], 'group': 'ai_chat'},
+    'create_booking': {'rate': '10/m', 'methods': ['POST']},
+    'bulk_moderate_bookings': {'rate': '30/m', 'methods': ['POST']},
+    'equipment_recommendations': '60/m',
+    'equipment_search': '120/m',
+    'equipment_availability': '120/m',
+    'name_lookup': '300/m',
+    'autocomplete': '600/m',
+}
+
+# Số đo theo view, xuất ở /metrics (Prometheus). Chi tiết (DB, cache, template,
+# AI/SMTP) chỉ ghi cho tỉ lệ METRICS_SAMPLE_RATE request; lab_requests_total luôn đủ.
+# /metrics chỉ mở cho header Authorization: Bearer METRICS_TOKEN (không đặt token thì
+# trả 404 cho mọi request) hoặc cho METRICS_ALLOWED_IPS. Danh sách IP mặc định rỗng:
+# sau reverse proxy cùng máy (nginx) REMOTE_ADDR luôn là 127.0.0.1, nên chỉ thêm IP
+# khi Prometheus gọi thẳng vào app server.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', '1.0'))
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Log query chậm và N+1 (JSON qua logger lab_management, tổng hợp bằng
+# `manage.py query_report`). Query chậm luôn được log; gom fingerprint để tìm
+# N+1 chỉ làm với tỉ lệ QUERY_LOG_SAMPLE_RATE request.
+QUERY_LOG_ENABLED = os.getenv('QUERY_LOG_ENABLED', 'True').lower() == 'true'
+QUERY_LOG_SLOW_MS = int(os.getenv('QUERY_LOG_SLOW_MS', '200'))
+QUERY_LOG_SAMPLE_RATE = float(os.getenv('QUERY_LOG_SAMPLE_RATE', '0.05'))
+QUERY_LOG_N_PLUS_ONE_THRESHOLD = 10
+QUERY_LOG_SQL_CHARS = 500
+
+# Gợi ý thiết bị bằng embedding tính tại chỗ (ma trận float32 memory-mapped)
+RECOMMENDATION_INDEX_DIR = BASE_DIR / 'recommendations'
+RECOMMENDATION_DIM = 512
+# Điểm cosine tối thiểu (thấp hơn thường chỉ là va chạm hash)
+RECOMMENDATION_MIN_SCORE = 0.12
 
 # Authentication
 LOGIN_URL = '/login/'
@@ -141,6 +240,17 @@ LOGOUT_REDIRECT_URL = '/'
 
 # AI Integration
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+# Đặt để trỏ tới server tương thích OpenAI khác (ví dụ fake_llm_server khi test)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+
+# Cache phản hồi AI: 'lru' (trong process), 'django' (Django cache) hoặc 'sqlite' (file)
+AI_CACHE = {
+    'BACKEND': os.getenv('AI_CACHE_BACKEND', 'lru'),
+    'TTL': int(os.getenv('AI_CACHE_TTL', str(7 * 24 * 3600))),
+    'MAX_ENTRIES': int(os.getenv('AI_CACHE_MAX_ENTRIES', '10000')),
+    'PATH': BASE_DIR / 'ai_cache.sqlite3',
+}
 
 # Celery Configuration
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
@@ -203,6 +313,28 @@ if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 '''
 
+# dnu_lab_system/dnu_lab_system/wsgi.py
+WSGI_PY = '''
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dnu_lab_system.settings')
+
+application = get_wsgi_application()
+'''
+
+# dnu_lab_system/dnu_lab_system/asgi.py
+ASGI_PY = '''
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dnu_lab_system.settings')
+
+application = get_asgi_application()
+'''
+
 # dnu_lab_system/lab_management/models.py
 MODELS_PY = '''
 from django.db import models
@@ -277,6 +409,10 @@ class Equipment(models.Model):
         verbose_name = _("Thiết bị")
         verbose_name_plural = _("Thiết bị")
         ordering = ['name']
+        indexes = [
+            # equipment_list: status='available' [+ department]
+            models.Index(fields=['status', 'department'], name='equipment_status_dept_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.code})"
@@ -293,6 +429,21 @@ class Equipment(models.Model):
             return delta.total_seconds() / 3600
         return 0
 
+class BookingQuerySet(models.QuerySet):
+    # Các cột mà template danh sách đơn thực sự dùng
+    LISTING_FIELDS = (
+        'id', 'status', 'pickup_time', 'return_time', 'purpose', 'notes', 'created_at',
+        'user', 'user__username', 'user__first_name', 'user__last_name', 'user__email',
+        'equipment', 'equipment__name', 'equipment__code',
+        'equipment__department', 'equipment__department__name',
+    )
+
+    def for_listing(self):
+        """Nạp user/thiết bị/phòng ban trong cùng một query (tránh N+1)"""
+        return self.select_related(
+            'user', 'equipment', 'equipment__department'
+        ).only(*self.LISTING_FIELDS)
+
 class Booking(models.Model):
     """Model cho đơn đặt lịch"""
     STATUS_CHOICES = [
@@ -302,7 +453,10 @@ class Booking(models.Model):
         ('completed', _('Hoàn thành')),
         ('cancelled', _('Đã hủy')),
     ]
-    
+
+    # Các trạng thái đang giữ chỗ thiết bị (dùng cho kiểm tra xung đột)
+    ACTIVE_STATUSES = ['approved', 'pending']
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name=_("Người dùng"))
     equipment = models.ForeignKey(Equipment, on_delete=models.CASCADE, verbose_name=_("Thiết bị"))
     pickup_time = models.DateTimeField(verbose_name=_("Thời gian nhận"))
@@ -316,11 +470,33 @@ class Booking(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     approved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, 
                                    related_name='approved_bookings', verbose_name=_("Được duyệt bởi"))
+
+    objects = BookingQuerySet.as_manager()
     
     class Meta:
         verbose_name = _("Đơn đặt lịch")
         verbose_name_plural = _("Đơn đặt lịch")
         ordering = ['-created_at']
+        indexes = [
+            # Kiểm tra xung đột: chỉ các đơn đang giữ chỗ
+            models.Index(
+                fields=['equipment', 'pickup_time', 'return_time'],
+                condition=models.Q(status__in=['approved', 'pending']),
+                name='booking_active_slot_idx',
+            ),
+            models.Index(
+                fields=['equipment', 'status', 'pickup_time', 'return_time'],
+                name='booking_equipment_slot_idx',
+            ),
+            # my_bookings (keyset theo created_at, id)
+            models.Index(fields=['user', '-created_at', '-id'], name='booking_user_created_idx'),
+            # pending_bookings, all_bookings?status=...
+            models.Index(fields=['status', '-created_at', '-id'], name='booking_status_created_idx'),
+            # all_bookings
+            models.Index(fields=['-created_at', '-id'], name='booking_created_idx'),
+            # Tính lại rollup theo ngày nhận thiết bị
+            models.Index(fields=['pickup_time'], name='booking_pickup_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.equipment.name} - {self.get_status_display()}"
@@ -332,14 +508,11 @@ class Booking(models.Model):
         return delta.total_seconds() / 3600
     
     def is_conflicting(self):
-        """Kiểm tra xung đột thời gian với các đơn khác"""
-        conflicting_bookings = Booking.objects.filter(
-            equipment=self.equipment,
-            status__in=['approved', 'pending'],
-            pickup_time__lt=self.return_time,
-            return_time__gt=self.pickup_time
-        ).exclude(id=self.id)
-        return conflicting_bookings.exists()
+        """Kiểm tra xung đột thời gian với các đơn khác (qua interval index)"""
+        from .booking_index import booking_index
+        return booking_index.has_conflict(
+            self.equipment_id, self.pickup_time, self.return_time, exclude_id=self.id
+        )
 
 class AIChat(models.Model):
     """Model cho chat AI"""
@@ -352,50 +525,218 @@ class AIChat(models.Model):
         verbose_name = _("Chat AI")
         verbose_name_plural = _("Chat AI")
         ordering = ['-created_at']
+        indexes = [
+            # Lịch sử chat của một người dùng (keyset theo created_at, id)
+            models.Index(fields=['user', '-created_at', '-id'], name='aichat_user_created_idx'),
+            # Dọn dữ liệu cũ theo created_at
+            models.Index(fields=['created_at', 'id'], name='aichat_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.created_at.strftime('%Y-%m-%d %H:%M')}"
+
+class AIChatSummary(models.Model):
+    """Tóm tắt cuốn chiếu các lượt chat cũ của một người dùng"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='ai_chat_summary')
+    summary = models.TextField(blank=True, verbose_name=_("Tóm tắt"))
+    # id AIChat cuối cùng đã được gộp vào tóm tắt
+    covered_until_id = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = _("Tóm tắt chat AI")
+        verbose_name_plural = _("Tóm tắt chat AI")
+    
+    def __str__(self):
+        return f"{self.user.username} (đến #{self.covered_until_id})"
+
+class BookingPatternSnapshot(models.Model):
+    """Kết quả phân tích pattern đặt lịch (tính bằng GROUP BY trên DB)"""
+    period_start = models.DateTimeField(verbose_name=_("Từ"))
+    period_end = models.DateTimeField(verbose_name=_("Đến"))
+    booking_count = models.PositiveIntegerField(default=0, verbose_name=_("Số đơn"))
+    stats = models.JSONField(default=dict, verbose_name=_("Thống kê"))
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _("Phân tích đặt lịch")
+        verbose_name_plural = _("Phân tích đặt lịch")
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.period_start:%d/%m/%Y} - {self.period_end:%d/%m/%Y} ({self.booking_count})"
+
+class DailyEquipmentUsage(models.Model):
+    """Tổng hợp sử dụng theo ngày cho từng thiết bị (ngày = ngày nhận thiết bị)"""
+    date = models.DateField(verbose_name=_("Ngày"))
+    equipment = models.ForeignKey(Equipment, on_delete=models.CASCADE, verbose_name=_("Thiết bị"))
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, verbose_name=_("Phòng ban"))
+    bookings = models.PositiveIntegerField(default=0, verbose_name=_("Số đơn"))
+    approved = models.PositiveIntegerField(default=0, verbose_name=_("Số đơn được duyệt"))
+    hours_booked = models.FloatField(default=0, verbose_name=_("Số giờ sử dụng"))
+    
+    class Meta:
+        verbose_name = _("Sử dụng thiết bị theo ngày")
+        verbose_name_plural = _("Sử dụng thiết bị theo ngày")
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'equipment'], name='daily_equipment_usage_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['department', 'date'], name='daily_equipment_dept_idx'),
+        ]
+    
+    @property
+    def approval_rate(self):
+        return self.approved * 100 / self.bookings if self.bookings else 0
+    
+    @property
+    def utilization(self):
+        """Phần trăm thời gian trong ngày thiết bị được sử dụng (cùng đơn vị với monthly_usage)"""
+        return self.hours_booked * 100 / 24
+
+class DailyDepartmentUsage(models.Model):
+    """Tổng hợp sử dụng theo ngày cho từng phòng ban"""
+    date = models.DateField(verbose_name=_("Ngày"))
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, verbose_name=_("Phòng ban"))
+    bookings = models.PositiveIntegerField(default=0, verbose_name=_("Số đơn"))
+    approved = models.PositiveIntegerField(default=0, verbose_name=_("Số đơn được duyệt"))
+    hours_booked = models.FloatField(default=0, verbose_name=_("Số giờ sử dụng"))
+    equipment_count = models.PositiveIntegerField(default=0, verbose_name=_("Số thiết bị"))
+    
+    class Meta:
+        verbose_name = _("Sử dụng phòng ban theo ngày")
+        verbose_name_plural = _("Sử dụng phòng ban theo ngày")
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'department'], name='daily_department_usage_uniq'),
+        ]
+    
+    @property
+    def approval_rate(self):
+        return self.approved * 100 / self.bookings if self.bookings else 0
+    
+    @property
+    def utilization(self):
+        """Phần trăm (giờ sử dụng / 24 giờ × số thiết bị)"""
+        return self.hours_booked * 100 / (24 * self.equipment_count) if self.equipment_count else 0
+
+class UsageRollupDirtyDay(models.Model):
+    """Ngày có đơn thay đổi, chờ job tính lại rollup"""
+    day = models.DateField(unique=True)
+    marked_at = models.DateTimeField(default=timezone.now)
+
+class SearchTerm(models.Model):
+    """Hậu tố (theo từ) của tên đã bỏ dấu, phục vụ tra cứu theo tiền tố"""
+    KIND_CHOICES = [
+        ('equipment', _('Thiết bị')),
+        ('department', _('Phòng ban')),
+        ('user', _('Người dùng')),
+    ]
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    term = models.CharField(max_length=100)
+    
+    class Meta:
+        indexes = [
+            # Tra cứu tiền tố: kind = ... AND term LIKE 'prefix%' / term >= ... AND term < ...
+            models.Index(
+                fields=['kind', 'term'], name='search_term_prefix_idx',
+                opclasses=['varchar_pattern_ops', 'varchar_pattern_ops'],
+            ),
+            models.Index(fields=['kind', 'object_id'], name='search_term_object_idx'),
+        ]
 '''
 
 # dnu_lab_system/lab_management/views.py
 VIEWS_PY = '''
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.contrib.auth.models import User
 from django.contrib import messages
-from django.core.mail import send_mail
+from django.db import transaction
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
-from .models import Equipment, Booking, Department, UserProfile, AIChat
+from django.utils.dateparse import parse_datetime
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import condition
+from asgiref.sync import sync_to_async
+from .models import Equipment, Booking, Department, AIChat
 from .forms import BookingForm
+from .reservations import reserve_booking, moderate_bookings, BookingConflict, BULK_ACTIONS
+from .pagination import keyset_page
+from .counters import dashboard_counters
+from .notifications import enqueue_booking_notification
+from .rollups import monthly_usage
+from .availability import availability, slot_minutes
+from . import catalog
+from .search import search_equipment
+from . import name_index
+from .autocomplete import autocomplete as autocomplete_index
+from .booking_index import booking_index
+from .recommendations import recommender
+from .metrics import registry as metrics_registry
+from .ai_services import ai_service
+from .ai_streaming import stream_chat_events
+import hmac
 import json
+import logging
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
 
 def home(request):
     """Trang chủ"""
     departments = Department.objects.all()
-    recent_bookings = Booking.objects.filter(status='approved')[:5]
+    recent_bookings = Booking.objects.for_listing().filter(status='approved')[:5]
     context = {
         'departments': departments,
         'recent_bookings': recent_bookings,
     }
     return render(request, 'lab_management/home.html', context)
 
+def catalog_department(request):
+    """Phòng ban đang lọc (None nếu không lọc hoặc tham số sai)"""
+    try:
+        return int(request.GET.get('department') or 0) or None
+    except ValueError:
+        return None
+
+def equipment_list_etag(request):
+    return catalog.etag(request, catalog_department(request))
+
+def equipment_list_last_modified(request):
+    # Chỉ gửi Last-Modified khi cũng có ETag (cùng điều kiện dùng lại trang)
+    if not catalog.reusable(request):
+        return None
+    return catalog.last_modified(catalog_department(request))
+
 @login_required
+@condition(etag_func=equipment_list_etag, last_modified_func=equipment_list_last_modified)
 def equipment_list(request):
-    """Danh sách thiết bị theo phòng ban"""
-    department_id = request.GET.get('department')
-    equipments = Equipment.objects.filter(status='available')
-    
-    if department_id:
-        equipments = equipments.filter(department_id=department_id)
+    """Danh sách thiết bị theo phòng ban (fragment cache + conditional GET)"""
+    department_id = catalog_department(request)
+    search_query = ' '.join(request.GET.get('q', '').split())[:100]
     
-    departments = Department.objects.all()
+    if search_query:
+        equipments = SimpleLazyObject(lambda: search_equipment(search_query, department_id))
+    else:
+        equipments = SimpleLazyObject(lambda: catalog.available_equipment(department_id))
     context = {
+        # Chỉ được đọc khi fragment của phòng ban/từ khóa này chưa có trong cache
         'equipments': equipments,
-        'departments': departments,
-        'selected_department': int(department_id) if department_id else None,
+        'departments': catalog.department_choices(),
+        'selected_department': department_id,
+        'search_query': search_query,
+        'catalog_generation': catalog.generation(),
+        'catalog_timeout': catalog.catalog_timeout(),
     }
-    return render(request, 'lab_management/equipment_list.html', context)
+    response = render(request, 'lab_management/equipment_list.html', context)
+    # Trang có phần riêng theo user: trình duyệt phải hỏi lại (304 nếu ETag khớp)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
 
 @login_required
 def create_booking(request, equipment_id):
@@ -409,14 +750,16 @@ def create_booking(request, equipment_id):
             booking.user = request.user
             booking.equipment = equipment
             
-            # Kiểm tra xung đột thời gian
-            if booking.is_conflicting():
+            # Kiểm tra xung đột và lưu trong cùng một transaction
+            try:
+                reserve_booking(booking)
+            except BookingConflict:
                 messages.error(request, 'Thiết bị đã được đặt trong khoảng thời gian này!')
                 return render(request, 'lab_management/create_booking.html', {
-                    'form': form, 'equipment': equipment
+                    'form': form, 'equipment': equipment,
+                    'alternatives': free_alternatives(equipment, booking),
                 })
             
-            booking.save()
             messages.success(request, 'Đơn đặt lịch đã được gửi thành công!')
             return redirect('my_bookings')
     else:
@@ -427,11 +770,28 @@ def create_booking(request, equipment_id):
         'equipment': equipment
     })
 
+def free_alternatives(equipment, booking, k=3):
+    """Thiết bị tương tự còn trống trong cùng khoảng thời gian"""
+    candidates = recommender.recommend(
+        f'{equipment.name} {equipment.specifications} {booking.purpose}', k=k * 2, exclude_ids=[equipment.id]
+    )
+    busy = booking_index.check_many(
+        (candidate.id, booking.pickup_time, booking.return_time) for candidate in candidates
+    )
+    return [candidate for candidate, is_busy in zip(candidates, busy) if not is_busy][:k]
+
 @login_required
 def my_bookings(request):
     """Danh sách đơn đặt lịch của người dùng"""
-    bookings = Booking.objects.filter(user=request.user)
-    return render(request, 'lab_management/my_bookings.html', {'bookings': bookings})
+    page = keyset_page(
+        Booking.objects.for_listing().filter(user=request.user),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+    return render(request, 'lab_management/my_bookings.html', {
+        'bookings': page.object_list,
+        'page': page,
+    })
 
 def is_teacher(user):
     """Kiểm tra user có phải là giảng viên (staff)"""
@@ -441,16 +801,19 @@ def is_teacher(user):
 @user_passes_test(is_teacher)
 def admin_dashboard(request):
     """Dashboard cho giảng viên"""
-    pending_bookings = Booking.objects.filter(status='pending').count()
-    total_bookings = Booking.objects.count()
-    total_equipment = Equipment.objects.count()
-    total_users = UserProfile.objects.count()
+    counts = dashboard_counters.snapshot()
+    today = timezone.localdate()
     
     context = {
-        'pending_bookings': pending_bookings,
-        'total_bookings': total_bookings,
-        'total_equipment': total_equipment,
-        'total_users': total_users,
+        'pending_bookings': counts['booking:pending'],
+        'total_bookings': counts['booking:total'],
+        'total_equipment': counts['equipment'],
+        'total_users': counts['userprofile'],
+        'booking_counts': counts,
+        # Đọc từ bảng rollup theo ngày, không quét Booking
+        'monthly_usage': monthly_usage(
+            (today - timedelta(days=180)).replace(day=1), today + timedelta(days=1)
+        ),
     }
     return render(request, 'lab_management/admin_dashboard.html', context)
 
@@ -458,49 +821,67 @@ def admin_dashboard(request):
 @user_passes_test(is_teacher)
 def pending_bookings(request):
     """Danh sách đơn chờ duyệt"""
-    bookings = Booking.objects.filter(status='pending').order_by('-created_at')
+    bookings = Booking.objects.for_listing().filter(status='pending').order_by('-created_at')
     return render(request, 'lab_management/pending_bookings.html', {'bookings': bookings})
 
+@login_required
+@user_passes_test(is_teacher)
+def bulk_moderate_bookings(request):
+    """Duyệt/từ chối nhiều đơn chờ duyệt (form hoặc JSON: ids, action, notes)"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Chỉ hỗ trợ POST'}, status=405)
+    
+    is_json = request.content_type == 'application/json'
+    if is_json:
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'JSON không hợp lệ'}, status=400)
+        ids, action, notes = data.get('ids') or [], data.get('action'), data.get('notes') or ''
+    else:
+        ids = request.POST.getlist('ids')
+        action, notes = request.POST.get('action'), request.POST.get('notes', '')
+    
+    try:
+        ids = [int(booking_id) for booking_id in ids]
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Danh sách id không hợp lệ'}, status=400)
+    if action not in BULK_ACTIONS or not ids:
+        return JsonResponse({'error': 'Cần action (approve/reject) và ids'}, status=400)
+    max_batch = getattr(settings, 'BULK_MODERATION_MAX', 1000)
+    if len(ids) > max_batch:
+        return JsonResponse({'error': f'Tối đa {max_batch} đơn mỗi lần'}, status=400)
+    
+    result = moderate_bookings(ids, action, request.user, notes)
+    if is_json:
+        return JsonResponse(result.as_dict())
+    
+    verb = 'phê duyệt' if action == 'approve' else 'từ chối'
+    messages.success(request, f'Đã {verb} {len(result.updated)} đơn đặt lịch!')
+    if result.conflicts:
+        messages.warning(request, f'{len(result.conflicts)} đơn bị trùng lịch nên chưa được duyệt.')
+    return redirect('pending_bookings')
+
 @login_required
 @user_passes_test(is_teacher)
 def approve_booking(request, booking_id):
     """Phê duyệt đơn đặt lịch"""
-    booking = get_object_or_404(Booking, id=booking_id)
+    booking = get_object_or_404(Booking.objects.select_related('user', 'equipment'), id=booking_id)
     
     if request.method == 'POST':
         action = request.POST.get('action')
         notes = request.POST.get('notes', '')
         
         if action == 'approve':
-            booking.status = 'approved'
-            booking.approved_by = request.user
-            booking.notes = notes
-            booking.save()
-            
-            # Gửi email thông báo
-            try:
-                send_mail(
-                    subject=f'Đơn đặt lịch thiết bị {booking.equipment.name} đã được phê duyệt',
-                    message=f'''
-Xin chào {booking.user.get_full_name() or booking.user.username},
-
-Đơn đặt lịch thiết bị của bạn đã được phê duyệt:
-- Thiết bị: {booking.equipment.name}
-- Thời gian nhận: {booking.pickup_time.strftime("%d/%m/%Y %H:%M")}
-- Thời gian trả: {booking.return_time.strftime("%d/%m/%Y %H:%M")}
-- Ghi chú: {notes}
-
-Vui lòng đến đúng giờ để nhận thiết bị.
-
-Trân trọng,
-Hệ thống Quản lý Phòng Lab DNU
-                    ''',
-                    from_email=settings.EMAIL_HOST_USER,
-                    recipient_list=[booking.user.email],
-                    fail_silently=True,
-                )
-            except Exception as e:
-                print(f"Email sending failed: {e}")
+            with transaction.atomic():
+                booking.status = 'approved'
+                booking.approved_by = request.user
+                booking.notes = notes
+                booking.save()
+                # Gửi email sau khi commit, không chờ SMTP trong request
+                enqueue_booking_notification(booking.id, 'approved')
             
             messages.success(request, 'Đơn đặt lịch đã được phê duyệt!')
             
@@ -519,28 +900,298 @@ Hệ thống Quản lý Phòng Lab DNU
 def all_bookings(request):
     """Tất cả đơn đặt lịch"""
     status_filter = request.GET.get('status', '')
-    bookings = Booking.objects.all().order_by('-created_at')
+    bookings = Booking.objects.for_listing()
     
     if status_filter:
         bookings = bookings.filter(status=status_filter)
     
+    page = keyset_page(
+        bookings,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
     context = {
-        'bookings': bookings,
+        'bookings': page.object_list,
+        'page': page,
         'status_filter': status_filter,
         'status_choices': Booking.STATUS_CHOICES,
     }
     return render(request, 'lab_management/all_bookings.html', context)
 
+def parse_window_bound(value):
+    """Chuỗi ISO -> datetime có múi giờ (None nếu không truyền)"""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+@login_required
+def equipment_search(request):
+    """Tìm thiết bị (JSON): ?q=<từ khóa>&department=<id>&limit=<n>"""
+    query = ' '.join(request.GET.get('q', '').split())[:100]
+    if not query:
+        return JsonResponse({'error': 'Cần tham số q'}, status=400)
+    try:
+        limit = min(int(request.GET.get('limit', 20)), 100)
+    except ValueError:
+        return JsonResponse({'error': 'limit không hợp lệ'}, status=400)
+    
+    results = search_equipment(query, catalog_department(request), limit=limit)
+    return JsonResponse({
+        'query': query,
+        'results': [
+            {
+                'id': equipment.id,
+                'name': equipment.name,
+                'code': equipment.code,
+                'department': equipment.department.name,
+            }
+            for equipment in results
+        ],
+    })
+
+@login_required
+def name_lookup(request):
+    """
+    Tra cứu theo tiền tố tên, không phân biệt dấu (JSON):
+    ?q=<tiền tố>&kind=equipment|department|user&limit=<n>. kind=user chỉ cho giảng viên.
+    """
+    kind = request.GET.get('kind', 'equipment')
+    if kind not in name_index.SOURCES:
+        return JsonResponse({'error': 'kind không hợp lệ'}, status=400)
+    if kind == 'user' and not is_teacher(request.user):
+        return JsonResponse({'error': 'Không có quyền'}, status=403)
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 50)
+    except ValueError:
+        return JsonResponse({'error': 'limit không hợp lệ'}, status=400)
+    
+    ids = name_index.lookup_ids(kind, request.GET.get('q', ''), limit)
+    if kind == 'equipment':
+        objects = Equipment.objects.only('id', 'name', 'code').in_bulk(ids)
+        results = [{'id': pk, 'name': objects[pk].name, 'code': objects[pk].code} for pk in ids if pk in objects]
+    elif kind == 'department':
+        objects = Department.objects.only('id', 'name', 'code').in_bulk(ids)
+        results = [{'id': pk, 'name': objects[pk].name, 'code': objects[pk].code} for pk in ids if pk in objects]
+    else:
+        objects = User.objects.select_related('userprofile').in_bulk(ids)
+        results = [
+            {
+                'id': pk,
+                'name': objects[pk].get_full_name() or objects[pk].username,
+                'username': objects[pk].username,
+                'student_id': getattr(getattr(objects[pk], 'userprofile', None), 'student_id', ''),
+            }
+            for pk in ids if pk in objects
+        ]
+    return JsonResponse({'kind': kind, 'results': results})
+
+@login_required
+def autocomplete(request):
+    """
+    Gợi ý khi gõ (JSON, từ index trong bộ nhớ):
+    ?q=<tiền tố>&source=equipment|student&limit=<n>. source=student chỉ cho giảng viên.
+    """
+    source = request.GET.get('source', 'equipment')
+    if source not in ('equipment', 'student'):
+        return JsonResponse({'error': 'source không hợp lệ'}, status=400)
+    if source == 'student' and not is_teacher(request.user):
+        return JsonResponse({'error': 'Không có quyền'}, status=403)
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 50)
+    except ValueError:
+        return JsonResponse({'error': 'limit không hợp lệ'}, status=400)
+    
+    results = autocomplete_index.search(source, request.GET.get('q', '')[:100], limit)
+    response = JsonResponse({'source': source, 'results': results})
+    patch_cache_control(response, private=True, max_age=30)
+    return response
+
+@login_required
+def equipment_recommendations(request):
+    """Thiết bị phù hợp với mục đích/câu hỏi (JSON): ?q=<văn bản>&k=<n>&all=1 (kể cả thiết bị không có sẵn)"""
+    text = request.GET.get('q', '').strip()[:1000]
+    if not text:
+        return JsonResponse({'error': 'Cần tham số q'}, status=400)
+    try:
+        k = min(int(request.GET.get('k', 5)), 20)
+    except ValueError:
+        return JsonResponse({'error': 'k không hợp lệ'}, status=400)
+    
+    results = recommender.recommend(text, k=k, available_only=not request.GET.get('all'))
+    return JsonResponse({
+        'query': text,
+        'results': [
+            {
+                'id': equipment.id,
+                'name': equipment.name,
+                'code': equipment.code,
+                'department': equipment.department.name,
+                'status': equipment.status,
+                'score': round(equipment.similarity, 4),
+            }
+            for equipment in results
+        ],
+    })
+
+def metrics(request):
+    """Số đo Prometheus; chỉ cho METRICS_ALLOWED_IPS hoặc Bearer METRICS_TOKEN, còn lại 404"""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    allowed = request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', [])
+    if token and authorization.startswith('Bearer '):
+        allowed = hmac.compare_digest(authorization[7:].encode(), token.encode())
+    if not allowed or not getattr(settings, 'METRICS_ENABLED', True):
+        raise Http404
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@login_required
+def equipment_availability(request):
+    """
+    Lịch trống theo bitmap (JSON).
+
+    ?equipment=<id> hoặc ?department=<id> (có thể thêm ?q=<tên>), khoảng ngày
+    ?start=YYYY-MM-DD&days=N. Thêm ?from=<ISO>&to=<ISO> để biết thiết bị nào
+    trống trong khoảng đó (?only_free=1 để chỉ trả về thiết bị trống).
+    """
+    equipment_qs = Equipment.objects.only('id', 'name', 'code', 'status').order_by('name', 'id')
+    try:
+        if request.GET.get('equipment'):
+            equipment_qs = equipment_qs.filter(id=int(request.GET['equipment']))
+        elif request.GET.get('department'):
+            equipment_qs = equipment_qs.filter(department_id=int(request.GET['department']))
+        else:
+            return JsonResponse({'error': 'Cần tham số equipment hoặc department'}, status=400)
+    except ValueError:
+        return JsonResponse({'error': 'equipment/department phải là số'}, status=400)
+    if request.GET.get('q'):
+        # Lọc tên trong cùng query với phòng ban; giới hạn số thiết bị áp dụng sau cùng
+        equipment_qs = equipment_qs.filter(id__in=name_index.matching_ids('equipment', request.GET['q']))
+    
+    try:
+        window_start, window_end = (
+            parse_window_bound(request.GET.get('from')), parse_window_bound(request.GET.get('to'))
+        )
+        if request.GET.get('start'):
+            first_day = date.fromisoformat(request.GET['start'])
+        elif window_start:
+            first_day = timezone.localtime(window_start).date()
+        else:
+            first_day = timezone.localdate()
+        day_count = int(request.GET.get('days', 1))
+    except (ValueError, TypeError):
+        return JsonResponse({'error': 'Tham số thời gian không hợp lệ'}, status=400)
+    if bool(window_start) != bool(window_end) or (window_start and window_end <= window_start):
+        return JsonResponse({'error': 'Cần cả from và to, với to > from'}, status=400)
+    max_days = getattr(settings, 'AVAILABILITY_MAX_DAYS', 31)
+    if not 1 <= day_count <= max_days:
+        return JsonResponse({'error': f'days phải từ 1 đến {max_days}'}, status=400)
+    
+    equipment = list(equipment_qs[:getattr(settings, 'AVAILABILITY_MAX_EQUIPMENT', 500)])
+    days = [first_day + timedelta(days=i) for i in range(day_count)]
+    bitmaps = availability.bitmaps([item.id for item in equipment], days)
+    free = None
+    if window_start:
+        free = set(availability.free_equipment(
+            [item.id for item in equipment if item.status == 'available'], window_start, window_end
+        ))
+    
+    results = []
+    for item in equipment:
+        entry = {
+            'id': item.id,
+            'name': item.name,
+            'code': item.code,
+            'status': item.status,
+            'busy': {
+                day.isoformat(): availability.busy_ranges(bitmaps[(item.id, day)], day)
+                for day in days
+            },
+        }
+        if free is not None:
+            entry['free'] = item.id in free
+            if request.GET.get('only_free') and not entry['free']:
+                continue
+        results.append(entry)
+    
+    return JsonResponse({
+        'slot_minutes': slot_minutes(),
+        'start': first_day.isoformat(),
+        'days': day_count,
+        'equipment': results,
+    })
+
+@login_required
+def ai_chat_history(request):
+    """Lịch sử chat của người dùng (JSON, keyset): ?after=<cursor> hoặc ?before=<cursor>"""
+    page = keyset_page(
+        AIChat.objects.filter(user=request.user).only('id', 'message', 'response', 'created_at'),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        per_page=getattr(settings, 'AI_CHAT_HISTORY_PER_PAGE', 20),
+    )
+    return JsonResponse({
+        'chats': [
+            {
+                'id': chat.id,
+                'message': chat.message,
+                'response': chat.response,
+                'created_at': chat.created_at.isoformat(),
+            }
+            for chat in page
+        ],
+        'next': page.next_cursor,
+        'previous': page.prev_cursor,
+    })
+
+def parse_chat_message(request):
+    """Lấy tin nhắn từ body JSON hoặc form"""
+    if request.content_type == 'application/json':
+        try:
+            return (json.loads(request.body or b'{}').get('message') or '').strip()
+        except (ValueError, AttributeError):
+            return ''
+    return (request.POST.get('message') or '').strip()
+
 @login_required
 def ai_chat(request):
     """Chat AI"""
     if request.method == 'POST':
-        message = request.POST.get('message')
-        response = "AI response here"  # Placeholder for AI response
+        message = parse_chat_message(request)
+        if not message:
+            return JsonResponse({'error': 'Tin nhắn trống'}, status=400)
+        try:
+            response = ai_service.chat_assistant(message, request.user)
+        except Exception as e:
+            logger.error(f"AI chat failed for user {request.user.id}: {e}")
+            return JsonResponse({'error': 'AI service unavailable'}, status=503)
         ai_chat = AIChat.objects.create(user=request.user, message=message, response=response)
         return JsonResponse({'response': response})
     
     return render(request, 'lab_management/ai_chat.html')
+
+async def ai_chat_stream(request):
+    """Chat AI dạng stream (Server-Sent Events), chạy async để không giữ worker"""
+    user = await sync_to_async(
+        lambda: request.user if request.user.is_authenticated else None
+    )()
+    if user is None:
+        return JsonResponse({'error': 'Vui lòng đăng nhập'}, status=401)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Chỉ hỗ trợ POST'}, status=405)
+    
+    message = parse_chat_message(request)
+    if not message:
+        return JsonResponse({'error': 'Tin nhắn trống'}, status=400)
+    
+    response = StreamingHttpResponse(
+        stream_chat_events(user, message), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Tắt buffer của nginx
+    return response
 '''
 
 # dnu_lab_system/lab_management/forms.py
@@ -596,11 +1247,20 @@ urlpatterns = [
     path('booking/create/<int:equipment_id>/', views.create_booking, name='create_booking'),
     path('my-bookings/', views.my_bookings, name='my_bookings'),
     path('ai-chat/', views.ai_chat, name='ai_chat'),
+    path('ai-chat/stream/', views.ai_chat_stream, name='ai_chat_stream'),
+    path('ai-chat/history/', views.ai_chat_history, name='ai_chat_history'),
+    path('api/availability/', views.equipment_availability, name='equipment_availability'),
+    path('api/equipment/search/', views.equipment_search, name='equipment_search'),
+    path('api/lookup/', views.name_lookup, name='name_lookup'),
+    path('api/autocomplete/', views.autocomplete, name='autocomplete'),
+    path('api/equipment/recommend/', views.equipment_recommendations, name='equipment_recommendations'),
+    path('metrics', views.metrics, name='metrics'),
     
     # Admin URLs
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
     path('pending-bookings/', views.pending_bookings, name='pending_bookings'),
     path('approve-booking/<int:booking_id>/', views.approve_booking, name='approve_booking'),
+    path('pending-bookings/bulk/', views.bulk_moderate_bookings, name='bulk_moderate_bookings'),
     path('all-bookings/', views.all_bookings, name='all_bookings'),
 ]
 '''
@@ -608,48 +1268,5028 @@ urlpatterns = [
 # dnu_lab_system/lab_management/admin.py
 ADMIN_PY = '''
 from django.contrib import admin
-from .models import Department, Equipment, Booking, UserProfile, AIChat
+from .models import Department, Equipment, Booking, UserProfile, AIChat, AIChatSummary, BookingPatternSnapshot
 
 admin.site.register(Department)
 admin.site.register(Equipment)
 admin.site.register(Booking)
 admin.site.register(UserProfile)
 admin.site.register(AIChat)
+admin.site.register(AIChatSummary)
+admin.site.register(BookingPatternSnapshot)
 '''
 
 # dnu_lab_system/lab_management/ai_services.py
 AI_SERVICES_PY = '''
-import openai
+import logging
+
 from django.conf import settings
+from openai import OpenAI
+
+from .ai_cache import ai_cache
+from .metrics import track_external
+
+logger = logging.getLogger(__name__)
+
+# Tăng phiên bản khi sửa prompt để không dùng lại kết quả cache cũ
+PROMPT_VERSIONS = {
+    'equipment_description': 1,
+    'usage_tips': 1,
+    'risk_assessment': 1,
+    'chat': 3,
+    'chat_summary': 1,
+    'maintenance_advice': 1,
+}
+
+SYSTEM_PROMPT = (
+    "Bạn là trợ lý AI của hệ thống quản lý phòng lab Đại học Đại Nam (DNU). "
+    "Trả lời ngắn gọn, chính xác bằng tiếng Việt."
+)
+
+
+def build_messages(prompt):
+    return [
+        {'role': 'system', 'content': SYSTEM_PROMPT},
+        {'role': 'user', 'content': prompt},
+    ]
+
+
+# Prompt builders dùng chung cho client đồng bộ và engine async (ai_batch.py)
+def equipment_description_prompt(equipment_name, specifications=''):
+    return (
+        f"Viết mô tả ngắn (3-4 câu) cho thiết bị phòng lab: {equipment_name}.\\n"
+        f"Thông số kỹ thuật: {specifications or 'không có'}"
+    )
+
+
+def usage_tips_prompt(equipment_name, description=''):
+    return (
+        f"Liệt kê 3-5 mẹo sử dụng an toàn và hiệu quả cho thiết bị: {equipment_name}.\\n"
+        f"Mô tả: {description or 'không có'}"
+    )
+
+
+def maintenance_advice_prompt(equipment_name):
+    return (
+        f"Tạo lời khuyên bảo trì định kỳ cho loại thiết bị {equipment_name}: "
+        f"các hạng mục cần kiểm tra và dấu hiệu cần sửa chữa."
+    )
+
+
+def risk_assessment_prompt(booking_purpose, equipment_name=''):
+    return (
+        f"Đánh giá rủi ro khi mượn thiết bị {equipment_name} với mục đích: "
+        f"{booking_purpose}. Nêu mức rủi ro (thấp/trung bình/cao) và lý do."
+    )
 
-openai.api_key = settings.OPENAI_API_KEY
 
-def generate_ai_description(equipment_name):
-    """Generate AI description for equipment"""
-    response = openai.Completion.create(
-        engine="text-davinci-003",
-        prompt=f"Write a description for the equipment: {equipment_name}",
-        max_tokens=150
+def chat_prompt(message, related_equipment=()):
+    """Câu hỏi kèm các thiết bị liên quan tìm được trong danh mục"""
+    if not related_equipment:
+        return message
+    catalog = '\\n'.join(
+        f"- {equipment.name} ({equipment.code}), {equipment.department.name}: {equipment.get_status_display()}"
+        for equipment in related_equipment
     )
-    return response.choices[0].text.strip()
+    return f"Thiết bị liên quan trong phòng lab:\\n{catalog}\\n\\nCâu hỏi: {message}"
 
-def generate_usage_tips(equipment_name):
-    """Generate usage tips for equipment"""
-    response = openai.Completion.create(
-        engine="text-davinci-003",
-        prompt=f"Provide usage tips for the equipment: {equipment_name}",
-        max_tokens=100
+
+def conversation_summary_prompt(previous_summary, turns, max_words):
+    """turns: [(câu hỏi, trả lời)] theo thứ tự thời gian"""
+    dialogue = '\\n'.join(f"Người dùng: {message}\\nTrợ lý: {response}" for message, response in turns)
+    return (
+        f"Tóm tắt hội thoại sau trong tối đa {max_words} từ, giữ lại thiết bị, "
+        f"thời gian và yêu cầu quan trọng của người dùng.\\n"
+        f"Tóm tắt trước đó: {previous_summary or 'không có'}\\n"
+        f"Các lượt mới:\\n{dialogue}"
     )
-    return response.choices[0].text.strip()
 
-def generate_risk_assessment(booking_purpose):
-    """Generate risk assessment for booking purpose"""
-    response = openai.Completion.create(
-        engine="text-davinci-003",
-        prompt=f"Assess the risk for the booking purpose: {booking_purpose}",
-        max_tokens=100
+
+def smart_email_prompt(booking, status_change):
+    return (
+        f"Viết email thông báo cho {booking.user.get_full_name() or booking.user.username} "
+        f"rằng đơn đặt thiết bị {booking.equipment.name} "
+        f"({booking.pickup_time:%d/%m/%Y %H:%M} - {booking.return_time:%d/%m/%Y %H:%M}) "
+        f"có trạng thái mới: {status_change}. Ghi chú: {booking.notes or 'không có'}"
     )
-    return response.choices[0].text.strip()
+
+
+class AIService:
+    \"\"\"Client OpenAI đồng bộ dùng cho views và Celery tasks\"\"\"
+
+    def __init__(self):
+        self._client = None
+
+    @property
+    def model(self):
+        return getattr(settings, 'OPENAI_MODEL', 'gpt-3.5-turbo')
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = OpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                base_url=getattr(settings, 'OPENAI_BASE_URL', None),
+            )
+        return self._client
+
+    def complete(self, prompt, max_tokens=300):
+        """prompt: chuỗi (kèm system prompt mặc định) hoặc danh sách messages"""
+        with track_external('ai'):
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=prompt if isinstance(prompt, list) else build_messages(prompt),
+                max_tokens=max_tokens,
+            )
+        return response.choices[0].message.content.strip()
+
+    def cache_key(self, kind, *inputs):
+        return ai_cache.make_key(self.model, kind, PROMPT_VERSIONS[kind], *inputs)
+
+    def cached_complete(self, kind, inputs, prompt, max_tokens):
+        """Gọi LLM qua response cache, key theo (model, phiên bản prompt, input)"""
+        key = self.cache_key(kind, *inputs)
+        text = ai_cache.get(key, kind)
+        if text is None:
+            text = self.complete(prompt, max_tokens)
+            ai_cache.set(key, text)
+        return text
+
+    def generate_equipment_description(self, equipment_name, specifications=''):
+        \"\"\"Generate AI description for equipment\"\"\"
+        return self.cached_complete(
+            'equipment_description', (equipment_name, specifications),
+            equipment_description_prompt(equipment_name, specifications), 250,
+        )
+
+    def generate_usage_tips(self, equipment_name, description=''):
+        \"\"\"Generate usage tips for equipment\"\"\"
+        return self.cached_complete(
+            'usage_tips', (equipment_name, description),
+            usage_tips_prompt(equipment_name, description), 250,
+        )
+
+    def generate_risk_assessment(self, booking_purpose, equipment_name=''):
+        \"\"\"Generate risk assessment for booking purpose\"\"\"
+        return self.cached_complete(
+            'risk_assessment', (booking_purpose, equipment_name),
+            risk_assessment_prompt(booking_purpose, equipment_name), 200,
+        )
+
+    def generate_maintenance_advice(self, equipment_name):
+        """Lời khuyên bảo trì theo loại thiết bị (dùng chung cho các máy cùng tên)"""
+        return self.cached_complete(
+            'maintenance_advice', (equipment_name,),
+            maintenance_advice_prompt(equipment_name), 300,
+        )
+
+    def chat_request(self, message, user=None):
+        """
+        (input cho cache key, prompt) của một câu hỏi, kèm thiết bị liên quan từ
+        recommender. Có `user` thì prompt là danh sách messages gồm tóm tắt và
+        các lượt gần nhất trong ngân sách token.
+        """
+        from .recommendations import recommender
+        related = recommender.recommend(message, k=3, available_only=False)
+        inputs = (message, *(f'{equipment.code}:{equipment.status}' for equipment in related))
+        prompt = chat_prompt(message, related)
+        if user is None:
+            return inputs, prompt
+
+        from .chat_context import build_chat_context, schedule_summary
+        context = build_chat_context(user, prompt, SYSTEM_PROMPT)
+        if context.needs_summary:
+            schedule_summary(user.id)
+        return (*inputs, user.id, *context.fingerprint), context.messages
+
+    def chat_assistant(self, message, user=None):
+        """Trả lời câu hỏi của người dùng (kèm ngữ cảnh hội thoại nếu có user)"""
+        inputs, prompt = self.chat_request(message, user)
+        return self.cached_complete('chat', inputs, prompt, 500)
+
+    def summarize_conversation(self, previous_summary, turns, max_tokens=300):
+        """Gộp các lượt chat mới vào bản tóm tắt trước đó"""
+        return self.complete(
+            conversation_summary_prompt(previous_summary, turns, int(max_tokens / 1.5)), max_tokens
+        )
+
+    def generate_smart_email(self, booking, status_change):
+        \"\"\"Soạn nội dung email thông báo trạng thái đơn\"\"\"
+        return self.complete(smart_email_prompt(booking, status_change), 400)
+
+
+ai_service = AIService()
+'''
+
+# dnu_lab_system/lab_management/booking_index.py
+BOOKING_INDEX_PY = '''
+"""
+Interval index cho kiểm tra xung đột đặt lịch.
+
+Mỗi thiết bị giữ các khoảng (pickup_time, return_time) của đơn
+approved/pending trong một treap sắp theo (pickup_time, booking_id); mỗi nút
+giữ hai return_time lớn nhất của cây con. Truy vấn chồng lấn chỉ đi một nhánh
+từ gốc (O(log n)), kể cả khi loại trừ một đơn, thay vì một query DB mỗi lần
+kiểm tra; thêm/xóa đơn cũng O(log n) nhờ map booking_id -> khoảng.
+
+Index nằm trong bộ nhớ của từng process. Mỗi thay đổi tăng một số phiên bản
+trong Django cache; process nào thấy phiên bản khác với bản đã nạp sẽ nạp lại
+thiết bị đó từ DB (cold -> DB fallback).
+"""
+import random
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_KEY = 'booking_index:v:{}'
+
+
+class IntervalNode:
+    """Nút treap theo (pickup_time, booking_id), giữ 2 return_time lớn nhất của cây con"""
+
+    __slots__ = ('key', 'end', 'priority', 'left', 'right', 'top')
+
+    def __init__(self, key, end, priority=None):
+        self.key = key
+        self.end = end
+        self.priority = random.random() if priority is None else priority
+        self.left = self.right = None
+        self.top = ((end, key[1]),)
+
+    def update(self):
+        # Giữ 2 giá trị để loại được exclude_id mà vẫn còn khoảng dài nhất khác
+        top = [(self.end, self.key[1])]
+        if self.left:
+            top.extend(self.left.top)
+        if self.right:
+            top.extend(self.right.top)
+        self.top = tuple(sorted(top, reverse=True)[:2])
+
+
+def split(node, key):
+    """(các nút có key < key, các nút còn lại)"""
+    if node is None:
+        return None, None
+    if node.key < key:
+        node.right, right = split(node.right, key)
+        node.update()
+        return node, right
+    left, node.left = split(node.left, key)
+    node.update()
+    return left, node
+
+
+def merge(left, right):
+    """Nối hai treap, mọi key bên trái nhỏ hơn bên phải"""
+    if left is None or right is None:
+        return left or right
+    if left.priority > right.priority:
+        left.right = merge(left.right, right)
+        left.update()
+        return left
+    right.left = merge(left, right.left)
+    right.update()
+    return right
+
+
+def build(items):
+    """Treap cân bằng từ [(key, end)] đã sắp xếp, O(n)"""
+    nodes = [IntervalNode(key, end, 0.0) for key, end in items]
+
+    def subtree(lo, hi):
+        if lo >= hi:
+            return None, 0
+        mid = (lo + hi) // 2
+        node = nodes[mid]
+        node.left, left_depth = subtree(lo, mid)
+        node.right, right_depth = subtree(mid + 1, hi)
+        node.update()
+        return node, max(left_depth, right_depth) + 1
+
+    root, _ = subtree(0, len(nodes))
+    # Độ ưu tiên giảm dần theo từng tầng để giữ tính chất heap cho các lần chèn sau
+    level, priorities = [root] if root else [], sorted((random.random() for _ in nodes), reverse=True)
+    index = 0
+    while level:
+        next_level = []
+        for node in level:
+            node.priority = priorities[index]
+            index += 1
+            next_level.extend(child for child in (node.left, node.right) if child)
+        level = next_level
+    return root
+
+
+class EquipmentIntervals:
+    """Các khoảng đặt lịch đang giữ chỗ của một thiết bị"""
+
+    __slots__ = ('root', 'bookings', 'version')
+
+    def __init__(self, rows=(), version=None):
+        # bookings: booking_id -> (pickup_time, return_time), để xóa theo key trong O(log n)
+        self.bookings = {booking_id: (start, end) for booking_id, start, end in rows}
+        self.root = build(sorted(
+            ((start, booking_id), end) for booking_id, (start, end) in self.bookings.items()
+        ))
+        self.version = version
+
+    def add(self, booking_id, start, end):
+        self.remove(booking_id)
+        self.bookings[booking_id] = (start, end)
+        key = (start, booking_id)
+        left, right = split(self.root, key)
+        self.root = merge(merge(left, IntervalNode(key, end)), right)
+
+    def remove(self, booking_id):
+        if booking_id not in self.bookings:
+            return False
+        start, _ = self.bookings.pop(booking_id)
+        left, rest = split(self.root, (start, booking_id))
+        _, right = split(rest, (start, booking_id + 1))
+        self.root = merge(left, right)
+        return True
+
+    def overlaps(self, start, end, exclude_id=None):
+        """Có khoảng nào giao với [start, end) không"""
+        # Đi một nhánh từ gốc: gom top của mọi cây con có pickup_time < end
+        top, node = [], self.root
+        while node is not None:
+            if node.key[0] < end:
+                top.append((node.end, node.key[1]))
+                if node.left:
+                    top.extend(node.left.top)
+                node = node.right
+            else:
+                node = node.left
+        return any(entry_end > start for entry_end, booking_id in top if booking_id != exclude_id)
+
+    def __len__(self):
+        return len(self.bookings)
+
+
+class BookingIntervalIndex:
+    """Index xung đột theo từng thiết bị, cập nhật dần qua signals"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._equipment = {}
+        self._booking_equipment = {}
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'BOOKING_INDEX_ENABLED', True)
+
+    # ---- nạp dữ liệu -------------------------------------------------
+
+    def _active_rows(self, equipment_ids):
+        from .models import Booking
+        return Booking.objects.filter(
+            equipment_id__in=equipment_ids,
+            status__in=Booking.ACTIVE_STATUSES,
+        ).values_list('equipment_id', 'id', 'pickup_time', 'return_time')
+
+    def _ensure_loaded(self, equipment_ids):
+        """Trả về {equipment_id: EquipmentIntervals}, nạp lại thiết bị cold/stale"""
+        equipment_ids = set(equipment_ids)
+        versions = cache.get_many([VERSION_KEY.format(eid) for eid in equipment_ids])
+        with self._lock:
+            stale = {
+                eid for eid in equipment_ids
+                if eid not in self._equipment
+                or self._equipment[eid].version != versions.get(VERSION_KEY.format(eid))
+            }
+        if stale:
+            rows = {eid: [] for eid in stale}
+            for equipment_id, booking_id, start, end in self._active_rows(stale):
+                rows[equipment_id].append((booking_id, start, end))
+            with self._lock:
+                for eid, equipment_rows in rows.items():
+                    for booking_id, _, _ in equipment_rows:
+                        self._booking_equipment[booking_id] = eid
+                    self._equipment[eid] = EquipmentIntervals(
+                        equipment_rows, versions.get(VERSION_KEY.format(eid))
+                    )
+        with self._lock:
+            return {eid: self._equipment[eid] for eid in equipment_ids}
+
+    # ---- truy vấn ----------------------------------------------------
+
+    def has_conflict(self, equipment_id, start, end, exclude_id=None):
+        """Kiểm tra một khoảng thời gian cho một thiết bị"""
+        if not self.enabled:
+            return self.db_has_conflict(equipment_id, start, end, exclude_id)
+        intervals = self._ensure_loaded([equipment_id])[equipment_id]
+        with self._lock:
+            return intervals.overlaps(start, end, exclude_id)
+
+    def check_many(self, slots):
+        """
+        Kiểm tra hàng loạt.
+
+        slots: iterable (equipment_id, start, end) hoặc
+        (equipment_id, start, end, exclude_id). Trả về list bool theo thứ tự.
+        Thiết bị cold được nạp bằng một query duy nhất.
+        """
+        slots = [tuple(slot) + (None,) * (4 - len(slot)) for slot in slots]
+        if not slots:
+            return []
+        if not self.enabled:
+            return [self.db_has_conflict(*slot) for slot in slots]
+        loaded = self._ensure_loaded(slot[0] for slot in slots)
+        with self._lock:
+            return [
+                loaded[eid].overlaps(start, end, exclude_id)
+                for eid, start, end, exclude_id in slots
+            ]
+
+    def find_free(self, equipment_id, candidate_slots):
+        """Lọc các slot (start, end) còn trống của một thiết bị"""
+        candidate_slots = list(candidate_slots)
+        conflicts = self.check_many((equipment_id, start, end) for start, end in candidate_slots)
+        return [slot for slot, busy in zip(candidate_slots, conflicts) if not busy]
+
+    def db_has_conflict(self, equipment_id, start, end, exclude_id=None):
+        from .models import Booking
+        return Booking.objects.filter(
+            equipment_id=equipment_id,
+            status__in=Booking.ACTIVE_STATUSES,
+            pickup_time__lt=end,
+            return_time__gt=start,
+        ).exclude(id=exclude_id).exists()
+
+    # ---- cập nhật dần --------------------------------------------------
+
+    def _bump_version(self, equipment_id):
+        key = VERSION_KEY.format(equipment_id)
+        cache.add(key, 0, timeout=None)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+            return 1
+
+    def update_booking(self, booking_id, equipment_id, start, end, status):
+        """Đồng bộ index sau khi đơn được lưu/đổi trạng thái"""
+        from .models import Booking
+        old_equipment_id = self._booking_equipment.get(booking_id)
+        touched = {equipment_id} | ({old_equipment_id} - {None})
+        versions = {eid: self._bump_version(eid) for eid in touched}
+        with self._lock:
+            if old_equipment_id in self._equipment:
+                self._equipment[old_equipment_id].remove(booking_id)
+            self._booking_equipment.pop(booking_id, None)
+            if status in Booking.ACTIVE_STATUSES:
+                self._booking_equipment[booking_id] = equipment_id
+                if equipment_id in self._equipment:
+                    self._equipment[equipment_id].add(booking_id, start, end)
+            for eid, version in versions.items():
+                # Chỉ cập nhật phiên bản nếu bản local đang đồng bộ trước đó
+                if eid in self._equipment and self._equipment[eid].version == version - 1:
+                    self._equipment[eid].version = version
+                elif eid in self._equipment:
+                    del self._equipment[eid]
+
+    def remove_booking(self, booking_id, equipment_id):
+        """Xóa đơn khỏi index sau khi bị xóa khỏi DB"""
+        version = self._bump_version(equipment_id)
+        with self._lock:
+            self._booking_equipment.pop(booking_id, None)
+            intervals = self._equipment.get(equipment_id)
+            if intervals is None:
+                return
+            intervals.remove(booking_id)
+            if intervals.version == version - 1:
+                intervals.version = version
+            else:
+                del self._equipment[equipment_id]
+
+    def invalidate(self, equipment_ids):
+        """Bỏ index của các thiết bị (sau update hàng loạt không qua signals)"""
+        for equipment_id in set(equipment_ids):
+            self._bump_version(equipment_id)
+        with self._lock:
+            for equipment_id in set(equipment_ids):
+                self._equipment.pop(equipment_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._equipment.clear()
+            self._booking_equipment.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'equipment': len(self._equipment),
+                'intervals': sum(len(i) for i in self._equipment.values()),
+            }
+
+
+booking_index = BookingIntervalIndex()
+'''
+
+# dnu_lab_system/lab_management/signals.py
+SIGNALS_PY = '''
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Booking, Department, Equipment, UserProfile
+from .autocomplete import autocomplete
+from .booking_index import booking_index
+from .catalog import bump_generation
+from .counters import dashboard_counters
+from .name_index import KIND_BY_MODEL, index_instance, indexed_values, remove_instance
+from .recommendations import EMBEDDED_FIELDS, recommender
+from .rollups import local_day, mark_dirty
+
+
+@receiver(post_init, sender=Booking)
+def booking_loaded(sender, instance, **kwargs):
+    """Ghi nhớ trạng thái lúc nạp để biết đơn chuyển từ trạng thái nào"""
+    # Không truy cập field bị defer (sẽ sinh thêm query)
+    instance._loaded_status = instance.__dict__.get('status')
+    instance._loaded_pickup = instance.__dict__.get('pickup_time')
+
+
+@receiver(post_save, sender=Booking)
+def booking_saved(sender, instance, created, **kwargs):
+    """Cập nhật interval index, bộ đếm và rollup khi đơn được tạo/đổi trạng thái"""
+    old_status = None if created else instance._loaded_status
+    new_status = instance.status
+    instance._loaded_status = new_status
+
+    # Đánh dấu ngày cần tính lại rollup (ghi sau khi transaction commit)
+    old_pickup = instance._loaded_pickup
+    instance._loaded_pickup = instance.pickup_time
+    mark_dirty({local_day(instance.pickup_time), old_pickup and local_day(old_pickup)})
+
+    def apply():
+        booking_index.update_booking(
+            instance.id, instance.equipment_id,
+            instance.pickup_time, instance.return_time, new_status,
+        )
+        dashboard_counters.booking_status_changed(old_status, new_status, created=created)
+
+    transaction.on_commit(apply)
+
+
+@receiver(post_delete, sender=Booking)
+def booking_deleted(sender, instance, **kwargs):
+    """Xóa đơn khỏi interval index, bộ đếm và rollup"""
+    status = instance.__dict__.get('status')
+    if instance.__dict__.get('pickup_time'):
+        mark_dirty({local_day(instance.pickup_time)})
+
+    def apply():
+        booking_index.remove_booking(instance.id, instance.equipment_id)
+        dashboard_counters.booking_status_changed(status, None, deleted=True)
+
+    transaction.on_commit(apply)
+
+
+@receiver(post_save, sender=Equipment)
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Equipment)
+@receiver(post_delete, sender=Department)
+def catalog_changed(sender, instance, **kwargs):
+    """Làm mới cache trang danh sách thiết bị"""
+    transaction.on_commit(bump_generation)
+
+
+@receiver(post_init, sender=Equipment)
+@receiver(post_init, sender=Department)
+@receiver(post_init, sender=User)
+def named_model_loaded(sender, instance, **kwargs):
+    instance._indexed_values = indexed_values(instance)
+
+
+@receiver(post_save, sender=Equipment)
+@receiver(post_save, sender=Department)
+@receiver(post_save, sender=User)
+def named_model_saved(sender, instance, created, **kwargs):
+    """Cập nhật index tên đã bỏ dấu khi tên thay đổi"""
+    current = indexed_values(instance)
+    if created or current != instance._indexed_values:
+        index_instance(instance)
+        if sender is User and not created:
+            transaction.on_commit(lambda: autocomplete.refresh('student', [instance.pk]))
+    instance._indexed_values = current
+
+
+@receiver(post_delete, sender=Equipment)
+@receiver(post_delete, sender=Department)
+@receiver(post_delete, sender=User)
+def named_model_deleted(sender, instance, **kwargs):
+    remove_instance(KIND_BY_MODEL[sender], instance.pk)
+
+
+@receiver(post_init, sender=Equipment)
+def equipment_loaded(sender, instance, **kwargs):
+    instance._autocomplete_values = (instance.__dict__.get('code'), instance.__dict__.get('name'))
+    instance._embedded_values = tuple(instance.__dict__.get(field) for field in EMBEDDED_FIELDS)
+
+
+@receiver(post_save, sender=Equipment)
+def equipment_saved(sender, instance, created, **kwargs):
+    """Cập nhật autocomplete và embedding khi các cột liên quan thay đổi"""
+    current = (instance.__dict__.get('code'), instance.__dict__.get('name'))
+    if created or current != instance._autocomplete_values:
+        transaction.on_commit(lambda: autocomplete.refresh('equipment', [instance.pk]))
+    instance._autocomplete_values = current
+
+    embedded = tuple(instance.__dict__.get(field) for field in EMBEDDED_FIELDS)
+    if created or embedded != instance._embedded_values:
+        transaction.on_commit(lambda: recommender.update([instance.pk]))
+    instance._embedded_values = embedded
+
+
+@receiver(post_delete, sender=Equipment)
+def equipment_deleted(sender, instance, **kwargs):
+    def apply():
+        autocomplete.refresh('equipment', [instance.pk])
+        recommender.update([instance.pk])
+
+    transaction.on_commit(apply)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def profile_changed(sender, instance, **kwargs):
+    """Cập nhật autocomplete mã sinh viên"""
+    transaction.on_commit(lambda: autocomplete.refresh('student', [instance.user_id]))
+
+
+@receiver(post_save, sender=Equipment)
+@receiver(post_save, sender=UserProfile)
+def counted_model_saved(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: dashboard_counters.incr(sender._meta.model_name))
+
+
+@receiver(post_delete, sender=Equipment)
+@receiver(post_delete, sender=UserProfile)
+def counted_model_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: dashboard_counters.incr(sender._meta.model_name, -1))
+'''
+
+# dnu_lab_system/lab_management/apps.py
+APPS_PY = '''
+from django.apps import AppConfig
+
+
+class LabManagementConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'lab_management'
+    verbose_name = 'Quản lý phòng lab'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from . import signals  # noqa: F401
+        from . import metrics, querylog
+        from .name_index import backfill
+        from .reservations import install_exclusion_constraint
+        from .search import install_search_index
+
+        post_migrate.connect(install_exclusion_constraint, sender=self)
+        post_migrate.connect(install_search_index, sender=self)
+        post_migrate.connect(backfill, sender=self)
+        metrics.install()
+        querylog.install()
+'''
+
+# dnu_lab_system/lab_management/reservations.py
+RESERVATIONS_PY = '''
+\"\"\"
+Đặt chỗ thiết bị nguyên tử (không double-booking khi có nhiều request đồng thời).
+
+reserve_booking() khóa dòng Equipment bằng SELECT ... FOR UPDATE, kiểm tra
+xung đột trên DB rồi mới lưu, tất cả trong một transaction. Các đơn cho những
+thiết bị khác nhau không chặn nhau. Trên PostgreSQL còn có thêm exclusion
+constraint trên tstzrange làm lớp bảo vệ cuối ở tầng DB.
+\"\"\"
+import logging
+from dataclasses import dataclass, field
+
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .booking_index import EquipmentIntervals, booking_index
+from .counters import dashboard_counters
+from .models import Booking, Equipment
+from .notifications import enqueue_booking_notification
+from .rollups import local_day, mark_dirty
+
+logger = logging.getLogger(__name__)
+
+EXCLUSION_CONSTRAINT = 'booking_no_overlap'
+
+# action -> trạng thái mới cho duyệt hàng loạt
+BULK_ACTIONS = {'approve': 'approved', 'reject': 'rejected'}
+
+
+class BookingConflict(Exception):
+    \"\"\"Khoảng thời gian đã bị đơn khác giữ chỗ\"\"\"
+
+
+@dataclass
+class ModerationResult:
+    """Kết quả duyệt hàng loạt"""
+    action: str
+    updated: list = field(default_factory=list)
+    conflicts: list = field(default_factory=list)
+    # Không tồn tại hoặc không còn ở trạng thái pending
+    skipped: list = field(default_factory=list)
+
+    def as_dict(self):
+        return {
+            'action': self.action,
+            'updated': self.updated,
+            'conflicts': self.conflicts,
+            'skipped': self.skipped,
+        }
+
+
+def reserve_booking(booking):
+    \"\"\"Lưu đơn nếu không xung đột, ngược lại raise BookingConflict\"\"\"
+    # Interval index chỉ là gợi ý (index của process này có thể cũ khi cache
+    # không dùng chung): từ chối nhanh khi DB xác nhận, quyết định cuối cùng
+    # luôn là db_has_conflict dưới khóa
+    if booking.is_conflicting() and booking_index.db_has_conflict(
+        booking.equipment_id, booking.pickup_time, booking.return_time, exclude_id=booking.id,
+    ):
+        raise BookingConflict()
+
+    try:
+        with transaction.atomic():
+            Equipment.objects.select_for_update().only('id').get(id=booking.equipment_id)
+            if booking_index.db_has_conflict(
+                booking.equipment_id, booking.pickup_time, booking.return_time,
+                exclude_id=booking.id,
+            ):
+                raise BookingConflict()
+            booking.save()
+    except IntegrityError as e:
+        if EXCLUSION_CONSTRAINT in str(e):
+            raise BookingConflict() from e
+        raise
+    return booking
+
+
+def split_conflicts(candidates):
+    """
+    Kiểm tra xung đột cho cả lô trong bộ nhớ.
+
+    candidates: [(id, equipment_id, pickup_time, return_time)] theo thứ tự ưu
+    tiên (đơn đến trước được duyệt trước). So với các đơn đang giữ chỗ ngoài lô
+    (một query) và các đơn trong lô đã được chấp nhận. Trả về (ok_ids, conflict_ids).
+    """
+    batch_ids = [row[0] for row in candidates]
+    rows = Booking.objects.filter(
+        equipment_id__in={row[1] for row in candidates},
+        status__in=Booking.ACTIVE_STATUSES,
+        pickup_time__lt=max(row[3] for row in candidates),
+        return_time__gt=min(row[2] for row in candidates),
+    ).exclude(id__in=batch_ids).values_list('equipment_id', 'id', 'pickup_time', 'return_time')
+
+    intervals = {}
+    for equipment_id, booking_id, start, end in rows:
+        intervals.setdefault(equipment_id, []).append((booking_id, start, end))
+    intervals = {eid: EquipmentIntervals(entries) for eid, entries in intervals.items()}
+
+    ok, conflicts = [], []
+    for booking_id, equipment_id, start, end in candidates:
+        equipment = intervals.setdefault(equipment_id, EquipmentIntervals())
+        if equipment.overlaps(start, end):
+            conflicts.append(booking_id)
+        else:
+            equipment.add(booking_id, start, end)
+            ok.append(booking_id)
+    return ok, conflicts
+
+
+def moderate_bookings(booking_ids, action, moderator, notes=''):
+    """
+    Duyệt/từ chối nhiều đơn pending trong một transaction.
+
+    Khóa các thiết bị liên quan (cùng khóa với reserve_booking), kiểm tra xung
+    đột trong bộ nhớ rồi cập nhật bằng một câu UPDATE ... WHERE id IN. Vì
+    update() bỏ qua signals nên index, bộ đếm dashboard và email được xử lý
+    trực tiếp sau khi commit.
+    """
+    new_status = BULK_ACTIONS[action]
+    booking_ids = set(booking_ids)
+    result = ModerationResult(action)
+
+    with transaction.atomic():
+        candidates = list(
+            Booking.objects.select_for_update()
+            .filter(id__in=booking_ids, status='pending')
+            .order_by('created_at', 'id')
+            .values_list('id', 'equipment_id', 'pickup_time', 'return_time')
+        )
+        result.skipped = sorted(booking_ids - {row[0] for row in candidates})
+        if not candidates:
+            return result
+
+        equipment_ids = sorted({row[1] for row in candidates})
+        if action == 'approve':
+            # Khóa theo thứ tự id để không deadlock giữa các lô
+            list(
+                Equipment.objects.select_for_update()
+                .filter(id__in=equipment_ids).order_by('id').values_list('id', flat=True)
+            )
+            result.updated, result.conflicts = split_conflicts(candidates)
+        else:
+            result.updated = [row[0] for row in candidates]
+        if not result.updated:
+            return result
+
+        fields = {'status': new_status, 'notes': notes, 'updated_at': timezone.now()}
+        if action == 'approve':
+            fields['approved_by'] = moderator
+        count = Booking.objects.filter(id__in=result.updated).update(**fields)
+        updated = set(result.updated)
+        mark_dirty({local_day(row[2]) for row in candidates if row[0] in updated})
+
+        def apply():
+            if new_status not in Booking.ACTIVE_STATUSES:
+                booking_index.invalidate(equipment_ids)
+            dashboard_counters.incr('booking:pending', -count)
+            dashboard_counters.incr(f'booking:{new_status}', count)
+
+        transaction.on_commit(apply)
+        enqueue_booking_notification(result.updated, new_status)
+
+    logger.info(
+        f"{moderator} bulk {action}: {len(result.updated)} updated, "
+        f"{len(result.conflicts)} conflicts, {len(result.skipped)} skipped"
+    )
+    return result
+
+
+def overlapping_bookings(queryset=None):
+    """Các đơn đang giữ chỗ chồng lấn với một đơn đang giữ chỗ khác cùng thiết bị"""
+    active = Booking.objects.filter(status__in=Booking.ACTIVE_STATUSES)
+    other = active.filter(
+        equipment_id=OuterRef('equipment_id'),
+        pickup_time__lt=OuterRef('return_time'),
+        return_time__gt=OuterRef('pickup_time'),
+    ).exclude(id=OuterRef('id'))
+    queryset = queryset if queryset is not None else Booking.objects.all()
+    return queryset.filter(status__in=Booking.ACTIVE_STATUSES).filter(Exists(other))
+
+
+def exclusion_constraint():
+    """ExclusionConstraint chống chồng lấn giữa các đơn đang giữ chỗ"""
+    from django.contrib.postgres.constraints import ExclusionConstraint
+    from django.contrib.postgres.fields import DateTimeRangeField, RangeBoundary, RangeOperators
+    from django.db.models import Func, Q
+
+    class TsTzRange(Func):
+        function = 'TSTZRANGE'
+        output_field = DateTimeRangeField()
+
+    return ExclusionConstraint(
+        name=EXCLUSION_CONSTRAINT,
+        expressions=[
+            ('equipment', RangeOperators.EQUAL),
+            (TsTzRange('pickup_time', 'return_time', RangeBoundary()), RangeOperators.OVERLAPS),
+        ],
+        condition=Q(status__in=Booking.ACTIVE_STATUSES),
+    )
+
+
+def install_exclusion_constraint(using='default', **kwargs):
+    """
+    Tạo exclusion constraint chống chồng lấn sau migrate (chỉ PostgreSQL).
+
+    Không khai báo trong Booking.Meta vì migrations được sinh bằng
+    makemigrations và phải chạy được trên SQLite. Nếu DB đã có đơn chồng lấn
+    thì bỏ qua (kèm cảnh báo) thay vì làm migrate thất bại; xử lý các đơn đó
+    rồi chạy lại migrate.
+    """
+    from django.db import connections
+    conn = connections[using]
+    if conn.vendor != 'postgresql':
+        return False
+
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_constraint WHERE conname = %s", [EXCLUSION_CONSTRAINT]
+        )
+        if cursor.fetchone():
+            return False
+
+    overlapping = list(overlapping_bookings(Booking.objects.using(using)).values_list('id', flat=True)[:20])
+    if overlapping:
+        logger.warning(
+            f"Skipped {EXCLUSION_CONSTRAINT}: active bookings overlap (e.g. ids {overlapping}); "
+            f"reject or reschedule them and run migrate again"
+        )
+        return False
+
+    with conn.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    with conn.schema_editor() as schema_editor:
+        schema_editor.add_constraint(Booking, exclusion_constraint())
+    logger.info(f"Installed {EXCLUSION_CONSTRAINT} exclusion constraint on {Booking._meta.db_table}")
+    return True
+'''
+
+# dnu_lab_system/lab_management/management/commands/loadtest_bookings.py
+LOADTEST_BOOKINGS_PY = '''
+import random
+import threading
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, OperationalError
+from django.utils import timezone
+
+from lab_management.models import Booking, Department, Equipment
+from lab_management.reservations import BookingConflict, overlapping_bookings, reserve_booking
+
+
+class Command(BaseCommand):
+    help = 'Load test concurrent booking submissions and verify there is no double-booking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=50, help='Concurrent threads (default: 50)')
+        parser.add_argument('--requests', type=int, default=1000, help='Total submissions (default: 1000)')
+        parser.add_argument('--equipment', type=int, default=5, help='Equipment items to contend on (default: 5)')
+        parser.add_argument('--slots', type=int, default=40, help='Hour slots per equipment (default: 40)')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows')
+
+    def handle(self, *args, **options):
+        # Các thread cần dữ liệu đã commit nên không chạy được trong transaction
+        # rollback; các dòng do lệnh này tạo ra được xóa ở cuối (trừ --keep)
+        created = []
+        department, is_new = Department.objects.get_or_create(
+            code='LOADT', defaults={'name': 'Load test'}
+        )
+        if is_new:
+            created.append(department)
+        user, is_new = User.objects.get_or_create(username='loadtest_user')
+        if is_new:
+            created.append(user)
+        equipment = []
+        for i in range(options['equipment']):
+            item, is_new = Equipment.objects.get_or_create(
+                code=f'LOADT-{i}', defaults={'name': f'Load test {i}', 'department': department}
+            )
+            equipment.append(item)
+            if is_new:
+                created.append(item)
+        try:
+            overlaps = self.run(equipment, user, options)
+        finally:
+            if not options['keep']:
+                Booking.objects.filter(equipment__in=equipment).delete()
+                for obj in reversed(created):
+                    obj.delete()
+
+        if overlaps:
+            raise CommandError(f'❌ {overlaps} bookings overlap another active booking')
+        self.stdout.write(self.style.SUCCESS('✅ No double-bookings'))
+
+    def run(self, equipment, user, options):
+        """Chạy tải, in thống kê và trả về số đơn bị chồng lấn"""
+        base = (timezone.now() + timedelta(days=30)).replace(minute=0, second=0, microsecond=0)
+
+        counters = {'created': 0, 'conflict': 0, 'error': 0}
+        latencies = []
+        lock = threading.Lock()
+        remaining = iter(range(options['requests']))
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        if next(remaining, None) is None:
+                            return
+                    item = random.choice(equipment)
+                    start = base + timedelta(hours=random.randrange(options['slots']))
+                    booking = Booking(
+                        user=user, equipment=item, purpose='load test',
+                        pickup_time=start,
+                        return_time=start + timedelta(hours=random.choice([1, 2])),
+                    )
+                    began = time.perf_counter()
+                    try:
+                        reserve_booking(booking)
+                        outcome = 'created'
+                    except BookingConflict:
+                        outcome = 'conflict'
+                    except OperationalError:
+                        outcome = 'error'
+                    with lock:
+                        counters[outcome] += 1
+                        latencies.append(time.perf_counter() - began)
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        overlaps = overlapping_bookings(Booking.objects.filter(equipment__in=equipment)).count()
+        latencies.sort()
+        p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+
+        self.stdout.write(f'Submissions: {len(latencies)} in {elapsed:.2f}s '
+                          f'({len(latencies) / elapsed:.0f}/s)')
+        self.stdout.write(f'  created={counters["created"]} conflict={counters["conflict"]} '
+                          f'error={counters["error"]}')
+        self.stdout.write(f'  latency p50={p(0.5):.1f}ms p95={p(0.95):.1f}ms p99={p(0.99):.1f}ms')
+        return overlaps
+'''
+
+# dnu_lab_system/lab_management/management/commands/explain_queries.py
+EXPLAIN_QUERIES_PY = '''
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from lab_management.models import Booking, Department, Equipment
+
+# Dấu hiệu planner dùng index, theo từng DB vendor
+INDEX_PATTERNS = {
+    'sqlite': re.compile(r'USING (COVERING )?INDEX|USING INTEGER PRIMARY KEY'),
+    'postgresql': re.compile(r'Index Scan|Index Only Scan|Bitmap Index Scan'),
+}
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\\bSCAN (?!.*USING)'),
+    'postgresql': re.compile(r'Seq Scan'),
+}
+
+
+def hot_querysets():
+    \"\"\"Các queryset nóng của từng view, cùng điều kiện lọc như trong views.py\"\"\"
+    now = timezone.now()
+    user = User.objects.order_by('id').first()
+    user_id = user.id if user else 0
+    equipment_id = Equipment.objects.order_by('id').values_list('id', flat=True).first() or 0
+    department_id = Department.objects.order_by('id').values_list('id', flat=True).first() or 0
+
+    return [
+        ('home', Booking.objects.filter(status='approved')[:5]),
+        ('equipment_list', Equipment.objects.filter(status='available')),
+        ('equipment_list?department', Equipment.objects.filter(
+            status='available', department_id=department_id)),
+        ('create_booking (conflict check)', Booking.objects.filter(
+            equipment_id=equipment_id,
+            status__in=Booking.ACTIVE_STATUSES,
+            pickup_time__lt=now + timezone.timedelta(hours=2),
+            return_time__gt=now,
+        )),
+        ('my_bookings', Booking.objects.filter(user_id=user_id).order_by('-created_at', '-id')[:51]),
+        ('pending_bookings', Booking.objects.filter(status='pending').order_by('-created_at')),
+        ('all_bookings', Booking.objects.order_by('-created_at', '-id')[:51]),
+        ('all_bookings?status', Booking.objects.filter(status='approved').order_by('-created_at', '-id')[:51]),
+        ('admin_dashboard (pending count)', Booking.objects.filter(status='pending').values('id')),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN on the hot view querysets and report whether they use an index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-plan',
+            action='store_true',
+            help='Print the full query plan for every queryset'
+        )
+        parser.add_argument(
+            '--fail-on-scan',
+            action='store_true',
+            help='Exit with an error if any queryset falls back to a full table scan'
+        )
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        index_re = INDEX_PATTERNS.get(vendor)
+        scan_re = FULL_SCAN_PATTERNS.get(vendor)
+        if index_re is None:
+            raise CommandError(f'Unsupported database vendor: {vendor}')
+
+        self.stdout.write(f'🔍 EXPLAIN on {vendor}\\n')
+        regressions = []
+        for name, queryset in hot_querysets():
+            plan = queryset.explain()
+            uses_index = bool(index_re.search(plan))
+            full_scan = bool(scan_re.search(plan))
+
+            if uses_index and not full_scan:
+                self.stdout.write(self.style.SUCCESS(f'  ✅ {name}: index'))
+            elif uses_index:
+                self.stdout.write(self.style.WARNING(f'  ⚠️  {name}: index + full scan'))
+                regressions.append(name)
+            else:
+                self.stdout.write(self.style.ERROR(f'  ❌ {name}: full scan'))
+                regressions.append(name)
+
+            if options['verbose_plan']:
+                for line in plan.splitlines():
+                    self.stdout.write(f'      {line}')
+
+        if regressions and options['fail_on_scan']:
+            raise CommandError(f'{len(regressions)} queryset(s) not fully indexed: {", ".join(regressions)}')
+'''
+
+# dnu_lab_system/lab_management/tests.py
+TESTS_PY = '''
+"""
+Số query của các trang danh sách không được tăng theo số dòng (N+1).
+
+Mỗi trang được gọi qua test client, render template thật, ở hai kích thước dữ
+liệu; số query đo ở bộ nhỏ phải giữ nguyên (assertNumQueries) ở bộ lớn.
+"""
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Booking, Department, Equipment
+
+# (URL name, tham số GET)
+LISTING_PAGES = [
+    ('home', {}),
+    ('equipment_list', {}),
+    ('my_bookings', {}),
+    ('pending_bookings', {}),
+    ('all_bookings', {}),
+    ('all_bookings', {'status': 'approved'}),
+]
+
+
+class ListingQueryCountTests(TestCase):
+    SMALL = 5
+    LARGE = 60
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('querycount_staff', password='x', is_staff=True)
+        cls.departments = [
+            Department.objects.create(name=f'QC {i}', code=f'QC{i}') for i in range(3)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+        self.rows = 0
+
+    def add_rows(self, count):
+        """Thêm thiết bị và đơn (mỗi đơn một người dùng khác nhau, một nửa của staff)"""
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(self.rows, self.rows + count):
+                equipment = Equipment.objects.create(
+                    name=f'QC equipment {i}', code=f'QC-{i}', department=self.departments[i % 3]
+                )
+                owner = self.staff if i % 2 else User.objects.create_user(f'querycount_{i}')
+                Booking.objects.create(
+                    user=owner, equipment=equipment, purpose='query count',
+                    pickup_time=now + timedelta(days=i + 1),
+                    return_time=now + timedelta(days=i + 1, hours=2),
+                    status='approved' if i % 3 else 'pending',
+                )
+        self.rows += count
+
+    def get(self, name, params):
+        # Đo đường cold: không dùng fragment/counter đã cache từ lần gọi trước
+        cache.clear()
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_listing_query_counts_do_not_grow_with_rows(self):
+        self.add_rows(self.SMALL)
+        expected = {}
+        for name, params in LISTING_PAGES:
+            with CaptureQueriesContext(connection) as queries:
+                self.get(name, params)
+            expected[name, tuple(params.items())] = len(queries)
+
+        self.add_rows(self.LARGE - self.SMALL)
+        for name, params in LISTING_PAGES:
+            with self.subTest(page=name, params=params):
+                with self.assertNumQueries(expected[name, tuple(params.items())]):
+                    self.get(name, params)
+'''
+
+# dnu_lab_system/lab_management/pagination.py
+PAGINATION_PY = '''
+\"\"\"
+Keyset (cursor) pagination theo (created_at, id) giảm dần.
+
+Khác với OFFSET, mỗi trang chỉ là một range scan trên index
+(..., -created_at, -id) nên độ trễ không phụ thuộc trang sâu đến đâu.
+Cursor là base64 của "created_at|id", ổn định khi có đơn mới được thêm.
+\"\"\"
+import base64
+import binascii
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import Q
+
+
+@dataclass
+class KeysetPage:
+    object_list: list = field(default_factory=list)
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def encode_cursor(obj):
+    raw = f'{obj.created_at.isoformat()}|{obj.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    \"\"\"Trả về (created_at, id) hoặc None nếu cursor không hợp lệ\"\"\"
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def keyset_page(queryset, after=None, before=None, per_page=None):
+    \"\"\"
+    Lấy một trang theo cursor.
+
+    after: cursor của dòng cuối trang trước (đi tới trang kế).
+    before: cursor của dòng đầu trang sau (quay lại trang trước).
+    Cursor không hợp lệ, before= đã về tới đầu danh sách, hoặc cursor không
+    còn dòng nào (các dòng đã bị xóa/đổi trạng thái) đều trả về trang đầu.
+    \"\"\"
+    per_page = per_page or getattr(settings, 'BOOKINGS_PER_PAGE', 50)
+    after_key, before_key = decode_cursor(after), decode_cursor(before)
+
+    if before_key:
+        created_at, pk = before_key
+        rows = list(
+            queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+            .order_by('created_at', 'id')[:per_page + 1]
+        )
+        if len(rows) <= per_page:
+            return keyset_page(queryset, per_page=per_page)
+        rows = rows[:per_page][::-1]
+        has_prev, has_next = True, True
+    else:
+        page_qs = queryset
+        if after_key:
+            created_at, pk = after_key
+            page_qs = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        rows = list(page_qs.order_by('-created_at', '-id')[:per_page + 1])
+        if not rows and after_key:
+            return keyset_page(queryset, per_page=per_page)
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        has_prev = after_key is not None
+
+    return KeysetPage(
+        object_list=rows,
+        next_cursor=encode_cursor(rows[-1]) if rows and has_next else None,
+        prev_cursor=encode_cursor(rows[0]) if rows and has_prev else None,
+    )
+'''
+
+# dnu_lab_system/lab_management/counters.py
+COUNTERS_PY = '''
+\"\"\"
+Bộ đếm cho admin dashboard, lưu trong Django cache.
+
+Signals tăng/giảm bộ đếm khi có thay đổi nên dashboard không cần chạy
+COUNT(*) mỗi lần tải trang. Khi cache trống (khởi động, bị evict) hoặc định
+kỳ qua task reconcile_dashboard_counters, các giá trị được tính lại từ DB.
+\"\"\"
+import logging
+
+from django.core.cache import cache
+from django.db.models import Count
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'counters:'
+
+
+class DashboardCounters:
+    \"\"\"Các khóa: booking:<status>, booking:total, equipment, userprofile\"\"\"
+
+    def keys(self):
+        from .models import Booking
+        statuses = [status for status, _ in Booking.STATUS_CHOICES]
+        return [f'booking:{status}' for status in statuses] + [
+            'booking:total', 'equipment', 'userprofile',
+        ]
+
+    def snapshot(self):
+        \"\"\"Đọc toàn bộ bộ đếm; tính lại từ DB nếu thiếu khóa nào\"\"\"
+        keys = self.keys()
+        cached = cache.get_many([KEY_PREFIX + key for key in keys])
+        if len(cached) == len(keys):
+            return {key: cached[KEY_PREFIX + key] for key in keys}
+        return self.reconcile()
+
+    def reconcile(self):
+        \"\"\"Tính lại tất cả bộ đếm từ DB và ghi vào cache\"\"\"
+        from .models import Booking, Equipment, UserProfile
+        counts = {key: 0 for key in self.keys()}
+        for row in Booking.objects.order_by().values('status').annotate(n=Count('id')):
+            counts[f'booking:{row["status"]}'] = row['n']
+        counts['booking:total'] = sum(
+            n for key, n in counts.items() if key.startswith('booking:') and key != 'booking:total'
+        )
+        counts['equipment'] = Equipment.objects.count()
+        counts['userprofile'] = UserProfile.objects.count()
+
+        cache.set_many({KEY_PREFIX + key: n for key, n in counts.items()}, timeout=None)
+        return counts
+
+    def incr(self, key, delta=1):
+        try:
+            cache.incr(KEY_PREFIX + key, delta)
+        except ValueError:
+            # Khóa chưa có: để lần đọc sau reconcile từ DB
+            pass
+
+    def booking_status_changed(self, old_status, new_status, created=False, deleted=False):
+        if old_status == new_status and not (created or deleted):
+            return
+        if old_status is None and not created:
+            # Không biết trạng thái cũ (field bị defer): tính lại ở lần đọc sau
+            self.invalidate()
+            return
+        if old_status:
+            self.incr(f'booking:{old_status}', -1)
+        if new_status:
+            self.incr(f'booking:{new_status}')
+        if created:
+            self.incr('booking:total')
+        elif deleted:
+            self.incr('booking:total', -1)
+
+    def invalidate(self):
+        \"\"\"Xóa bộ đếm (dùng sau các thao tác bỏ qua signals như bulk_update)\"\"\"
+        cache.delete_many([KEY_PREFIX + key for key in self.keys()])
+
+
+dashboard_counters = DashboardCounters()
+'''
+
+# dnu_lab_system/lab_management/ai_cache.py
+AI_CACHE_PY = '''
+"""
+Cache phản hồi AI theo nội dung (content-addressed).
+
+Key = sha256(model, loại prompt, phiên bản prompt, input đã chuẩn hóa), nên
+các thiết bị trùng tên/thông số hoặc câu hỏi chat giống nhau dùng chung một
+kết quả. Backend chọn qua settings.AI_CACHE['BACKEND']:
+
+- lru: OrderedDict trong process, giới hạn số entry + TTL
+- django: Django cache (Redis khi có CACHE_URL), TTL do cache quản lý
+- sqlite: file SQLite trên đĩa, giữ qua các lần khởi động, TTL + giới hạn entry
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(value):
+    """NFC và gộp khoảng trắng; giữ nguyên hoa thường ("mA" khác "MA" trong thông số)"""
+    text = unicodedata.normalize('NFC', str(value or ''))
+    return ' '.join(text.split())
+
+
+class LRUBackend:
+    def __init__(self, ttl, max_entries, **kwargs):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DjangoCacheBackend:
+    PREFIX = 'ai_cache:'
+
+    def __init__(self, ttl, **kwargs):
+        from django.core.cache import cache
+        self.cache = cache
+        self.ttl = ttl
+        self.evictions = 0
+
+    def get(self, key):
+        return self.cache.get(self.PREFIX + key)
+
+    def set(self, key, value):
+        self.cache.set(self.PREFIX + key, value, timeout=self.ttl)
+
+    def clear(self):
+        # Django cache không xóa được theo prefix; tăng PROMPT_VERSIONS để vô hiệu hóa
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class SQLiteBackend:
+    def __init__(self, ttl, max_entries, path, **kwargs):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS ai_cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+            'expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ai_cache_accessed ON ai_cache (accessed_at)')
+        self._count = self._conn.execute('SELECT COUNT(*) FROM ai_cache').fetchone()[0]
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM ai_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute('DELETE FROM ai_cache WHERE key = ?', (key,))
+                self._count -= 1
+                return None
+            self._conn.execute('UPDATE ai_cache SET accessed_at = ? WHERE key = ?', (now, key))
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            exists = self._conn.execute('SELECT 1 FROM ai_cache WHERE key = ?', (key,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO ai_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, value, now + self.ttl, now),
+            )
+            if not exists:
+                self._count += 1
+            if self._count > self.max_entries:
+                self._evict(now)
+
+    def _evict(self, now):
+        """Xóa entry hết hạn, sau đó entry lâu không được dùng nhất"""
+        self._conn.execute('DELETE FROM ai_cache WHERE expires_at < ?', (now,))
+        count = self._conn.execute('SELECT COUNT(*) FROM ai_cache').fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                'DELETE FROM ai_cache WHERE key IN ('
+                'SELECT key FROM ai_cache ORDER BY accessed_at LIMIT ?)', (excess,)
+            )
+            count -= excess
+        self.evictions += self._count - count
+        self._count = count
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM ai_cache')
+            self._count = 0
+
+    def __len__(self):
+        return self._count
+
+
+BACKENDS = {
+    'lru': LRUBackend,
+    'django': DjangoCacheBackend,
+    'sqlite': SQLiteBackend,
+}
+
+
+class AIResponseCache:
+    """Cache phản hồi AI với backend cấu hình được và đếm hit/miss"""
+
+    def __init__(self):
+        self._backend = None
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    config = getattr(settings, 'AI_CACHE', {})
+                    backend_class = BACKENDS[config.get('BACKEND', 'lru')]
+                    self._backend = backend_class(
+                        ttl=config.get('TTL', 7 * 24 * 3600),
+                        max_entries=config.get('MAX_ENTRIES', 10000),
+                        path=config.get('PATH', 'ai_cache.sqlite3'),
+                    )
+        return self._backend
+
+    @staticmethod
+    def make_key(model, kind, version, *inputs):
+        payload = json.dumps(
+            [model, kind, version] + [normalize(value) for value in inputs],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key, kind='default'):
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"AI cache get failed: {e}")
+            value = None
+        if value is None:
+            self.misses[kind] += 1
+        else:
+            self.hits[kind] += 1
+        return value
+
+    def set(self, key, value):
+        if not value:
+            return
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            logger.warning(f"AI cache set failed: {e}")
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'evictions': self.backend.evictions,
+            'by_kind': {
+                kind: {'hits': self.hits[kind], 'misses': self.misses[kind]}
+                for kind in sorted(set(self.hits) | set(self.misses))
+            },
+        }
+
+
+ai_cache = AIResponseCache()
+'''
+
+# dnu_lab_system/lab_management/ai_streaming.py
+AI_STREAMING_PY = '''
+"""
+Stream phản hồi chat AI dưới dạng Server-Sent Events.
+
+Generator async: token được chuyển tiếp ngay khi model trả về, bản ghi AIChat
+chỉ được lưu khi stream hoàn tất. Khi chạy dưới ASGI, một stream chậm chỉ là
+một coroutine đang chờ, không chiếm worker đồng bộ.
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from openai import AsyncOpenAI
+
+from .ai_cache import ai_cache
+from .ai_services import ai_service, build_messages
+from .metrics import track_external
+from .models import AIChat
+
+logger = logging.getLogger(__name__)
+
+
+def sse(payload, event=None):
+    data = json.dumps(payload, ensure_ascii=False)
+    if event:
+        return f'event: {event}\\ndata: {data}\\n\\n'
+    return f'data: {data}\\n\\n'
+
+
+async def stream_completion(prompt, max_tokens=500):
+    """Yield từng đoạn text từ OpenAI với stream=True (prompt: chuỗi hoặc messages)"""
+    client = AsyncOpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        base_url=getattr(settings, 'OPENAI_BASE_URL', None),
+    )
+    try:
+        with track_external('ai'):
+            stream = await client.chat.completions.create(
+                model=ai_service.model,
+                messages=prompt if isinstance(prompt, list) else build_messages(prompt),
+                max_tokens=max_tokens,
+                stream=True,
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+    finally:
+        await client.close()
+
+
+async def stream_chat_events(user, message):
+    """Sự kiện SSE: data {token} cho từng đoạn, cuối cùng event done {id}"""
+    inputs, prompt = await sync_to_async(ai_service.chat_request)(message, user)
+    cache_key = ai_service.cache_key('chat', *inputs)
+    response = await sync_to_async(ai_cache.get)(cache_key, 'chat')
+
+    if response is not None:
+        yield sse({'token': response})
+    else:
+        parts = []
+        try:
+            async for delta in stream_completion(prompt):
+                parts.append(delta)
+                yield sse({'token': delta})
+        except Exception as e:
+            logger.error(f"AI chat stream failed for user {user.id}: {e}")
+            yield sse({'error': 'AI service unavailable'}, event='error')
+            return
+        response = ''.join(parts)
+        await sync_to_async(ai_cache.set)(cache_key, response)
+
+    chat = await AIChat.objects.acreate(user=user, message=message, response=response)
+    yield sse({'id': chat.id}, event='done')
+'''
+
+# dnu_lab_system/lab_management/notifications.py
+NOTIFICATIONS_PY = '''
+"""
+Gửi email thông báo đơn đặt lịch ngoài request.
+
+View chỉ gọi `enqueue_booking_notification` trong transaction; sau khi commit
+đơn được đẩy sang Celery task `send_booking_notifications`. Khi không có
+Celery (hoặc broker không kết nối được) thì dùng hàng đợi trong process với
+một worker thread. Cả hai đường đều gửi cả lô qua một kết nối SMTP duy nhất.
+
+Nhắc nhở bảo trì cũng được gộp: mỗi người nhận một email tổng hợp
+(send_maintenance_digest) thay vì một email cho mỗi cặp thiết bị × admin.
+"""
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+
+from .ai_cache import normalize
+from .metrics import track_external
+from .models import Booking
+
+logger = logging.getLogger(__name__)
+
+STATUS_SUBJECTS = {
+    'approved': 'Đặt lịch được duyệt',
+    'rejected': 'Đặt lịch bị từ chối',
+    'completed': 'Đặt lịch hoàn thành',
+    'cancelled': 'Đặt lịch bị hủy',
+}
+
+
+def default_email_body(booking, status_change):
+    """Nội dung mặc định khi không sinh được email bằng AI"""
+    status = dict(Booking.STATUS_CHOICES).get(status_change, status_change)
+    return f"""
+Xin chào {booking.user.get_full_name() or booking.user.username},
+
+Đơn đặt lịch thiết bị của bạn đã chuyển sang trạng thái: {status}
+- Thiết bị: {booking.equipment.name}
+- Thời gian nhận: {booking.pickup_time.strftime("%d/%m/%Y %H:%M")}
+- Thời gian trả: {booking.return_time.strftime("%d/%m/%Y %H:%M")}
+- Ghi chú: {booking.notes}
+
+Trân trọng,
+Hệ thống Quản lý Phòng Lab DNU
+""".strip()
+
+
+def build_booking_email(booking, status_change):
+    """Tạo EmailMessage cho một đơn, ưu tiên nội dung AI"""
+    try:
+        from .ai_services import ai_service
+        body = ai_service.generate_smart_email(booking, status_change)
+    except Exception as e:
+        logger.warning(f"AI email failed for booking {booking.id}, using default text: {e}")
+        body = default_email_body(booking, status_change)
+
+    return EmailMessage(
+        subject=f"[DNU Lab] {STATUS_SUBJECTS.get(status_change, 'Cập nhật đặt lịch')}",
+        body=body,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[booking.user.email],
+    )
+
+
+class EmailSendError(Exception):
+    """
+    Gửi thất bại giữa chừng: `sent` email đầu danh sách đã đi.
+
+    Với send_booking_emails, `unsent_ids` là các đơn chưa được gửi email để
+    retry mà không gửi trùng.
+    """
+
+    def __init__(self, sent, cause, unsent_ids=None):
+        super().__init__(str(cause))
+        self.sent = sent
+        self.unsent_ids = unsent_ids
+
+
+def send_booking_emails(booking_ids, status_change):
+    """Gửi email cho nhiều đơn qua một kết nối SMTP, trả về số email đã gửi"""
+    bookings = Booking.objects.filter(id__in=booking_ids).select_related('user', 'equipment')
+    pending = [
+        (booking.id, build_booking_email(booking, status_change))
+        for booking in bookings if booking.user.email
+    ]
+    if not pending:
+        return 0
+
+    try:
+        sent = send_pooled([email for _, email in pending])
+    except EmailSendError as e:
+        e.unsent_ids = [booking_id for booking_id, _ in pending[e.sent:]]
+        raise
+    except Exception as e:
+        raise EmailSendError(0, e, [booking_id for booking_id, _ in pending]) from e
+    logger.info(f"Sent {sent}/{len(pending)} '{status_change}' booking emails")
+    return sent
+
+
+def send_pooled(emails):
+    """
+    Gửi danh sách EmailMessage qua một kết nối SMTP.
+
+    Từng email một trên cùng kết nối, để khi lỗi biết chính xác bao nhiêu
+    email đã đi (EmailSendError.sent).
+    """
+    sent = 0
+    with track_external('smtp'), get_connection() as connection:
+        for index, email in enumerate(emails):
+            try:
+                sent += connection.send_messages([email]) or 0
+            except Exception as e:
+                raise EmailSendError(index, e) from e
+    return sent
+
+
+def maintenance_digest_body(equipment_list, advice):
+    """Email tổng hợp: thiết bị nhóm theo loại, mỗi loại một lời khuyên AI"""
+    lines = [f"Có {len(equipment_list)} thiết bị cần được kiểm tra bảo trì:", ""]
+    groups = {}
+    for equipment in equipment_list:
+        groups.setdefault(normalize(equipment.name), []).append(equipment)
+
+    for type_key, items in groups.items():
+        lines.append(f"== {items[0].name} ({len(items)} thiết bị) ==")
+        for equipment in items:
+            lines.append(
+                f"- {equipment.code} | {equipment.department.name} | "
+                f"mua {equipment.purchase_date or '?'} | hết bảo hành {equipment.warranty_date}"
+            )
+        if advice.get(type_key):
+            lines += ["", "Lời khuyên từ AI:", advice[type_key]]
+        lines.append("")
+
+    lines.append("Vui lòng kiểm tra và cập nhật trạng thái thiết bị.")
+    return '\\n'.join(lines)
+
+
+def send_maintenance_digest(equipment_list, recipients):
+    """
+    Gửi một email tổng hợp cho mỗi người nhận.
+
+    Lời khuyên AI tính một lần cho mỗi loại thiết bị (qua response cache), mọi
+    email đi chung một kết nối SMTP. Trả về báo cáo kèm thời gian từng bước.
+    """
+    from .ai_services import ai_service
+
+    timings = {}
+    started = time.perf_counter()
+    types = {}
+    for equipment in equipment_list:
+        types.setdefault(normalize(equipment.name), equipment.name)
+    advice = {}
+    for type_key, name in types.items():
+        try:
+            advice[type_key] = ai_service.generate_maintenance_advice(name)
+        except Exception as e:
+            logger.warning(f"Maintenance advice failed for {name}: {e}")
+    timings['advice'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    body = maintenance_digest_body(equipment_list, advice)
+    emails = [
+        EmailMessage(
+            subject=f"[DNU Lab] Nhắc nhở bảo trì {len(equipment_list)} thiết bị",
+            body=body,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[recipient],
+        )
+        for recipient in recipients
+    ]
+    timings['render'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    sent = send_pooled(emails) if emails else 0
+    timings['send'] = time.perf_counter() - started
+
+    return {
+        'equipment': len(equipment_list),
+        'types': len(types),
+        'recipients': len(recipients),
+        'sent': sent,
+        'timings': {stage: round(seconds, 3) for stage, seconds in timings.items()},
+    }
+
+
+class LocalMailQueue:
+    """Hàng đợi trong process, dùng khi không có Celery"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, booking_ids, status_change):
+        self._queue.put((list(booking_ids), status_change))
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='local-mail-queue', daemon=True
+                )
+                self._thread.start()
+
+    def _drain(self):
+        """Gom các đơn đang chờ theo trạng thái để gửi chung một lô"""
+        grouped, taken = {}, 0
+        item = self._queue.get()
+        while True:
+            booking_ids, status_change = item
+            grouped.setdefault(status_change, []).extend(booking_ids)
+            taken += 1
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return grouped, taken
+
+    def _run(self):
+        while True:
+            grouped, taken = self._drain()
+            try:
+                for status_change, booking_ids in grouped.items():
+                    send_booking_emails(booking_ids, status_change)
+            except Exception as e:
+                logger.error(f"Local mail queue failed to send {grouped}: {e}")
+            finally:
+                close_old_connections()
+                for _ in range(taken):
+                    self._queue.task_done()
+
+    def join(self):
+        """Chờ gửi hết (dùng trong test và management command)"""
+        self._queue.join()
+
+
+local_mail_queue = LocalMailQueue()
+
+
+def use_celery():
+    backend = getattr(settings, 'NOTIFICATION_BACKEND', 'celery')
+    if backend != 'celery':
+        return False
+    try:
+        import celery  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def dispatch_booking_notifications(booking_ids, status_change):
+    """Đẩy việc gửi email sang Celery, lỗi broker thì rơi về hàng đợi local"""
+    booking_ids = list(booking_ids)
+    if use_celery():
+        try:
+            from .tasks import send_booking_notifications
+            send_booking_notifications.delay(booking_ids, status_change)
+            return
+        except Exception as e:
+            logger.warning(f"Celery unavailable, queueing booking emails locally: {e}")
+    local_mail_queue.put(booking_ids, status_change)
+
+
+def enqueue_booking_notification(booking_ids, status_change):
+    """Lên lịch gửi email sau khi transaction hiện tại commit"""
+    if isinstance(booking_ids, int):
+        booking_ids = [booking_ids]
+    booking_ids = list(booking_ids)
+    transaction.on_commit(lambda: dispatch_booking_notifications(booking_ids, status_change))
+'''
+
+# dnu_lab_system/lab_management/management/commands/benchmark_bulk_moderation.py
+BENCHMARK_BULK_MODERATION_PY = '''
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from lab_management.counters import dashboard_counters
+from lab_management.models import Booking, Department, Equipment
+from lab_management.reservations import moderate_bookings
+
+
+class QueryTimer:
+    """execute_wrapper đếm số query và tổng thời gian DB"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = 'Benchmark bulk approval of pending bookings (DB time and query count)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500, help='Pending bookings to approve (default: 500)')
+        parser.add_argument('--equipment', type=int, default=20, help='Equipment items (default: 20)')
+        parser.add_argument('--conflicts', type=int, default=10, help='Deliberately overlapping bookings (default: 10)')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows')
+
+    def handle(self, *args, **options):
+        department, _ = Department.objects.get_or_create(
+            code='BULKB', defaults={'name': 'Bulk benchmark'}
+        )
+        student, _ = User.objects.get_or_create(username='bulkbench_student')
+        teacher, _ = User.objects.get_or_create(username='bulkbench_teacher', defaults={'is_staff': True})
+        equipment = [
+            Equipment.objects.get_or_create(
+                code=f'BULKB-{i}', defaults={'name': f'Bulk benchmark {i}', 'department': department}
+            )[0]
+            for i in range(options['equipment'])
+        ]
+        Booking.objects.filter(equipment__in=equipment).delete()
+
+        base = (timezone.now() + timedelta(days=60)).replace(minute=0, second=0, microsecond=0)
+        bookings = []
+        for i in range(options['count']):
+            start = base + timedelta(hours=2 * (i // len(equipment)))
+            bookings.append(Booking(
+                user=student, equipment=equipment[i % len(equipment)], purpose='bulk benchmark',
+                pickup_time=start, return_time=start + timedelta(hours=1),
+            ))
+        # Các đơn trùng giờ với đơn đầu tiên của từng thiết bị
+        for i in range(options['conflicts']):
+            bookings.append(Booking(
+                user=student, equipment=equipment[i % len(equipment)], purpose='bulk benchmark conflict',
+                pickup_time=base + timedelta(minutes=30), return_time=base + timedelta(minutes=90),
+            ))
+        Booking.objects.bulk_create(bookings)
+        dashboard_counters.invalidate()
+        ids = list(Booking.objects.filter(equipment__in=equipment).values_list('id', flat=True))
+
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            result = moderate_bookings(ids, 'approve', teacher)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(f'Bulk approve of {len(ids)} bookings: {elapsed * 1000:.1f}ms wall, '
+                          f'{timer.seconds * 1000:.1f}ms DB in {timer.count} queries')
+        self.stdout.write(f'  updated={len(result.updated)} conflicts={len(result.conflicts)} '
+                          f'skipped={len(result.skipped)}')
+
+        if not options['keep']:
+            Booking.objects.filter(equipment__in=equipment).delete()
+            dashboard_counters.invalidate()
+
+        if len(result.conflicts) != options['conflicts']:
+            raise CommandError(f'❌ Expected {options["conflicts"]} conflicts, got {len(result.conflicts)}')
+        if timer.seconds >= 1:
+            self.stdout.write(self.style.WARNING(f'⚠️ DB time {timer.seconds:.2f}s is over the 1s budget'))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ All conflicts caught, DB time under 1s'))
+'''
+
+# dnu_lab_system/lab_management/analytics.py
+ANALYTICS_PY = '''
+"""
+Thống kê pattern đặt lịch tính hoàn toàn trên DB.
+
+Mỗi nhóm (phòng ban, vai trò, thiết bị, phòng ban × vai trò) là một query
+values().annotate() GROUP BY; thời lượng trung bình tính bằng biểu thức
+return_time - pickup_time trong SQL. Chi phí chỉ phụ thuộc số nhóm trả về,
+không phải số đơn phải duyệt qua trong Python. Kết quả được lưu vào
+BookingPatternSnapshot và cache bản mới nhất.
+"""
+import logging
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Q
+from django.utils import timezone
+
+from .models import Booking, BookingPatternSnapshot
+
+logger = logging.getLogger(__name__)
+
+SUCCESS_STATUSES = ['approved', 'completed']
+LATEST_KEY = 'booking_patterns:latest'
+
+# Tên nhóm -> {tên cột kết quả: đường dẫn field}
+GROUPS = {
+    'departments': {'department': 'equipment__department__name'},
+    'roles': {'role': 'user__userprofile__role'},
+    'equipment': {'equipment_code': 'equipment__code', 'equipment_name': 'equipment__name'},
+    'patterns': {'department': 'equipment__department__name', 'role': 'user__userprofile__role'},
+}
+
+
+def duration():
+    return ExpressionWrapper(F('return_time') - F('pickup_time'), output_field=DurationField())
+
+
+def group_stats(queryset, columns):
+    """Một query GROUP BY: số đơn, số đơn thành công, thời lượng trung bình"""
+    rows = (
+        queryset.order_by()
+        .values(**{name: F(path) for name, path in columns.items()})
+        .annotate(
+            total=Count('id'),
+            approved=Count('id', filter=Q(status__in=SUCCESS_STATUSES)),
+            avg_duration=Avg(duration()),
+            equipment_types=Count('equipment__name', distinct=True),
+        )
+        .order_by('-total')
+    )
+    results = []
+    for row in rows:
+        avg = row.pop('avg_duration')
+        row['approval_rate'] = round(row['approved'] * 100 / row['total'], 1)
+        row['avg_duration_hours'] = round(avg.total_seconds() / 3600, 2) if avg else 0
+        results.append(row)
+    return results
+
+
+def booking_pattern_stats(since, until=None):
+    """Thống kê các đơn tạo trong [since, until)"""
+    queryset = Booking.objects.filter(created_at__gte=since)
+    if until is not None:
+        queryset = queryset.filter(created_at__lt=until)
+    stats = {name: group_stats(queryset, fields) for name, fields in GROUPS.items()}
+    stats['total'] = sum(row['total'] for row in stats['departments'])
+    return stats
+
+
+def take_snapshot(days=30):
+    """Tính thống kê cho `days` ngày gần nhất, lưu DB và cache"""
+    period_end = timezone.now()
+    period_start = period_end - timedelta(days=days)
+    stats = booking_pattern_stats(period_start, period_end)
+    snapshot = BookingPatternSnapshot.objects.create(
+        period_start=period_start,
+        period_end=period_end,
+        booking_count=stats['total'],
+        stats=stats,
+    )
+    cache.set(LATEST_KEY, snapshot, timeout=None)
+    return snapshot
+
+
+def latest_snapshot():
+    """Snapshot mới nhất (cache, rồi tới DB)"""
+    snapshot = cache.get(LATEST_KEY)
+    if snapshot is None:
+        snapshot = BookingPatternSnapshot.objects.first()
+        if snapshot is not None:
+            cache.set(LATEST_KEY, snapshot, timeout=None)
+    return snapshot
+'''
+
+# dnu_lab_system/lab_management/rollups.py
+ROLLUPS_PY = '''
+"""
+Bảng tổng hợp sử dụng theo ngày (rollup) cho báo cáo.
+
+Mỗi lần đơn được tạo/sửa/xóa, ngày nhận thiết bị của đơn được đánh dấu trong
+UsageRollupDirtyDay ngay sau khi transaction của thay đổi commit, để các đơn
+cùng ngày không phải chờ nhau trên khóa dòng của ngày đó trong lúc đặt lịch
+(nếu process dừng đúng giữa commit và lúc đánh dấu, `usage_rollups --rebuild`
+sẽ sửa lại). Task refresh_usage_rollups
+chạy định kỳ, chỉ tính lại các ngày bị đánh dấu: xóa dòng rollup cũ của những
+ngày đó rồi ghi lại từ một query GROUP BY trên Booking. Báo cáo theo tháng/năm
+chỉ đọc DailyEquipmentUsage/DailyDepartmentUsage.
+
+Một đơn được tính vào ngày nhận thiết bị (theo TIME_ZONE), số giờ sử dụng chỉ
+tính các đơn approved/completed.
+"""
+import calendar
+import logging
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Max, Q, Sum, Value
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .models import (
+    Booking, DailyDepartmentUsage, DailyEquipmentUsage, Equipment, UsageRollupDirtyDay,
+)
+
+logger = logging.getLogger(__name__)
+
+USED_STATUSES = ['approved', 'completed']
+
+
+def local_day(value):
+    return timezone.localtime(value).date()
+
+
+def mark_dirty(days):
+    """
+    Đánh dấu các ngày cần tính lại sau khi transaction hiện tại commit.
+
+    Upsert chạy trong autocommit nên khóa dòng của ngày chỉ giữ trong một câu
+    lệnh, không kéo dài theo transaction đặt lịch. marked_at lấy sau commit
+    nên refresh_dirty bắt đầu trước đó sẽ không xóa dấu của thay đổi này.
+    """
+    days = {day for day in days if day is not None}
+    if days:
+        transaction.on_commit(lambda: upsert_dirty(days))
+
+
+def upsert_dirty(days):
+    now = timezone.now()
+    UsageRollupDirtyDay.objects.bulk_create(
+        [UsageRollupDirtyDay(day=day, marked_at=now) for day in days],
+        update_conflicts=True, unique_fields=['day'], update_fields=['marked_at'],
+    )
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def recompute_days(days):
+    """Tính lại rollup cho các ngày đã cho (2 query đọc, 4 query ghi)"""
+    days = sorted(set(days))
+    if not days:
+        return 0
+    start, end = day_bounds(days[0])[0], day_bounds(days[-1])[1]
+    hours = ExpressionWrapper(F('return_time') - F('pickup_time'), output_field=DurationField())
+    rows = (
+        Booking.objects.filter(pickup_time__gte=start, pickup_time__lt=end)
+        .annotate(day=TruncDate('pickup_time'))
+        .filter(day__in=days)
+        .order_by()
+        .values('day', 'equipment_id', 'equipment__department_id')
+        .annotate(
+            total=Count('id'),
+            approved=Count('id', filter=Q(status__in=USED_STATUSES)),
+            hours=Sum(hours, filter=Q(status__in=USED_STATUSES)),
+        )
+    )
+    equipment_rows = [
+        DailyEquipmentUsage(
+            date=row['day'],
+            equipment_id=row['equipment_id'],
+            department_id=row['equipment__department_id'],
+            bookings=row['total'],
+            approved=row['approved'],
+            hours_booked=row['hours'].total_seconds() / 3600 if row['hours'] else 0,
+        )
+        for row in rows
+    ]
+
+    department_rows = {}
+    for row in equipment_rows:
+        key = (row.date, row.department_id)
+        total = department_rows.setdefault(key, DailyDepartmentUsage(
+            date=row.date, department_id=row.department_id,
+        ))
+        total.bookings += row.bookings
+        total.approved += row.approved
+        total.hours_booked += row.hours_booked
+    equipment_counts = dict(
+        Equipment.objects.order_by().values_list('department_id').annotate(n=Count('id'))
+    )
+    for (_, department_id), total in department_rows.items():
+        total.equipment_count = equipment_counts.get(department_id, 0)
+
+    with transaction.atomic():
+        DailyEquipmentUsage.objects.filter(date__in=days).delete()
+        DailyDepartmentUsage.objects.filter(date__in=days).delete()
+        DailyEquipmentUsage.objects.bulk_create(equipment_rows, batch_size=500)
+        DailyDepartmentUsage.objects.bulk_create(department_rows.values(), batch_size=500)
+    return len(equipment_rows)
+
+
+def refresh_dirty(batch_days=31):
+    """Tính lại các ngày bị đánh dấu, trả về số ngày đã xử lý"""
+    started = timezone.now()
+    dirty = list(
+        UsageRollupDirtyDay.objects.filter(marked_at__lte=started)
+        .order_by('day').values_list('day', flat=True)
+    )
+    for i in range(0, len(dirty), batch_days):
+        chunk = dirty[i:i + batch_days]
+        recompute_days(chunk)
+        # Ngày bị đánh dấu lại trong lúc tính vẫn giữ cho lần chạy sau
+        UsageRollupDirtyDay.objects.filter(day__in=chunk, marked_at__lte=started).delete()
+    if dirty:
+        logger.info(f"Refreshed usage rollups for {len(dirty)} days ({dirty[0]} .. {dirty[-1]})")
+    return len(dirty)
+
+
+def rebuild(since=None):
+    """Đánh dấu toàn bộ (hoặc từ `since`) các ngày có đơn rồi tính lại"""
+    queryset = Booking.objects.all()
+    if since is not None:
+        queryset = queryset.filter(pickup_time__gte=day_bounds(since)[0])
+    days = set(
+        queryset.annotate(day=TruncDate('pickup_time')).order_by()
+        .values_list('day', flat=True).distinct()
+    )
+    stale = DailyEquipmentUsage.objects.all()
+    if since is not None:
+        stale = stale.filter(date__gte=since)
+    days |= set(stale.values_list('date', flat=True).distinct())
+    mark_dirty(days)
+    return refresh_dirty()
+
+
+def monthly_usage(start, end, by='department'):
+    """
+    Báo cáo theo tháng từ bảng rollup.
+
+    by='department' hoặc 'equipment'; trả về list dict theo (tháng, nhóm).
+    """
+    if by == 'equipment':
+        model, group = DailyEquipmentUsage, {'name': F('equipment__name'), 'code': F('equipment__code')}
+        capacity = Max(Value(1))
+    else:
+        model, group = DailyDepartmentUsage, {'name': F('department__name')}
+        capacity = Max('equipment_count')
+    rows = (
+        model.objects.filter(date__gte=start, date__lt=end)
+        .annotate(month=TruncMonth('date'))
+        .order_by()
+        .values('month', **group)
+        .annotate(
+            total=Sum('bookings'),
+            approved_total=Sum('approved'),
+            hours=Sum('hours_booked'),
+            active_days=Count('date', distinct=True),
+            equipment=capacity,
+        )
+        .order_by('month', '-hours')
+    )
+    results = []
+    for row in rows:
+        row['approval_rate'] = round(row['approved_total'] * 100 / row['total'], 1) if row['total'] else 0
+        row['hours'] = round(row['hours'] or 0, 1)
+        # Tỷ lệ sử dụng = giờ đã dùng / (số thiết bị × 24h × số ngày trong tháng)
+        month_hours = 24 * calendar.monthrange(row['month'].year, row['month'].month)[1]
+        equipment = row.pop('equipment') or 0
+        row['utilization'] = round(row['hours'] * 100 / (month_hours * equipment), 1) if equipment else 0
+        results.append(row)
+    return results
+'''
+
+# dnu_lab_system/lab_management/management/commands/usage_rollups.py
+USAGE_ROLLUPS_PY = '''
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from lab_management.rollups import monthly_usage, rebuild, refresh_dirty
+
+
+class Command(BaseCommand):
+    help = 'Refresh or rebuild daily usage rollups and print a monthly report from them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recompute every day that has bookings')
+        parser.add_argument('--since', help='With --rebuild: only days from YYYY-MM-DD')
+        parser.add_argument('--months', type=int, default=0, help='Print a report for the last N months')
+        parser.add_argument('--by', choices=['department', 'equipment'], default='department')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['rebuild']:
+            try:
+                since = date.fromisoformat(options['since']) if options['since'] else None
+            except ValueError:
+                raise CommandError('--since must be YYYY-MM-DD')
+            days = rebuild(since)
+        else:
+            days = refresh_dirty()
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Recomputed {days} days in {time.perf_counter() - started:.2f}s'
+        ))
+
+        if options['months']:
+            today = timezone.localdate()
+            start = (today - timedelta(days=31 * (options['months'] - 1))).replace(day=1)
+            started = time.perf_counter()
+            rows = monthly_usage(start, today + timedelta(days=1), by=options['by'])
+            elapsed = (time.perf_counter() - started) * 1000
+
+            self.stdout.write(f'\\n📅 Monthly usage by {options["by"]} ({elapsed:.1f}ms):')
+            for row in rows:
+                self.stdout.write(
+                    f'  {row["month"]:%m/%Y} {row["name"]}: {row["total"]} bookings, '
+                    f'{row["approval_rate"]:.1f}% approved, {row["hours"]}h, '
+                    f'{row["utilization"]}% utilization'
+                )
+'''
+
+# dnu_lab_system/lab_management/availability.py
+AVAILABILITY_PY = '''
+"""
+Bitmap lịch trống của thiết bị.
+
+Mỗi (thiết bị, ngày) là một số nguyên có SLOTS_PER_DAY bit, bit i = 1 nghĩa là
+khung [i * SLOT_MINUTES, (i + 1) * SLOT_MINUTES) đã có đơn approved/pending
+giữ chỗ. Bitmap được cache với key chứa phiên bản index của thiết bị
+(booking_index:v:<id>); mỗi lần đơn thay đổi, signals tăng phiên bản nên
+bitmap cũ tự hết hiệu lực. Các bitmap còn thiếu được tính bằng một query cho
+tất cả thiết bị, nên câu hỏi "thiết bị nào trống 14:00-16:00 thứ Ba" trên
+hàng trăm thiết bị chỉ là một phép AND trên mỗi bitmap.
+
+Phiên bản bị thiếu (chưa có hoặc đã bị cache đẩy ra) được khởi tạo bằng một giá
+trị mới theo thời gian thay vì 0, để không đọc lại bitmap của phiên bản cũ.
+"""
+import time as clock
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .booking_index import VERSION_KEY
+from .models import Booking
+
+CACHE_KEY = 'availability:{}:{}:{}'
+
+
+def slot_minutes():
+    return getattr(settings, 'AVAILABILITY_SLOT_MINUTES', 15)
+
+
+def slots_per_day():
+    return 24 * 60 // slot_minutes()
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def slot_mask(day, start, end):
+    """Các bit của `day` giao với [start, end)"""
+    begin = day_start(day)
+    step = timedelta(minutes=slot_minutes())
+    first = max(0, int((start - begin) // step))
+    # Làm tròn lên: khung chỉ giao một phần cũng tính là bận
+    last = min(slots_per_day(), -int(-(end - begin) // step))
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def days_between(start, end):
+    """Các ngày (theo TIME_ZONE) mà [start, end) đi qua"""
+    day = timezone.localtime(start).date()
+    last = timezone.localtime(end - timedelta(microseconds=1)).date()
+    days = []
+    while day <= last:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+class AvailabilityBitmaps:
+    """Đọc bitmap từ cache, tính phần còn thiếu bằng một query"""
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'AVAILABILITY_CACHE_TTL', 3600)
+
+    def versions(self, equipment_ids):
+        """{equipment_id: phiên bản}; None nếu cache không giữ được phiên bản"""
+        keys = {eid: VERSION_KEY.format(eid) for eid in equipment_ids}
+        versions = cache.get_many(keys.values())
+        missing = [key for key in keys.values() if key not in versions]
+        if missing:
+            seed = clock.time_ns()
+            for key in missing:
+                cache.add(key, seed, timeout=None)
+            versions.update(cache.get_many(missing))
+        return {eid: versions.get(key) for eid, key in keys.items()}
+
+    def bitmaps(self, equipment_ids, days):
+        """Trả về {(equipment_id, day): bitmap}"""
+        equipment_ids, days = list(equipment_ids), list(days)
+        versions = self.versions(equipment_ids)
+        keys = {
+            (eid, day): CACHE_KEY.format(eid, versions[eid], day.isoformat())
+            for eid in equipment_ids for day in days
+            if versions[eid] is not None
+        }
+        cached = cache.get_many(keys.values())
+        result = {slot: cached[key] for slot, key in keys.items() if key in cached}
+
+        missing = [(eid, day) for eid in equipment_ids for day in days if (eid, day) not in result]
+        if missing:
+            computed = self.compute({eid for eid, _ in missing}, {day for _, day in missing})
+            fresh = {slot: computed.get(slot, 0) for slot in missing}
+            cache.set_many(
+                {keys[slot]: bitmap for slot, bitmap in fresh.items() if slot in keys}, timeout=self.ttl
+            )
+            result.update(fresh)
+        return result
+
+    def compute(self, equipment_ids, days):
+        """Tính bitmap từ các đơn đang giữ chỗ (một query)"""
+        days = sorted(days)
+        range_start = day_start(days[0])
+        range_end = day_start(days[-1]) + timedelta(days=1)
+        wanted = set(days)
+        bitmaps = {}
+        rows = Booking.objects.filter(
+            equipment_id__in=equipment_ids,
+            status__in=Booking.ACTIVE_STATUSES,
+            pickup_time__lt=range_end,
+            return_time__gt=range_start,
+        ).values_list('equipment_id', 'pickup_time', 'return_time')
+        for equipment_id, start, end in rows:
+            for day in days_between(max(start, range_start), min(end, range_end)):
+                if day in wanted:
+                    key = (equipment_id, day)
+                    bitmaps[key] = bitmaps.get(key, 0) | slot_mask(day, start, end)
+        return bitmaps
+
+    def free_equipment(self, equipment_ids, start, end):
+        """Các thiết bị không có khung bận nào trong [start, end)"""
+        equipment_ids = list(equipment_ids)
+        days = days_between(start, end)
+        masks = {day: slot_mask(day, start, end) for day in days}
+        bitmaps = self.bitmaps(equipment_ids, days)
+        return [
+            eid for eid in equipment_ids
+            if not any(bitmaps[(eid, day)] & mask for day, mask in masks.items())
+        ]
+
+    def busy_ranges(self, bitmap, day):
+        """Chuyển bitmap thành danh sách khoảng bận [(bắt đầu, kết thúc)] dạng HH:MM"""
+        step = slot_minutes()
+        ranges, i, total = [], 0, slots_per_day()
+        while i < total:
+            if bitmap >> i & 1:
+                j = i
+                while j < total and bitmap >> j & 1:
+                    j += 1
+                ranges.append((minutes_label(i * step), minutes_label(j * step)))
+                i = j
+            else:
+                i += 1
+        return ranges
+
+
+def minutes_label(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+availability = AvailabilityBitmaps()
+'''
+
+# dnu_lab_system/lab_management/catalog.py
+CATALOG_PY = '''
+"""
+Cache cho trang danh sách thiết bị.
+
+Mọi key đều chứa một số thế hệ (catalog:generation). Signals của Equipment và
+Department tăng số này sau khi commit, nên danh sách phòng ban, kết quả query
+theo từng phòng ban và các template fragment cũ cùng hết hiệu lực mà không
+cần xóa từng key. equipment_list còn trả ETag/Last-Modified để trình duyệt
+dùng lại trang khi không có gì thay đổi (304, không query DB).
+
+Last-Modified lấy mốc muộn hơn giữa updated_at mới nhất và lần tăng thế hệ
+gần nhất (catalog:changed_at), vì xóa thiết bị không làm Max(updated_at) đổi.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.translation import get_language
+
+from .models import Department, Equipment
+
+GENERATION_KEY = 'catalog:generation'
+CHANGED_KEY = 'catalog:changed_at'
+
+
+def catalog_timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 3600)
+
+
+def generation():
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        value = cache.get(GENERATION_KEY, 1)
+    return value
+
+
+def bump_generation():
+    """Làm mới toàn bộ cache danh mục (gọi từ signals)"""
+    cache.set(CHANGED_KEY, timezone.now(), timeout=None)
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 2, timeout=None)
+        return 2
+
+
+def changed_at():
+    """Lần tăng thế hệ gần nhất; mất khỏi cache thì coi như vừa thay đổi"""
+    value = cache.get(CHANGED_KEY)
+    if value is None:
+        cache.add(CHANGED_KEY, timezone.now(), timeout=None)
+        value = cache.get(CHANGED_KEY) or timezone.now()
+    return value
+
+
+def cached(name, compute):
+    key = f'catalog:{generation()}:{name}'
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout=catalog_timeout())
+    return value
+
+
+def department_choices():
+    """[(id, name)] cho bộ lọc phòng ban"""
+    return cached('departments', lambda: list(
+        Department.objects.order_by('name').values_list('id', 'name')
+    ))
+
+
+def available_equipment(department_id=None):
+    """Thiết bị có sẵn (kèm phòng ban) của một phòng ban hoặc tất cả"""
+    def compute():
+        queryset = Equipment.objects.filter(status='available').select_related('department')
+        if department_id:
+            queryset = queryset.filter(department_id=department_id)
+        return list(queryset)
+    return cached(f'equipment:{department_id or "all"}', compute)
+
+
+def last_modified(department_id=None):
+    """Thời điểm sửa cuối trong phạm vi đang xem (kể cả xóa thiết bị)"""
+    def compute():
+        queryset = Equipment.objects.all()
+        if department_id:
+            queryset = queryset.filter(department_id=department_id)
+        # Bọc trong tuple để phân biệt "chưa cache" với "không có thiết bị"
+        return (queryset.aggregate(latest=Max('updated_at'))['latest'],)
+    latest = cached(f'last_modified:{department_id or "all"}', compute)[0]
+    changed = changed_at()
+    return max(latest, changed) if latest else changed
+
+
+def reusable(request):
+    """
+    Trình duyệt có được dùng lại bản đang giữ không: không khi token CSRF sẽ
+    được tạo trong lần render này hoặc còn flash message chưa hiển thị.
+    """
+    return bool(request.META.get('CSRF_COOKIE')) and not len(messages.get_messages(request))
+
+
+def etag(request, department_id=None):
+    """
+    ETag của trang: thế hệ cache, phòng ban, thời điểm sửa cuối và những gì
+    trang hiển thị riêng cho người xem (user, ngôn ngữ, CSRF token).
+    """
+    if not reusable(request):
+        return None
+    csrf_secret = request.META.get('CSRF_COOKIE')
+    parts = [
+        generation(),
+        department_id or 'all',
+        last_modified(department_id),
+        request.user.pk,
+        get_language(),
+        csrf_secret,
+    ]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+'''
+
+# dnu_lab_system/lab_management/search.py
+SEARCH_PY = '''
+"""
+Tìm kiếm toàn văn trên danh mục thiết bị (name, code, description,
+specifications, ai_description).
+
+- PostgreSQL: cột sinh tự động search_vector (tsvector, bỏ dấu bằng unaccent)
+  có GIN index, cộng trigram similarity trên tên đã bỏ dấu để gõ "may hien
+  song" vẫn ra "Máy hiện sóng".
+- SQLite: bảng ảo FTS5 (unicode61 remove_diacritics) đồng bộ bằng trigger.
+  unicode61 không coi đ là d có dấu, nên trigger và truy vấn tự đổi đ/Đ -> d/D.
+- DB khác: icontains trên các cột.
+
+Cột/bảng index được tạo bằng DDL riêng cho từng DB sau migrate (giống
+exclusion constraint trong reservations), và được DB tự cập nhật khi lưu,
+kể cả qua bulk_create/bulk_update. Khi định nghĩa index thay đổi (thêm cột,
+đổi trigger) DDL cũ được thay và dữ liệu được index lại.
+"""
+import logging
+import re
+
+from django.db import OperationalError, connections
+from django.db.models import Q
+
+from .models import Equipment
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'lab_equipment_fts'
+FTS_COLUMNS = ['name', 'code', 'description', 'specifications', 'ai_description']
+# Trọng số bm25 theo thứ tự FTS_COLUMNS
+FTS_WEIGHTS = (10.0, 10.0, 2.0, 2.0, 1.0)
+# Đánh dấu định nghĩa search_vector hiện tại trên PostgreSQL (COMMENT ON COLUMN)
+SEARCH_VECTOR_VERSION = 'lab_search:2'
+
+
+def fold_d(text):
+    """đ/Đ -> d/D (unicode61 remove_diacritics không gộp chữ này)"""
+    return text.replace('đ', 'd').replace('Đ', 'D')
+
+
+def fold_d_sql(expression):
+    return f"replace(replace({expression}, 'đ', 'd'), 'Đ', 'D')"
+
+
+def search_backend(using='default'):
+    vendor = connections[using].vendor
+    if vendor == 'postgresql':
+        return 'postgresql'
+    if vendor == 'sqlite' and sqlite_fts_ready(using):
+        return 'sqlite'
+    return 'basic'
+
+
+def sqlite_fts_ready(using='default'):
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE]
+        )
+        return cursor.fetchone()[0] == 1
+
+
+def install_search_index(using='default', **kwargs):
+    """Tạo index tìm kiếm cho DB hiện tại (post_migrate, chạy lại an toàn)"""
+    conn = connections[using]
+    table = Equipment._meta.db_table
+    if conn.vendor == 'postgresql':
+        install_postgres(conn, table)
+    elif conn.vendor == 'sqlite':
+        install_sqlite(conn, table)
+
+
+def install_postgres(conn, table):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT col_description(attrelid, attnum) FROM pg_attribute "
+            "WHERE attrelid = %s::regclass AND attname = 'search_vector' AND NOT attisdropped",
+            [table],
+        )
+        row = cursor.fetchone()
+        if row and row[0] != SEARCH_VECTOR_VERSION:
+            # Định nghĩa cũ (chưa có code): bỏ cột, GIN index đi theo cột
+            cursor.execute(f'ALTER TABLE {table} DROP COLUMN search_vector')
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS unaccent')
+        # unaccent() không IMMUTABLE nên không dùng trực tiếp trong index/cột sinh
+        cursor.execute(
+            "CREATE OR REPLACE FUNCTION lab_unaccent(text) RETURNS text AS "
+            "$$ SELECT public.unaccent('public.unaccent', $1) $$ "
+            "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT"
+        )
+        cursor.execute(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS ("
+            f"setweight(to_tsvector('simple', lab_unaccent("
+            f"coalesce(name, '') || ' ' || coalesce(code, ''))), 'A') || "
+            f"setweight(to_tsvector('simple', lab_unaccent("
+            f"coalesce(description, '') || ' ' || coalesce(specifications, ''))), 'B') || "
+            f"setweight(to_tsvector('simple', lab_unaccent(coalesce(ai_description, ''))), 'C')"
+            f") STORED"
+        )
+        cursor.execute(f"COMMENT ON COLUMN {table}.search_vector IS '{SEARCH_VECTOR_VERSION}'")
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS equipment_search_vector_idx ON {table} USING gin (search_vector)'
+        )
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS equipment_name_trgm_idx ON {table} '
+            f'USING gin (lab_unaccent(lower(name)) gin_trgm_ops)'
+        )
+
+
+def install_sqlite(conn, table):
+    columns = ', '.join(FTS_COLUMNS)
+    new_values = ', '.join(fold_d_sql(f'new.{column}') for column in FTS_COLUMNS)
+    old_values = ', '.join(fold_d_sql(f'old.{column}') for column in FTS_COLUMNS)
+    triggers = {
+        f'{FTS_TABLE}_ai': f'AFTER INSERT ON {table} BEGIN '
+                           f'INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END',
+        f'{FTS_TABLE}_ad': f'AFTER DELETE ON {table} BEGIN '
+                           f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) "
+                           f"VALUES ('delete', old.id, {old_values}); END",
+        f'{FTS_TABLE}_au': f'AFTER UPDATE ON {table} BEGIN '
+                           f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) "
+                           f"VALUES ('delete', old.id, {old_values}); "
+                           f'INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END',
+    }
+    with conn.cursor() as cursor:
+        cursor.execute(f'PRAGMA table_info({FTS_TABLE})')
+        current_columns = [row[1] for row in cursor.fetchall()]
+        if current_columns and current_columns != FTS_COLUMNS:
+            cursor.execute(f'DROP TABLE {FTS_TABLE}')
+        try:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({columns}, '
+                f"content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            )
+        except OperationalError as e:
+            logger.warning(f"SQLite FTS5 unavailable, search falls back to icontains: {e}")
+            return
+        cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [table]
+        )
+        existing = dict(cursor.fetchall())
+        changed = [
+            name for name, body in triggers.items()
+            if existing.get(name) != f'CREATE TRIGGER {name} {body}'
+        ]
+        for name in changed:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(f'CREATE TRIGGER {name} {triggers[name]}')
+        if changed or current_columns != FTS_COLUMNS:
+            # Trigger mất/đổi khi migration dựng lại bảng hoặc khi nâng cấp:
+            # index lại toàn bộ ('rebuild' đọc bảng gốc nên sẽ không đổi đ -> d)
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')")
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE}(rowid, {columns}) '
+                f"SELECT id, {', '.join(fold_d_sql(column) for column in FTS_COLUMNS)} FROM {table}"
+            )
+
+
+def fts_query(text):
+    """Chuỗi người dùng -> truy vấn FTS5: mọi từ (dạng tiền tố) đều phải có"""
+    return ' '.join(f'"{token}"*' for token in re.findall(r'\w+', fold_d(text)))
+
+
+def search_equipment_ids(query, department_id=None, available_only=True, limit=50, using='default'):
+    """Id thiết bị khớp `query`, xếp theo độ liên quan"""
+    query = ' '.join((query or '').split())
+    if not query:
+        return []
+    backend = search_backend(using)
+    if backend == 'basic':
+        return list(icontains_search(query, department_id, available_only).values_list('id', flat=True)[:limit])
+
+    table = Equipment._meta.db_table
+    filters, params = [], []
+    if department_id:
+        filters.append('e.department_id = %s')
+        params.append(department_id)
+    if available_only:
+        filters.append("e.status = 'available'")
+    extra = ''.join(f' AND {condition}' for condition in filters)
+
+    with connections[using].cursor() as cursor:
+        if backend == 'postgresql':
+            cursor.execute(
+                f'SELECT e.id FROM {table} e, websearch_to_tsquery(%s, lab_unaccent(%s)) q '
+                f'WHERE (e.search_vector @@ q OR lab_unaccent(lower(e.name)) %% lab_unaccent(lower(%s))){extra} '
+                f'ORDER BY ts_rank(e.search_vector, q) '
+                f'+ similarity(lab_unaccent(lower(e.name)), lab_unaccent(lower(%s))) DESC, e.id '
+                f'LIMIT %s',
+                ['simple', query, query] + params + [query, limit],
+            )
+        else:
+            terms = fts_query(query)
+            if not terms:
+                return []
+            weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+            cursor.execute(
+                f'SELECT e.id FROM {FTS_TABLE} f JOIN {table} e ON e.id = f.rowid '
+                f'WHERE {FTS_TABLE} MATCH %s{extra} '
+                f'ORDER BY bm25({FTS_TABLE}, {weights}), e.id LIMIT %s',
+                [terms] + params + [limit],
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_equipment(query, department_id=None, available_only=True, limit=50):
+    """Thiết bị (kèm phòng ban) khớp `query`, giữ thứ tự liên quan"""
+    ids = search_equipment_ids(query, department_id, available_only, limit)
+    by_id = Equipment.objects.select_related('department').in_bulk(ids)
+    return [by_id[equipment_id] for equipment_id in ids if equipment_id in by_id]
+
+
+def icontains_search(query, department_id=None, available_only=True):
+    """Quét icontains trên các cột (fallback và mốc so sánh cho benchmark)"""
+    condition = Q()
+    for column in FTS_COLUMNS:
+        condition |= Q(**{f'{column}__icontains': query})
+    queryset = Equipment.objects.filter(condition).order_by('id')
+    if department_id:
+        queryset = queryset.filter(department_id=department_id)
+    if available_only:
+        queryset = queryset.filter(status='available')
+    return queryset
+'''
+
+# dnu_lab_system/lab_management/management/commands/benchmark_search.py
+BENCHMARK_SEARCH_PY = '''
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from lab_management.autocomplete import autocomplete
+from lab_management.models import Department, Equipment
+from lab_management.name_index import lookup_ids, rebuild
+from lab_management.search import icontains_search, install_search_index, search_backend, search_equipment_ids
+
+KINDS = ['Máy hiện sóng', 'Kính hiển vi', 'Máy đo điện', 'Bộ nguồn', 'Máy phát xung',
+         'Cân phân tích', 'Máy ly tâm', 'Tủ sấy', 'Máy quang phổ', 'Bộ thí nghiệm vi điều khiển']
+BRANDS = ['Tektronix', 'Rigol', 'Keysight', 'Olympus', 'Nikon', 'Hioki', 'Fluke', 'Sartorius']
+WORDS = ['kênh', 'băng thông', 'độ phân giải', 'cảm biến', 'màn hình', 'điện áp', 'tần số',
+         'nhiệt độ', 'chính xác', 'di động', 'phòng thí nghiệm', 'sinh viên', 'bảo hành']
+QUERIES = ['máy hiện sóng', 'may hien song', 'Rigol', 'kính hiển vi Nikon', 'tần số', 'quang phổ', '99999']
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark catalog search, name prefix lookups and autocomplete against icontains scans (data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100000, help='Equipment rows to generate (default: 100000)')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query (default: 5)')
+        parser.add_argument('--limit', type=int, default=50, help='Results per search (default: 50)')
+
+    def handle(self, *args, **options):
+        install_search_index()
+        self.stdout.write(f'Search backend: {search_backend()}')
+        try:
+            with transaction.atomic():
+                self.seed(options['items'])
+                self.run(options['repeat'], options['limit'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def seed(self, count):
+        started = time.perf_counter()
+        department, _ = Department.objects.get_or_create(code='SRCHB', defaults={'name': 'Search benchmark'})
+        rng = random.Random(42)
+        rows = [
+            Equipment(
+                name=f'{rng.choice(KINDS)} {rng.choice(BRANDS)} {i}',
+                code=f'SRCHB-{i}',
+                department=department,
+                description=' '.join(rng.sample(WORDS, 5)),
+                specifications=f'{rng.choice(WORDS)} {rng.randint(1, 500)}',
+            )
+            for i in range(count)
+        ]
+        Equipment.objects.bulk_create(rows, batch_size=2000)
+        self.stdout.write(f'Seeded {count} equipment in {time.perf_counter() - started:.1f}s')
+        # bulk_create bỏ qua signals nên dựng lại index tên
+        started = time.perf_counter()
+        terms = rebuild(['equipment'])['equipment']
+        self.stdout.write(f'Indexed {terms} name terms in {time.perf_counter() - started:.1f}s')
+        started = time.perf_counter()
+        autocomplete.clear()
+        autocomplete.search('equipment', 'a')
+        self.stdout.write(
+            f'Built autocomplete ({autocomplete.stats()["equipment"]} keys) in {time.perf_counter() - started:.1f}s'
+        )
+
+    def timed(self, func, repeat):
+        timings, result = [], None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return sorted(timings)[len(timings) // 2], result
+
+    def run(self, repeat, limit):
+        self.stdout.write(
+            f'{"query":<22} {"index ms":>9} {"hits":>5} {"icontains ms":>13} {"hits":>5} '
+            f'{"name prefix ms":>15} {"hits":>5} {"autocomplete ms":>16}'
+        )
+        for query in QUERIES:
+            index_ms, index_ids = self.timed(
+                lambda: search_equipment_ids(query, available_only=False, limit=limit), repeat
+            )
+            scan_ms, scan_ids = self.timed(
+                lambda: list(icontains_search(query, available_only=False).values_list('id', flat=True)[:limit]),
+                repeat,
+            )
+            prefix_ms, prefix_ids = self.timed(lambda: lookup_ids('equipment', query, limit), repeat)
+            suggest_ms, _ = self.timed(lambda: autocomplete.search('equipment', query, 10), repeat)
+            self.stdout.write(
+                f'{query:<22} {index_ms:>9.1f} {len(index_ids):>5} {scan_ms:>13.1f} {len(scan_ids):>5} '
+                f'{prefix_ms:>15.1f} {len(prefix_ids):>5} {suggest_ms:>16.3f}'
+            )
+'''
+
+# dnu_lab_system/lab_management/name_index.py
+NAME_INDEX_PY = '''
+"""
+Index tên đã chuẩn hóa (bỏ dấu, chữ thường, tách từ) cho thiết bị, phòng ban
+và người dùng, để tra cứu theo tiền tố: gõ "may hien" hay "hien so" đều ra
+"Máy hiện sóng".
+
+Mỗi tên được lưu thành các hậu tố bắt đầu ở ranh giới từ ("may hien song",
+"hien song", "song") trong bảng SearchTerm, nên mọi truy vấn tiền tố chỉ là
+một lần quét khoảng trên B-tree index (kind, term). Index được cập nhật trong
+signals khi tên thay đổi; dữ liệu đưa vào bằng bulk_create thì chạy
+`manage.py rebuild_name_index`. Sau migrate, loại nào có dữ liệu mà chưa có
+term nào (lần đầu nâng cấp) được dựng tự động (post_migrate).
+"""
+import re
+import unicodedata
+
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models import Min
+
+from .models import Department, Equipment, SearchTerm
+
+# kind -> (model, các cột tạo nên tên)
+SOURCES = {
+    'equipment': (Equipment, ('name',)),
+    'department': (Department, ('name',)),
+    # Tên của UserProfile nằm trên auth User
+    'user': (User, ('first_name', 'last_name', 'username')),
+}
+KIND_BY_MODEL = {model: kind for kind, (model, _) in SOURCES.items()}
+
+TERM_LENGTH = SearchTerm._meta.get_field('term').max_length
+REBUILD_BATCH_SIZE = 5000
+
+
+def unaccent(text):
+    """Bỏ dấu tiếng Việt (đ -> d)"""
+    decomposed = unicodedata.normalize('NFD', text.replace('đ', 'd').replace('Đ', 'D'))
+    return ''.join(char for char in decomposed if unicodedata.category(char) != 'Mn')
+
+
+def normalize(text):
+    """'  Máy hiện-sóng ' -> 'may hien song'"""
+    return ' '.join(re.findall(r'\w+', unaccent(text or '').lower()))
+
+
+def name_terms(text):
+    """Các hậu tố bắt đầu ở từng từ của tên đã chuẩn hóa"""
+    words = normalize(text).split()
+    return {' '.join(words[i:])[:TERM_LENGTH] for i in range(len(words))}
+
+
+def indexed_values(instance):
+    """Giá trị các cột tên đang có trên instance (cột bị defer -> None)"""
+    _, fields = SOURCES[KIND_BY_MODEL[type(instance)]]
+    return tuple(instance.__dict__.get(field) for field in fields)
+
+
+def source_text(values):
+    return ' '.join(value for value in values if value)
+
+
+def index_instance(instance):
+    """Ghi lại các term của một đối tượng (gọi trong transaction đang lưu)"""
+    kind = KIND_BY_MODEL[type(instance)]
+    _, fields = SOURCES[kind]
+    text = source_text((getattr(instance, field) for field in fields))
+    remove_instance(kind, instance.pk)
+    SearchTerm.objects.bulk_create([
+        SearchTerm(kind=kind, object_id=instance.pk, term=term) for term in name_terms(text)
+    ])
+
+
+def remove_instance(kind, object_id):
+    SearchTerm.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def rebuild(kinds=None, using='default'):
+    """Dựng lại index từ đầu, trả về {kind: số term}"""
+    terms = SearchTerm.objects.using(using)
+    written = {}
+    for kind in kinds or SOURCES:
+        model, fields = SOURCES[kind]
+        terms.filter(kind=kind).delete()
+        batch, written[kind] = [], 0
+        rows = model.objects.using(using).order_by().values_list('pk', *fields)
+        for row in rows.iterator(chunk_size=REBUILD_BATCH_SIZE):
+            batch.extend(
+                SearchTerm(kind=kind, object_id=row[0], term=term)
+                for term in name_terms(source_text(row[1:]))
+            )
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                terms.bulk_create(batch)
+                written[kind] += len(batch)
+                batch = []
+        terms.bulk_create(batch)
+        written[kind] += len(batch)
+    return written
+
+
+def unindexed_kinds(using='default'):
+    """Các loại có dữ liệu nhưng chưa có term nào (dữ liệu có từ trước index)"""
+    terms = SearchTerm.objects.using(using)
+    return [
+        kind for kind, (model, _) in SOURCES.items()
+        if not terms.filter(kind=kind).exists() and model.objects.using(using).exists()
+    ]
+
+
+def backfill(using='default', **kwargs):
+    """post_migrate: dựng index cho các loại chưa được index"""
+    kinds = unindexed_kinds(using)
+    if kinds:
+        with transaction.atomic(using=using):
+            rebuild(kinds, using)
+
+
+def prefix_filter(prefix, using='default'):
+    """Điều kiện tiền tố dùng được index trên mọi DB"""
+    if connections[using].vendor == 'postgresql':
+        # index varchar_pattern_ops phục vụ LIKE 'prefix%'
+        return {'term__startswith': prefix}
+    # LIKE của SQLite không phân biệt hoa thường nên không dùng được index;
+    # term đã chuẩn hóa nên so sánh khoảng theo byte là chính xác
+    return {'term__gte': prefix, 'term__lt': prefix + '\\uffff'}
+
+
+def matching_terms(kind, query, using='default'):
+    """Các SearchTerm khớp tiền tố `query` (rỗng nếu query không có từ nào)"""
+    prefix = normalize(query)[:TERM_LENGTH]
+    terms = SearchTerm.objects.using(using)
+    if not prefix:
+        return terms.none()
+    return terms.filter(kind=kind, **prefix_filter(prefix, using))
+
+
+def matching_ids(kind, query, using='default'):
+    """Subquery id đối tượng khớp `query`, để lọc tiếp trong DB (id__in=...)"""
+    return matching_terms(kind, query, using).values('object_id')
+
+
+def lookup_ids(kind, query, limit=20, using='default'):
+    """Id đối tượng có một từ trong tên bắt đầu bằng `query` (xếp theo term khớp nhỏ nhất)"""
+    if not normalize(query):
+        return []
+    rows = (
+        matching_terms(kind, query, using)
+        .values('object_id')
+        .annotate(first_term=Min('term'))
+        .order_by('first_term', 'object_id')
+        .values_list('object_id', flat=True)[:limit]
+    )
+    return list(rows)
+'''
+
+# dnu_lab_system/lab_management/management/commands/rebuild_name_index.py
+REBUILD_NAME_INDEX_PY = '''
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from lab_management.name_index import SOURCES, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the diacritic-insensitive name index (after imports that bypass signals)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=list(SOURCES), action='append', help='Only these kinds (repeatable)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        with transaction.atomic():
+            written = rebuild(options['kind'])
+        for kind, count in written.items():
+            self.stdout.write(f'  {kind}: {count} terms')
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Rebuilt name index in {time.perf_counter() - started:.2f}s'
+        ))
+'''
+
+# dnu_lab_system/lab_management/autocomplete.py
+AUTOCOMPLETE_PY = '''
+"""
+Autocomplete (gõ tới đâu gợi ý tới đó) cho mã/tên thiết bị và mã sinh viên.
+
+Mỗi nguồn là một mảng đã sắp xếp các cặp (khóa đã chuẩn hóa, id) trong bộ nhớ
+của từng process: tìm theo tiền tố là một lần bisect rồi đọc tuần tự, không
+query DB. Mảng được dựng lười ở lần dùng đầu tiên từ một lần quét values_list
+và cập nhật dần qua signals.
+
+Giống booking_index, mỗi thay đổi tăng số phiên bản của nguồn trong Django
+cache; process khác thấy phiên bản lệch (kiểm tra tối đa mỗi
+AUTOCOMPLETE_VERSION_CHECK_SECONDS giây) sẽ dựng lại nguồn đó. Mỗi process chỉ
+dựng lại một lần cho mỗi phiên bản: một thread dựng, các thread khác dùng tạm
+bản cũ. Vì vậy khi chạy nhiều worker cache phải dùng chung (CACHE_URL); với
+locmem process khác không thấy thay đổi (check lab_management.W001).
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+
+from .name_index import name_terms, normalize
+
+VERSION_KEY = 'autocomplete:v:{}'
+
+
+def equipment_rows(ids=None):
+    """(id, nhãn, các khóa): mã thiết bị và từng hậu tố của tên"""
+    from .models import Equipment
+    queryset = Equipment.objects.order_by()
+    if ids is not None:
+        queryset = queryset.filter(id__in=ids)
+    for pk, code, name in queryset.values_list('id', 'code', 'name').iterator():
+        yield pk, {'code': code, 'name': name}, {normalize(code)} | name_terms(name)
+
+
+def student_rows(ids=None):
+    """(user_id, nhãn, các khóa): mã sinh viên và từng hậu tố của họ tên"""
+    from .models import UserProfile
+    queryset = UserProfile.objects.exclude(student_id='').order_by()
+    if ids is not None:
+        queryset = queryset.filter(user_id__in=ids)
+    rows = queryset.values_list('user_id', 'student_id', 'user__first_name', 'user__last_name', 'user__username')
+    for user_id, student_id, first_name, last_name, username in rows.iterator():
+        name = f'{first_name} {last_name}'.strip() or username
+        yield user_id, {'student_id': student_id, 'name': name}, {normalize(student_id)} | name_terms(name)
+
+
+SOURCES = {
+    'equipment': equipment_rows,
+    'student': student_rows,
+}
+
+
+class PrefixIndex:
+    """Mảng (khóa, id) đã sắp xếp của một nguồn"""
+
+    __slots__ = ('entries', 'keys', 'labels', 'version')
+
+    def __init__(self, rows=(), version=None):
+        self.entries, self.keys, self.labels = [], {}, {}
+        for pk, label, keys in rows:
+            self.keys[pk] = keys
+            self.labels[pk] = label
+            self.entries.extend((key, pk) for key in keys if key)
+        self.entries.sort()
+        self.version = version
+
+    def put(self, pk, label, keys):
+        self.remove(pk)
+        self.keys[pk] = keys
+        self.labels[pk] = label
+        for key in keys:
+            if key:
+                insort(self.entries, (key, pk))
+
+    def remove(self, pk):
+        for key in self.keys.pop(pk, ()):
+            i = bisect_left(self.entries, (key, pk))
+            if i < len(self.entries) and self.entries[i] == (key, pk):
+                del self.entries[i]
+        self.labels.pop(pk, None)
+
+    def search(self, prefix, limit):
+        found = {}
+        i = bisect_left(self.entries, (prefix,))
+        while i < len(self.entries) and len(found) < limit:
+            key, pk = self.entries[i]
+            if not key.startswith(prefix):
+                break
+            found.setdefault(pk, None)
+            i += 1
+        return [dict(id=pk, **self.labels[pk]) for pk in found]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Autocomplete:
+    """Các PrefixIndex theo nguồn, dựng lười và đồng bộ qua phiên bản trong cache"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._build_locks = {source: threading.Lock() for source in SOURCES}
+        self._indexes = {}
+        self._checked_at = {}
+
+    @property
+    def check_interval(self):
+        return getattr(settings, 'AUTOCOMPLETE_VERSION_CHECK_SECONDS', 5)
+
+    def _index(self, source):
+        now = time.monotonic()
+        with self._lock:
+            index = self._indexes.get(source)
+            if index is not None and now - self._checked_at.get(source, 0) < self.check_interval:
+                return index
+            self._checked_at[source] = now
+        version = cache.get(VERSION_KEY.format(source))
+        if index is not None and index.version == version:
+            return index
+        build_lock = self._build_locks[source]
+        if not build_lock.acquire(blocking=index is None):
+            # Thread khác đang dựng lại: dùng tạm bản cũ
+            return index
+        try:
+            with self._lock:
+                current = self._indexes.get(source)
+            if current is not None and current.version == version:
+                # Thread trước đã dựng xong trong lúc chờ lock
+                return current
+            index = PrefixIndex(SOURCES[source](), version)
+            with self._lock:
+                self._indexes[source] = index
+                self._checked_at[source] = time.monotonic()
+            return index
+        finally:
+            build_lock.release()
+
+    def search(self, source, query, limit=10):
+        """Gợi ý theo tiền tố (không dấu, không phân biệt hoa thường)"""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        index = self._index(source)
+        with self._lock:
+            return index.search(prefix, limit)
+
+    def _bump_version(self, source):
+        key = VERSION_KEY.format(source)
+        cache.add(key, 0, timeout=None)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+            return 1
+
+    def refresh(self, source, ids):
+        """Đồng bộ các id vừa lưu/xóa (gọi sau commit); chỉ đọc DB nếu nguồn đã được dựng"""
+        ids = set(ids)
+        version = self._bump_version(source)
+        with self._lock:
+            index = self._indexes.get(source)
+        if index is None:
+            return
+        rows = list(SOURCES[source](ids))
+        with self._lock:
+            if self._indexes.get(source) is not index or index.version != version - 1:
+                # Bản local đã lệch từ trước: lần dùng sau dựng lại
+                self._indexes.pop(source, None)
+                return
+            for pk in ids:
+                index.remove(pk)
+            for pk, label, keys in rows:
+                index.put(pk, label, keys)
+            index.version = version
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+            self._checked_at.clear()
+
+    def stats(self):
+        with self._lock:
+            return {source: len(index) for source, index in self._indexes.items()}
+
+
+autocomplete = Autocomplete()
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """Nhiều worker + locmem: thay đổi không tới được process khác"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if settings.DEBUG or not backend.endswith('LocMemCache'):
+        return []
+    return [checks.Warning(
+        'Autocomplete and booking indexes sync through the default cache, which is per-process LocMemCache.',
+        hint='Set CACHE_URL to a shared cache (Redis) when running more than one worker process.',
+        id='lab_management.W001',
+    )]
+'''
+
+# dnu_lab_system/lab_management/recommendations.py
+RECOMMENDATIONS_PY = '''
+"""
+Gợi ý thiết bị theo ngữ nghĩa (mục đích đặt lịch, câu hỏi chat) bằng embedding
+tính tại chỗ, không cần gọi API.
+
+Embedding: hashing trick trên từ đơn và cặp từ liền nhau của văn bản đã bỏ
+dấu (name + specifications + ai_description), tf dạng 1 + log, chuẩn hóa L2.
+IDF chỉ nhân vào vector truy vấn (từ bảng document frequency cập nhật dần),
+nên thêm/sửa một thiết bị không phải tính lại các dòng khác. Chiều không có
+trong thiết bị nào (df = 0) có trọng số 0: nếu không, các từ thừa của câu hỏi
+("tôi cần", "cho bài") chiếm phần lớn chuẩn của vector truy vấn và kéo điểm
+của thiết bị đúng xuống dưới RECOMMENDATION_MIN_SCORE.
+
+Lưu trữ trong RECOMMENDATION_INDEX_DIR: ma trận float32 memory-mapped
+(vectors.f32), id thiết bị của từng dòng (ids.i64, 0 = dòng trống), df.npy và
+meta.json. Ghi dưới file lock; process đọc mở lại memmap khi phiên bản trong
+meta.json đổi. Tìm top-k là một phép nhân ma trận-vector + argpartition.
+"""
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+from .name_index import normalize
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ một process ghi
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+EMBEDDED_FIELDS = ('name', 'specifications', 'ai_description')
+
+
+def features(text):
+    """Từ đơn và cặp từ liền nhau của văn bản đã chuẩn hóa"""
+    words = normalize(text).split()
+    return words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+
+
+def embed(texts, dim):
+    """Ma trận (len(texts), dim) float32, mỗi dòng đã chuẩn hóa L2 (hoặc toàn 0)"""
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feature, count in Counter(features(text)).items():
+            h = zlib.crc32(feature.encode())
+            matrix[row, h % dim] += (1.0 + math.log(count)) * (1 if h & 0x80000000 else -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def equipment_text(name, specifications, ai_description):
+    return ' '.join(part for part in (name, specifications, ai_description) if part)
+
+
+class Snapshot:
+    """Ma trận đang mở để đọc, kèm id và df tại một phiên bản"""
+
+    __slots__ = ('version', 'vectors', 'ids', 'df', 'count')
+
+    def __init__(self, version, vectors, ids, df, count):
+        self.version = version
+        self.vectors = vectors
+        self.ids = ids
+        self.df = df
+        self.count = count
+
+
+class EmbeddingStore:
+    """Các file của index trong một thư mục"""
+
+    def __init__(self, directory, dim):
+        self.directory = str(directory)
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def exists(self):
+        return os.path.exists(self.path('meta.json'))
+
+    def read_meta(self):
+        with open(self.path('meta.json')) as f:
+            return json.load(f)
+
+    def _write_meta(self, meta):
+        tmp = self.path('meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.path('meta.json'))
+
+    def _write_df(self, df):
+        tmp = self.path('df.tmp.npy')
+        np.save(tmp, df)
+        os.replace(tmp, self.path('df.npy'))
+
+    @contextmanager
+    def writing(self):
+        """File lock cho mọi thao tác ghi (giữa các process)"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path('write.lock'), 'w') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # ---- đọc ----------------------------------------------------------
+
+    def snapshot(self):
+        """Snapshot hiện tại, mở lại khi meta.json có phiên bản mới"""
+        if not self.exists():
+            return None
+        meta = self.read_meta()
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != meta['version']:
+                rows = meta['rows']
+                if meta['dim'] != self.dim or rows == 0:
+                    vectors = np.zeros((0, meta['dim']), dtype=np.float32)
+                    ids = np.zeros(0, dtype=np.int64)
+                else:
+                    vectors = np.memmap(self.path('vectors.f32'), dtype=np.float32, mode='r', shape=(rows, meta['dim']))
+                    ids = np.array(np.memmap(self.path('ids.i64'), dtype=np.int64, mode='r', shape=(rows,)))
+                self._snapshot = Snapshot(meta['version'], vectors, ids, np.load(self.path('df.npy')), meta['count'])
+            return self._snapshot
+
+    def search(self, query_vector, k):
+        """[(id, điểm cosine)] của k dòng gần nhất, giảm dần"""
+        snapshot = self.snapshot()
+        if snapshot is None or not len(snapshot.ids):
+            return []
+        idf = np.log((1 + snapshot.count) / (1 + snapshot.df)).astype(np.float32) + 1
+        idf[snapshot.df == 0] = 0
+        query = query_vector * idf
+        norm = np.linalg.norm(query)
+        if not norm:
+            return []
+        scores = snapshot.vectors @ (query / norm)
+        scores[snapshot.ids == 0] = -np.inf
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(snapshot.ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+    # ---- ghi ----------------------------------------------------------
+
+    def rebuild(self, chunks):
+        """Ghi lại toàn bộ index từ các khối (ids, vectors)"""
+        with self.writing():
+            version = self.read_meta()['version'] + 1 if self.exists() else 1
+            df = np.zeros(self.dim, dtype=np.int64)
+            rows = 0
+            with open(self.path('vectors.f32.tmp'), 'wb') as vectors_file, \\
+                    open(self.path('ids.i64.tmp'), 'wb') as ids_file:
+                for ids, vectors in chunks:
+                    vectors_file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+                    ids_file.write(np.asarray(ids, dtype=np.int64).tobytes())
+                    df += np.count_nonzero(vectors, axis=0)
+                    rows += len(ids)
+            os.replace(self.path('vectors.f32.tmp'), self.path('vectors.f32'))
+            os.replace(self.path('ids.i64.tmp'), self.path('ids.i64'))
+            self._write_df(df)
+            self._write_meta({'version': version, 'dim': self.dim, 'rows': rows, 'count': rows})
+        return rows
+
+    def apply(self, upserts, removals):
+        """
+        Cập nhật dần: upserts là (ids, vectors) của các thiết bị thêm/sửa,
+        removals là các id đã xóa. Ghi đè dòng cũ, dùng lại dòng trống, còn
+        thiếu thì nối vào cuối file.
+        """
+        upsert_ids, upsert_vectors = upserts
+        with self.writing():
+            meta = self.read_meta()
+            rows, dim = meta['rows'], meta['dim']
+            df = np.load(self.path('df.npy'))
+            ids = np.memmap(self.path('ids.i64'), dtype=np.int64, mode='r+', shape=(rows,)) if rows else np.zeros(0, np.int64)
+            vectors = np.memmap(self.path('vectors.f32'), dtype=np.float32, mode='r+', shape=(rows, dim)) if rows else None
+
+            # Xóa dòng cũ của mọi id bị đụng tới
+            touched = np.isin(ids, np.concatenate([np.asarray(upsert_ids, np.int64), np.asarray(removals, np.int64)]))
+            for row in np.flatnonzero(touched):
+                df -= vectors[row] != 0
+                vectors[row] = 0
+                ids[row] = 0
+            meta['count'] -= int(touched.sum())
+
+            free_rows = list(np.flatnonzero(ids == 0)) if rows else []
+            appended_ids, appended_vectors = [], []
+            for equipment_id, vector in zip(upsert_ids, upsert_vectors):
+                df += vector != 0
+                if free_rows:
+                    row = free_rows.pop(0)
+                    vectors[row] = vector
+                    ids[row] = equipment_id
+                else:
+                    appended_ids.append(equipment_id)
+                    appended_vectors.append(vector)
+            meta['count'] += len(upsert_ids)
+            if rows:
+                vectors.flush()
+                ids.flush()
+            if appended_ids:
+                with open(self.path('vectors.f32'), 'ab') as f:
+                    f.write(np.asarray(appended_vectors, dtype=np.float32).tobytes())
+                with open(self.path('ids.i64'), 'ab') as f:
+                    f.write(np.asarray(appended_ids, dtype=np.int64).tobytes())
+                meta['rows'] = rows + len(appended_ids)
+            self._write_df(df)
+            meta['version'] += 1
+            self._write_meta(meta)
+
+    def size_bytes(self):
+        return sum(
+            os.path.getsize(self.path(name)) for name in ('vectors.f32', 'ids.i64', 'df.npy')
+            if os.path.exists(self.path(name))
+        )
+
+    def destroy(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        with self._lock:
+            self._snapshot = None
+
+
+class EquipmentRecommender:
+    """Embedding thiết bị + tìm thiết bị gần nhất với một đoạn văn bản"""
+
+    REBUILD_CHUNK_SIZE = 2000
+
+    def __init__(self):
+        self._store = None
+
+    @property
+    def dim(self):
+        return getattr(settings, 'RECOMMENDATION_DIM', 512)
+
+    @property
+    def store(self):
+        directory = str(getattr(settings, 'RECOMMENDATION_INDEX_DIR', settings.BASE_DIR / 'recommendations'))
+        if self._store is None or self._store.directory != directory or self._store.dim != self.dim:
+            self._store = EmbeddingStore(directory, self.dim)
+        return self._store
+
+    def _rows(self, ids=None):
+        from .models import Equipment
+        queryset = Equipment.objects.order_by('id')
+        if ids is not None:
+            queryset = queryset.filter(id__in=ids)
+        return queryset.values_list('id', *EMBEDDED_FIELDS)
+
+    def rebuild(self):
+        """Tính lại embedding cho toàn bộ thiết bị, trả về số dòng"""
+        def chunks():
+            batch = []
+            for row in self._rows().iterator(chunk_size=self.REBUILD_CHUNK_SIZE):
+                batch.append(row)
+                if len(batch) == self.REBUILD_CHUNK_SIZE:
+                    yield self._embed_rows(batch)
+                    batch = []
+            if batch:
+                yield self._embed_rows(batch)
+        return self.store.rebuild(chunks())
+
+    def _embed_rows(self, rows):
+        return [row[0] for row in rows], embed([equipment_text(*row[1:]) for row in rows], self.dim)
+
+    def ensure_built(self):
+        """Dựng index lần đầu (hoặc khi đổi RECOMMENDATION_DIM); True nếu vừa dựng"""
+        store = self.store
+        if store.exists() and store.read_meta()['dim'] == self.dim:
+            return False
+        self.rebuild()
+        return True
+
+    def update(self, ids):
+        """Đồng bộ các thiết bị vừa lưu/xóa (gọi sau commit)"""
+        if self.ensure_built():
+            return
+        ids = set(ids)
+        rows = list(self._rows(ids))
+        removed = ids - {row[0] for row in rows}
+        self.store.apply(self._embed_rows(rows), sorted(removed))
+
+    def similar_ids(self, text, k=5):
+        """[(equipment_id, điểm)] gần nhất với `text`"""
+        self.ensure_built()
+        return self.store.search(embed([text], self.dim)[0], k)
+
+    def recommend(self, text, k=5, available_only=True, exclude_ids=()):
+        """Thiết bị (kèm .similarity) phù hợp nhất với mục đích/câu hỏi"""
+        from .models import Equipment
+        try:
+            scored = self.similar_ids(text, k * 4)
+        except Exception as e:
+            logger.error(f"Equipment recommendation failed: {e}")
+            return []
+        queryset = Equipment.objects.select_related('department').exclude(id__in=exclude_ids)
+        if available_only:
+            queryset = queryset.filter(status='available')
+        min_score = getattr(settings, 'RECOMMENDATION_MIN_SCORE', 0.12)
+        scored = [(equipment_id, score) for equipment_id, score in scored if score >= min_score]
+        by_id = queryset.in_bulk([equipment_id for equipment_id, _ in scored])
+        results = []
+        for equipment_id, score in scored:
+            if equipment_id in by_id and len(results) < k:
+                equipment = by_id[equipment_id]
+                equipment.similarity = score
+                results.append(equipment)
+        return results
+
+
+recommender = EquipmentRecommender()
+'''
+
+# dnu_lab_system/lab_management/management/commands/recommendations.py
+RECOMMENDATIONS_CMD_PY = '''
+import time
+
+from django.core.management.base import BaseCommand
+
+from lab_management.recommendations import recommender
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the equipment embedding index or query it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recompute embeddings for all equipment')
+        parser.add_argument('--query', help='Print the equipment closest to this text')
+        parser.add_argument('--k', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            started = time.perf_counter()
+            rows = recommender.rebuild()
+            self.stdout.write(self.style.SUCCESS(
+                f'✅ Embedded {rows} equipment in {time.perf_counter() - started:.2f}s '
+                f'({recommender.store.size_bytes() / 1e6:.1f} MB in {recommender.store.directory})'
+            ))
+
+        if options['query']:
+            started = time.perf_counter()
+            results = recommender.recommend(options['query'], k=options['k'], available_only=False)
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stdout.write(f'\\n🔎 {options["query"]} ({elapsed:.1f}ms):')
+            for equipment in results:
+                self.stdout.write(f'  {equipment.similarity:.3f}  {equipment.name} ({equipment.code}) - {equipment.status}')
+'''
+
+# dnu_lab_system/lab_management/management/commands/benchmark_recommendations.py
+BENCHMARK_RECOMMENDATIONS_PY = '''
+import random
+import tempfile
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from lab_management.recommendations import EmbeddingStore, embed
+
+KINDS = ['Máy hiện sóng', 'Kính hiển vi', 'Máy đo điện', 'Bộ nguồn', 'Máy phát xung', 'Cân phân tích',
+         'Máy ly tâm', 'Tủ sấy', 'Máy quang phổ', 'Bộ thí nghiệm vi điều khiển', 'Máy in 3D', 'Robot giáo dục']
+WORDS = ['kênh', 'băng thông', 'độ phân giải', 'cảm biến', 'màn hình cảm ứng', 'điện áp', 'tần số',
+         'nhiệt độ', 'độ chính xác cao', 'di động', 'quang học', 'vi mạch', 'tín hiệu số', 'mẫu sinh học',
+         'lập trình', 'đo lường', 'phân tích hóa học', 'hiệu chuẩn', 'an toàn', 'tốc độ cao']
+QUERIES = [
+    'Đo tín hiệu số trên mạch vi điều khiển',
+    'quan sat mau sinh hoc do phan giai cao',
+    'Phân tích hóa học mẫu đất',
+    'Cần nguồn điện áp ổn định cho thí nghiệm',
+    'In mô hình robot bằng máy in 3D',
+]
+# Câu hỏi tự nhiên (nhiều từ không có trong danh mục) -> thiết bị phải đứng đầu
+QUESTIONS = [
+    ('Tôi cần máy hiện sóng để đo tín hiệu cho bài thí nghiệm', 'Máy hiện sóng'),
+    ('Mình muốn quan sát tế bào bằng kính hiển vi được không?', 'Kính hiển vi'),
+    ('Cho em mượn cân phân tích để cân mẫu hóa chất', 'Cân phân tích'),
+]
+# Số câu mô tả khác nhau được embed; kích thước lớn hơn lặp lại các vector này
+POOL_SIZE = 20000
+
+
+class Command(BaseCommand):
+    help = 'Benchmark top-k equipment recommendation over memory-mapped embedding matrices (no database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+        parser.add_argument('--dim', type=int, default=getattr(settings, 'RECOMMENDATION_DIM', 512))
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=20, help='Queries per size (default: 20)')
+
+    def handle(self, *args, **options):
+        dim, k = options['dim'], options['k']
+        rng = random.Random(42)
+        texts = [
+            f'{rng.choice(KINDS)} {" ".join(rng.sample(WORDS, 4))}'
+            for _ in range(min(POOL_SIZE, max(options['sizes'])))
+        ]
+        started = time.perf_counter()
+        pool = embed(texts, dim)
+        embed_ms = (time.perf_counter() - started) * 1000 / len(texts)
+        self.stdout.write(f'Embedding: {embed_ms:.3f}ms per item ({len(texts)} items, dim={dim})')
+        self.check_questions(dim)
+        self.stdout.write(f'{"items":>9} {"build s":>8} {"MB":>8} {"cold ms":>8} {"p50 ms":>8} {"p95 ms":>8}')
+
+        for size in options['sizes']:
+            with tempfile.TemporaryDirectory() as directory:
+                store = EmbeddingStore(directory, dim)
+                started = time.perf_counter()
+                store.rebuild(self.chunks(pool, size))
+                build_s = time.perf_counter() - started
+
+                queries = [embed([QUERIES[i % len(QUERIES)]], dim)[0] for i in range(options['repeat'])]
+                started = time.perf_counter()
+                store.search(queries[0], k)
+                cold_ms = (time.perf_counter() - started) * 1000
+                timings = []
+                for query in queries:
+                    started = time.perf_counter()
+                    store.search(query, k)
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                self.stdout.write(
+                    f'{size:>9} {build_s:>8.2f} {store.size_bytes() / 1e6:>8.1f} {cold_ms:>8.2f} '
+                    f'{timings[len(timings) // 2]:>8.2f} {timings[int(len(timings) * 0.95)]:>8.2f}'
+                )
+
+    def check_questions(self, dim):
+        """Mỗi loại thiết bị một dòng; câu hỏi phải ra đúng loại với điểm >= RECOMMENDATION_MIN_SCORE"""
+        min_score = getattr(settings, 'RECOMMENDATION_MIN_SCORE', 0.12)
+        failed = 0
+        with tempfile.TemporaryDirectory() as directory:
+            store = EmbeddingStore(directory, dim)
+            store.rebuild([(np.arange(1, len(KINDS) + 1), embed(KINDS, dim))])
+            for question, expected in QUESTIONS:
+                top = store.search(embed([question], dim)[0], 1)
+                name, score = (KINDS[top[0][0] - 1], top[0][1]) if top else (None, 0.0)
+                ok = name == expected and score >= min_score
+                failed += not ok
+                self.stdout.write(f'  {"✅" if ok else "❌"} {question} -> {name} ({score:.3f})')
+        if failed:
+            raise CommandError(f'{failed} question(s) did not recommend the expected equipment')
+
+    def chunks(self, pool, size, chunk_size=50000):
+        for start in range(0, size, chunk_size):
+            count = min(chunk_size, size - start)
+            rows = np.arange(start, start + count) % len(pool)
+            yield np.arange(start + 1, start + count + 1), pool[rows]
+'''
+
+# dnu_lab_system/lab_management/retention.py
+RETENTION_PY = '''
+"""
+Dọn dữ liệu chat AI cũ theo từng lô nhỏ, có giới hạn thời gian.
+
+Mỗi lô lấy id của các dòng cũ nhất qua index created_at rồi xóa bằng một câu
+DELETE ... WHERE id IN (...) trong transaction riêng (AIChat không có quan hệ
+hay signal nên Django xóa thẳng, không nạp object). Khóa chỉ giữ trong một lô,
+và job dừng khi hết ngân sách thời gian; phần còn lại được xóa ở lần chạy sau.
+"""
+import logging
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AIChat
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PurgeReport:
+    deleted: int = 0
+    batches: int = 0
+    elapsed: float = 0.0
+    finished: bool = False
+
+    def as_dict(self):
+        return {
+            'deleted': self.deleted,
+            'batches': self.batches,
+            'elapsed': round(self.elapsed, 3),
+            'finished': self.finished,
+        }
+
+
+def retention_cutoff(days=None):
+    days = days if days is not None else getattr(settings, 'AI_CHAT_RETENTION_DAYS', 90)
+    return timezone.now() - timedelta(days=days)
+
+
+def purge_old_chats(days=None, batch_size=None, time_budget=None):
+    """Xóa chat cũ hơn `days` ngày theo lô `batch_size`, dừng sau `time_budget` giây"""
+    cutoff = retention_cutoff(days)
+    batch_size = batch_size or getattr(settings, 'AI_CHAT_PURGE_BATCH_SIZE', 1000)
+    time_budget = time_budget if time_budget is not None else getattr(settings, 'AI_CHAT_PURGE_TIME_BUDGET', 30)
+
+    report = PurgeReport()
+    started = time.monotonic()
+    while time.monotonic() - started < time_budget:
+        ids = list(
+            AIChat.objects.filter(created_at__lt=cutoff)
+            .order_by('created_at', 'id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if ids:
+            with transaction.atomic():
+                deleted, _ = AIChat.objects.filter(id__in=ids).delete()
+            report.deleted += deleted
+            report.batches += 1
+        if len(ids) < batch_size:
+            report.finished = True
+            break
+    report.elapsed = time.monotonic() - started
+    return report
+
+
+def count_old_chats(days=None):
+    return AIChat.objects.filter(created_at__lt=retention_cutoff(days)).count()
+'''
+
+# dnu_lab_system/lab_management/management/commands/purge_ai_chats.py
+PURGE_AI_CHATS_PY = '''
+from django.core.management.base import BaseCommand
+
+from lab_management.retention import count_old_chats, purge_old_chats
+
+
+class Command(BaseCommand):
+    help = 'Delete old AI chat records in small batches within a time budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Keep chats newer than N days (default: AI_CHAT_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, help='Rows per DELETE (default: AI_CHAT_PURGE_BATCH_SIZE)')
+        parser.add_argument('--budget', type=float, help='Seconds to spend (default: AI_CHAT_PURGE_TIME_BUDGET)')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the chats that would be deleted')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(f'🗑️  {count_old_chats(options["days"])} chats would be deleted')
+            return
+
+        report = purge_old_chats(options['days'], options['batch_size'], options['budget'])
+        message = f'Deleted {report.deleted} chats in {report.batches} batches ({report.elapsed:.2f}s)'
+        if report.finished:
+            self.stdout.write(self.style.SUCCESS(f'✅ {message}'))
+        else:
+            self.stdout.write(self.style.WARNING(f'⏱️  {message}; time budget reached, run again to continue'))
+'''
+
+# dnu_lab_system/lab_management/chat_context.py
+CHAT_CONTEXT_PY = '''
+"""
+Ngữ cảnh hội thoại cho chat AI trong giới hạn token.
+
+Prompt gồm system prompt, bản tóm tắt cuốn chiếu của các lượt cũ (lưu trong
+AIChatSummary), tối đa AI_CHAT_HISTORY_TURNS lượt gần nhất (một query trên
+index (user, created_at)) và câu hỏi hiện tại. Các lượt gần nhất được thêm từ
+mới về cũ cho tới khi chạm AI_CHAT_PROMPT_TOKENS (ước lượng token tại chỗ),
+nên kích thước prompt có chặn trên dù hội thoại dài bao nhiêu.
+
+Các lượt đã ra khỏi cửa sổ được gộp dần vào bản tóm tắt ở background: mỗi lần
+chỉ gửi bản tóm tắt cũ cùng các lượt mới ra khỏi cửa sổ.
+"""
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import AIChat, AIChatSummary
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+# Tokenizer BPE thường tách một âm tiết tiếng Việt có dấu thành 1-2 token
+TOKENS_PER_WORD = 1.5
+
+
+def estimate_tokens(text):
+    """Ước lượng số token mà không cần tokenizer của model"""
+    return int(len(TOKEN_PATTERN.findall(text or '')) * TOKENS_PER_WORD) + 1
+
+
+def truncate_tokens(text, max_tokens):
+    """Cắt `text` còn khoảng `max_tokens` token (giữ phần đầu)"""
+    words = int(max_tokens / TOKENS_PER_WORD)
+    for i, match in enumerate(TOKEN_PATTERN.finditer(text)):
+        if i == words:
+            return text[:match.start()].rstrip() + '…'
+    return text
+
+
+def context_setting(name):
+    defaults = {
+        'AI_CHAT_PROMPT_TOKENS': 2000,
+        'AI_CHAT_HISTORY_TURNS': 6,
+        'AI_CHAT_SUMMARY_TOKENS': 300,
+        'AI_CHAT_SUMMARY_MIN_TURNS': 4,
+        'AI_CHAT_SUMMARY_MAX_TURNS': 20,
+    }
+    return getattr(settings, name, defaults[name])
+
+
+@dataclass
+class ChatContext:
+    messages: list = field(default_factory=list)
+    tokens: int = 0
+    # (id lượt cuối đã tóm tắt, id lượt mới nhất trong cửa sổ): đổi khi ngữ cảnh đổi
+    fingerprint: tuple = (0, 0)
+    needs_summary: bool = False
+
+
+def build_chat_context(user, prompt, system_prompt):
+    """Messages cho OpenAI: tóm tắt + các lượt gần nhất vừa ngân sách token + câu hỏi"""
+    turns = context_setting('AI_CHAT_HISTORY_TURNS')
+    min_pending = context_setting('AI_CHAT_SUMMARY_MIN_TURNS')
+    budget = context_setting('AI_CHAT_PROMPT_TOKENS')
+
+    summary = AIChatSummary.objects.filter(user=user).only('summary', 'covered_until_id').first()
+    covered_until = summary.covered_until_id if summary else 0
+    # Lấy thêm min_pending lượt ngoài cửa sổ để biết có cần tóm tắt không (cùng query)
+    recent = list(
+        AIChat.objects.filter(user=user)
+        .order_by('-created_at', '-id')
+        .only('id', 'message', 'response')[:turns + min_pending]
+    )
+    outside = recent[turns:]
+
+    context = ChatContext(messages=[{'role': 'system', 'content': system_prompt}])
+    context.tokens = estimate_tokens(system_prompt) + estimate_tokens(prompt)
+    if summary and summary.summary:
+        summary_text = truncate_tokens(summary.summary, context_setting('AI_CHAT_SUMMARY_TOKENS'))
+        context.messages.append({'role': 'system', 'content': f'Tóm tắt hội thoại trước: {summary_text}'})
+        context.tokens += estimate_tokens(summary_text)
+
+    window = []
+    for chat in recent[:turns]:
+        cost = estimate_tokens(chat.message) + estimate_tokens(chat.response)
+        if context.tokens + cost > budget:
+            break
+        context.tokens += cost
+        window.append(chat)
+    for chat in reversed(window):
+        context.messages.append({'role': 'user', 'content': chat.message})
+        context.messages.append({'role': 'assistant', 'content': chat.response})
+    context.messages.append({'role': 'user', 'content': prompt})
+
+    context.fingerprint = (covered_until, window[0].id if window else 0)
+    context.needs_summary = len(outside) == min_pending and outside[-1].id > covered_until
+    return context
+
+
+def summarize_pending(user_id):
+    """Gộp các lượt đã ra khỏi cửa sổ vào bản tóm tắt, trả về số lượt đã gộp"""
+    from .ai_services import ai_service
+
+    turns = context_setting('AI_CHAT_HISTORY_TURNS')
+    summary, _ = AIChatSummary.objects.get_or_create(user_id=user_id)
+    boundary = (
+        AIChat.objects.filter(user_id=user_id)
+        .order_by('-created_at', '-id')
+        .values_list('id', flat=True)[turns:turns + 1]
+        .first()
+    )
+    if boundary is None:
+        return 0
+    chats = list(
+        AIChat.objects.filter(user_id=user_id, id__gt=summary.covered_until_id, id__lte=boundary)
+        .order_by('id')
+        .only('id', 'message', 'response')[:context_setting('AI_CHAT_SUMMARY_MAX_TURNS')]
+    )
+    if not chats:
+        return 0
+
+    text = ai_service.summarize_conversation(
+        summary.summary, [(chat.message, chat.response) for chat in chats],
+        context_setting('AI_CHAT_SUMMARY_TOKENS'),
+    )
+    # Chỉ ghi nếu chưa có lần tóm tắt khác chạy song song
+    updated = AIChatSummary.objects.filter(pk=summary.pk, covered_until_id=summary.covered_until_id).update(
+        summary=text, covered_until_id=chats[-1].id, updated_at=timezone.now()
+    )
+    return len(chats) if updated else 0
+
+
+def summarize_in_thread(user_id):
+    try:
+        summarize_pending(user_id)
+    except Exception as e:
+        logger.error(f"Chat summary failed for user {user_id}: {e}")
+    finally:
+        close_old_connections()
+
+
+def schedule_summary(user_id):
+    """Tóm tắt ở Celery, không có broker thì chạy ở thread nền"""
+    from .notifications import use_celery
+    if use_celery():
+        try:
+            from .tasks import summarize_chat_history
+            summarize_chat_history.delay(user_id)
+            return
+        except Exception as e:
+            logger.warning(f"Celery unavailable, summarizing chat history locally: {e}")
+    threading.Thread(target=summarize_in_thread, args=(user_id,), daemon=True).start()
+'''
+
+# dnu_lab_system/lab_management/ratelimit.py
+RATELIMIT_PY = '''
+"""
+Giới hạn tần suất request theo người dùng và theo URL name.
+
+Sliding window xấp xỉ bằng hai cửa sổ cố định liền nhau: số request ước lượng
+= số đếm của cửa sổ trước x phần của nó còn nằm trong cửa sổ trượt + số đếm
+của cửa sổ hiện tại. Mỗi lần kiểm tra chỉ tốn một get và một incr trên Django
+cache (locmem: giới hạn theo từng process; Redis: dùng chung giữa các worker),
+và mỗi khóa chỉ giữ hai số nguyên. Request bị từ chối được trừ lại (decr) nên
+client cứ gửi lại liên tục cũng không kéo dài thời gian bị chặn.
+"""
+import math
+import re
+import time
+from dataclasses import dataclass
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+RATE_PATTERN = re.compile(r'^(\d+)/(\d*)([smhd])$')
+UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+@dataclass(frozen=True)
+class Rule:
+    limit: int
+    window: int
+    # Rỗng = mọi method
+    methods: frozenset = frozenset()
+    # Các URL cùng group dùng chung một bộ đếm
+    group: str = ''
+
+
+@dataclass
+class Decision:
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: int = 0
+
+
+def parse_rate(rate):
+    """'20/m' -> (20, 60), '100/10m' -> (100, 600)"""
+    match = RATE_PATTERN.match(str(rate).replace(' ', ''))
+    if not match:
+        raise ImproperlyConfigured(f"Rate không hợp lệ: {rate!r} (dạng '20/m', '100/10m')")
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * UNIT_SECONDS[unit]
+
+
+def load_rules(config):
+    """RATE_LIMITS {url_name: '20/m' | {'rate', 'methods', 'group'}} -> {url_name: Rule}"""
+    rules = {}
+    for url_name, value in config.items():
+        options = value if isinstance(value, dict) else {'rate': value}
+        limit, window = parse_rate(options['rate'])
+        rules[url_name] = Rule(
+            limit=limit,
+            window=window,
+            methods=frozenset(method.upper() for method in options.get('methods', ())),
+            group=options.get('group', url_name),
+        )
+    return rules
+
+
+class SlidingWindowLimiter:
+    """Bộ đếm sliding window trên Django cache"""
+
+    def __init__(self, cache_alias='default', prefix='ratelimit'):
+        self.cache = caches[cache_alias]
+        self.prefix = prefix
+
+    def hit(self, key, rule, now=None):
+        """Ghi nhận một request cho `key` và cho biết có được phép không"""
+        now = time.time() if now is None else now
+        window_index, offset = divmod(now, rule.window)
+        window_index = int(window_index)
+        current_key = f'{self.prefix}:{key}:{window_index}'
+        previous = self.cache.get(f'{self.prefix}:{key}:{window_index - 1}', 0)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            # Khóa hết hạn ở giữa add và incr thì coi như request đầu tiên
+            self.cache.add(current_key, 0, timeout=rule.window * 2)
+            try:
+                current = self.cache.incr(current_key)
+            except ValueError:
+                current = 1
+
+        previous_weight = 1 - offset / rule.window
+        estimate = previous * previous_weight + current
+        if estimate <= rule.limit:
+            return Decision(True, rule.limit, max(0, math.floor(rule.limit - estimate)))
+        # Không tính request bị từ chối
+        try:
+            current = self.cache.decr(current_key)
+        except ValueError:
+            current -= 1
+        return Decision(False, rule.limit, 0, self.retry_after(rule, previous, max(0, current), offset))
+
+    @staticmethod
+    def retry_after(rule, previous, current, offset):
+        """Số giây tới khi request kế tiếp (tính cả chính nó) nằm trong giới hạn"""
+        window, room = rule.window, rule.limit - 1
+        # Còn trong cửa sổ hiện tại: previous * (1 - (offset + t) / window) + current + 1 <= limit
+        if previous and current <= room:
+            wait = window * (1 - (room - current) / previous) - offset
+            if wait < window - offset:
+                return max(1, math.ceil(wait))
+        # Sang cửa sổ sau, cửa sổ hiện tại thành cửa sổ trước:
+        # current * (1 - t / window) + 1 <= limit
+        wait = window - offset
+        if current > room:
+            wait += window * (1 - max(room, 0) / current)
+        return max(1, math.ceil(wait))
+'''
+
+# dnu_lab_system/lab_management/middleware.py
+MIDDLEWARE_PY = '''
+"""Middleware của lab_management"""
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+
+from . import metrics, querylog
+from .ratelimit import SlidingWindowLimiter, load_rules
+
+
+def call_after_streaming(response, callback):
+    """Gọi callback khi nội dung streaming đã gửi hết (hoặc response bị đóng giữa chừng)"""
+    content = response.streaming_content
+    if response.is_async:
+        async def wrapped():
+            try:
+                async for chunk in content:
+                    yield chunk
+            finally:
+                callback()
+    else:
+        def wrapped():
+            try:
+                yield from content
+            finally:
+                callback()
+    response.streaming_content = wrapped()
+
+
+class MetricsMiddleware:
+    """
+    Đo thời gian, số query/thời gian DB, cache hit/miss, thời gian render
+    template và gọi AI/SMTP theo view (xem lab_management/metrics.py).
+
+    Đặt đầu MIDDLEWARE để bao cả các middleware khác. Với streaming response,
+    số đo được chốt khi server đóng response (sau khi gửi hết nội dung).
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        collector = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        except Exception:
+            metrics.current_request.set(None)
+            metrics.finish_request(collector, view_name(request), request.method, 500,
+                                   time.perf_counter() - started)
+            raise
+
+        view = view_name(request)
+        if view == 'metrics':
+            metrics.current_request.set(None)
+            return response
+
+        def finish():
+            metrics.current_request.set(None)
+            metrics.finish_request(collector, view, request.method, response.status_code,
+                                   time.perf_counter() - started)
+
+        if response.streaming:
+            call_after_streaming(response, finish)
+        else:
+            finish()
+        return response
+
+
+class QueryLogMiddleware:
+    """Gom query theo fingerprint cho request được lấy mẫu để phát hiện N+1 (lab_management/querylog.py)"""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_LOG_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        inspection = querylog.start_request()
+        try:
+            response = self.get_response(request)
+        except Exception:
+            querylog.finish_request(inspection, view_name(request), request.method, request.path)
+            raise
+
+        def finish():
+            querylog.finish_request(inspection, view_name(request), request.method, request.path)
+
+        if response.streaming:
+            call_after_streaming(response, finish)
+        else:
+            finish()
+        return response
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unmatched'
+
+
+def client_identity(request):
+    """Người dùng đã đăng nhập theo id, khách theo địa chỉ IP"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'u{user.pk}'
+    if getattr(settings, 'RATE_LIMIT_TRUST_X_FORWARDED_FOR', False):
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded:
+            return f'ip{forwarded.split(",")[0].strip()}'
+    return f"ip{request.META.get('REMOTE_ADDR', '')}"
+
+
+class RateLimitMiddleware:
+    """
+    Giới hạn tần suất theo URL name (settings.RATE_LIMITS) và người dùng.
+
+    Vượt giới hạn -> 429 kèm Retry-After; request được phép nhận thêm
+    X-RateLimit-Limit / X-RateLimit-Remaining.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.rules = load_rules(getattr(settings, 'RATE_LIMITS', {}))
+        self.limiter = SlidingWindowLimiter(getattr(settings, 'RATE_LIMIT_CACHE', 'default'))
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        decision = getattr(request, 'rate_limit', None)
+        if decision is not None and decision.allowed:
+            response['X-RateLimit-Limit'] = str(decision.limit)
+            response['X-RateLimit-Remaining'] = str(decision.remaining)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        rule = self.rules.get(match.url_name) if match else None
+        if rule is None or (rule.methods and request.method not in rule.methods):
+            return None
+
+        decision = self.limiter.hit(f'{rule.group}:{client_identity(request)}', rule)
+        request.rate_limit = decision
+        if decision.allowed:
+            return None
+        response = JsonResponse(
+            {'error': 'Quá nhiều yêu cầu, vui lòng thử lại sau', 'retry_after': decision.retry_after},
+            status=429,
+        )
+        response['Retry-After'] = str(decision.retry_after)
+        return response
+'''
+
+# dnu_lab_system/lab_management/management/commands/benchmark_ratelimit.py
+BENCHMARK_RATELIMIT_PY = '''
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from lab_management.middleware import RateLimitMiddleware
+from lab_management.ratelimit import Rule, SlidingWindowLimiter
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request overhead of RateLimitMiddleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        cache_alias = getattr(settings, 'RATE_LIMIT_CACHE', 'default')
+        self.stdout.write(f'Cache: {type(caches[cache_alias]).__name__}, {count} requests')
+
+        limiter = SlidingWindowLimiter(cache_alias, prefix='ratelimit-benchmark')
+        rule = Rule(limit=count * 2, window=60)
+        started = time.perf_counter()
+        for i in range(count):
+            limiter.hit('bench', rule)
+        self.report('limiter.hit', started, count)
+
+        middleware = RateLimitMiddleware(lambda request: HttpResponse())
+        # Giới hạn đủ cao để mọi request đều được phép
+        for name in middleware.rules:
+            middleware.rules[name] = Rule(limit=count * 2, window=60, group=f'benchmark-{name}')
+        factory = RequestFactory()
+        for label, path in (('limited URL', reverse('equipment_search')), ('unlimited URL (baseline)', reverse('home'))):
+            request = factory.get(path, {'q': 'x'})
+            request.user = AnonymousUser()
+            request.resolver_match = resolve(path)
+            started = time.perf_counter()
+            for i in range(count):
+                middleware.process_view(request, None, (), {})
+                middleware(request)
+            self.report(f'middleware, {label}', started, count)
+
+    def report(self, label, started, count):
+        per_request = (time.perf_counter() - started) * 1e6 / count
+        self.stdout.write(f'  {label:<28} {per_request:8.1f} µs/request')
+'''
+
+# dnu_lab_system/lab_management/metrics.py
+METRICS_PY = '''
+"""
+Số đo hiệu năng theo view, xuất ở /metrics dạng Prometheus text.
+
+Mỗi request được lấy mẫu (METRICS_SAMPLE_RATE) có một RequestMetrics gắn vào
+contextvar; các hook ghi vào đó:
+
+- DB: execute_wrapper gắn vào mọi kết nối khi được mở (connection_created),
+  nên bắt được cả query chạy trong thread của sync_to_async.
+- Cache: get/get_many của các lớp cache đang cấu hình (hit/miss).
+- Template: Template.render của backend Django (chỉ template ngoài cùng).
+- Gọi ra ngoài: track_external('ai' | 'smtp') quanh lời gọi OpenAI/SMTP; cũng
+  ghi vào histogram toàn cục nên đo được cả Celery task.
+
+Khi không có request đang đo, mỗi hook chỉ tốn một lần đọc contextvar. Số
+liệu nằm trong bộ nhớ từng process (cộng dồn từ lúc process khởi động).
+"""
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+current_request = ContextVar('lab_request_metrics', default=None)
+
+
+@dataclass
+class RequestMetrics:
+    db_queries: int = 0
+    db_time: float = 0.0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    template_time: float = 0.0
+    template_depth: int = 0
+    external: dict = field(default_factory=dict)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Counter và histogram theo (tên metric, labels)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.help = {}
+
+    def observe(self, name, labels, value, buckets=DURATION_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def render(self):
+        """Định dạng text exposition của Prometheus"""
+        lines = [
+            '# HELP lab_metrics_sample_rate Fraction of requests with detailed metrics',
+            '# TYPE lab_metrics_sample_rate gauge',
+            f'lab_metrics_sample_rate {sample_rate()}',
+        ]
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, (h.buckets, list(h.counts), h.sum, h.count)) for key, h in self.histograms.items()
+            )
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                declared.add(name)
+                lines += [f'# HELP {name} {METRIC_HELP.get(name, name)}', f'# TYPE {name} counter']
+            lines.append(f'{name}{format_labels(labels)} {value}')
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            if name not in declared:
+                declared.add(name)
+                lines += [f'# HELP {name} {METRIC_HELP.get(name, name)}', f'# TYPE {name} histogram']
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", format_value(bound)),))} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(total)}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+        return '\\n'.join(lines) + '\\n'
+
+
+METRIC_HELP = {
+    'lab_requests_total': 'HTTP requests by view, method and status (not sampled)',
+    'lab_request_duration_seconds': 'Wall time per request',
+    'lab_request_db_queries': 'Database queries per request',
+    'lab_request_db_seconds': 'Database time per request',
+    'lab_request_template_seconds': 'Template render time per request',
+    'lab_request_external_seconds': 'Time in external calls (AI, SMTP) per request',
+    'lab_request_cache_hits_total': 'Cache hits in sampled requests',
+    'lab_request_cache_misses_total': 'Cache misses in sampled requests',
+    'lab_external_call_seconds': 'Duration of each external call, including background tasks',
+}
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels) + '}'
+
+
+def escape_label(value):
+    return str(value).replace('\\\\', '\\\\\\\\').replace('"', '\\\\"').replace('\\n', '\\\\n')
+
+
+registry = Registry()
+
+
+def sample_rate():
+    return getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)
+
+
+def start_request():
+    """Bắt đầu đo một request; None nếu request không được lấy mẫu"""
+    rate = sample_rate()
+    collector = RequestMetrics() if rate >= 1 or random.random() < rate else None
+    current_request.set(collector)
+    return collector
+
+
+def finish_request(collector, view, method, status, elapsed):
+    registry.inc('lab_requests_total', {'view': view, 'method': method, 'status': str(status)})
+    if collector is None:
+        return
+    labels = {'view': view}
+    registry.observe('lab_request_duration_seconds', labels, elapsed)
+    registry.observe('lab_request_db_queries', labels, collector.db_queries, QUERY_BUCKETS)
+    registry.observe('lab_request_db_seconds', labels, collector.db_time)
+    registry.observe('lab_request_template_seconds', labels, collector.template_time)
+    for service, seconds in collector.external.items():
+        registry.observe('lab_request_external_seconds', {'view': view, 'service': service}, seconds)
+    if collector.cache_hits:
+        registry.inc('lab_request_cache_hits_total', labels, collector.cache_hits)
+    if collector.cache_misses:
+        registry.inc('lab_request_cache_misses_total', labels, collector.cache_misses)
+
+
+@contextmanager
+def track_external(service):
+    """Đo thời gian một lời gọi ra ngoài (OpenAI, SMTP)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe('lab_external_call_seconds', {'service': service}, elapsed)
+        collector = current_request.get()
+        if collector is not None:
+            collector.external[service] = collector.external.get(service, 0.0) + elapsed
+
+
+# ---- hook ----------------------------------------------------------------
+
+def query_wrapper(execute, sql, params, many, context):
+    collector = current_request.get()
+    if collector is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        collector.db_queries += 1
+        collector.db_time += time.perf_counter() - started
+
+
+def connection_opened(sender, connection, **kwargs):
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+MISSING = object()
+
+
+def instrument_cache_class(cache_class):
+    if cache_class.__dict__.get('_lab_metrics'):
+        return
+    original_get, original_get_many = cache_class.get, cache_class.get_many
+
+    def get(self, key, default=None, version=None):
+        collector = current_request.get()
+        if collector is None:
+            return original_get(self, key, default, version)
+        value = original_get(self, key, MISSING, version)
+        if value is MISSING:
+            collector.cache_misses += 1
+            return default
+        collector.cache_hits += 1
+        return value
+
+    def get_many(self, keys, version=None):
+        result = original_get_many(self, keys, version)
+        collector = current_request.get()
+        if collector is not None:
+            keys = list(keys) if not isinstance(keys, (list, tuple, set)) else keys
+            collector.cache_hits += len(result)
+            collector.cache_misses += len(keys) - len(result)
+        return result
+
+    cache_class.get = get
+    # BaseCache.get_many gọi lại self.get, chỉ bọc khi backend tự cài get_many
+    if 'get_many' in cache_class.__dict__:
+        cache_class.get_many = get_many
+    cache_class._lab_metrics = True
+
+
+def instrument_templates():
+    from django.template.backends.django import Template
+    if Template.__dict__.get('_lab_metrics'):
+        return
+    original_render = Template.render
+
+    def render(self, context=None, request=None):
+        collector = current_request.get()
+        if collector is None:
+            return original_render(self, context, request)
+        collector.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return original_render(self, context, request)
+        finally:
+            collector.template_depth -= 1
+            if not collector.template_depth:
+                collector.template_time += time.perf_counter() - started
+
+    Template.render = render
+    Template._lab_metrics = True
+
+
+def install():
+    """Gắn các hook (gọi một lần trong AppConfig.ready)"""
+    from django.core.cache import caches
+    from django.db.backends.signals import connection_created
+
+    if not getattr(settings, 'METRICS_ENABLED', True):
+        return
+    connection_created.connect(connection_opened, dispatch_uid='lab_metrics_query_wrapper')
+    for alias in settings.CACHES:
+        instrument_cache_class(type(caches[alias]))
+    instrument_templates()
+'''
+
+# dnu_lab_system/lab_management/querylog.py
+QUERYLOG_PY = '''
+"""
+Log query chậm và phát hiện N+1 ngay trên production.
+
+Một execute_wrapper (gắn vào mọi kết nối khi được mở, từ AppConfig.ready) đo
+từng query: query lâu hơn QUERY_LOG_SLOW_MS được ghi log ở mọi nơi (request,
+Celery, management command). Với tỉ lệ QUERY_LOG_SAMPLE_RATE request,
+QueryLogMiddleware còn gom query theo fingerprint (SQL bỏ tham số, danh sách
+IN gộp lại); fingerprint lặp từ QUERY_LOG_N_PLUS_ONE_THRESHOLD lần trở lên
+trong một request được ghi là N+1.
+
+Mỗi bản ghi là một dòng JSON qua logger lab_management.querylog (handler của
+logger lab_management trong LOGGING); `manage.py query_report` tổng hợp lại.
+Với request không được lấy mẫu, chi phí chỉ là hai lần đọc đồng hồ mỗi query.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+EVENTS = ('slow_query', 'n_plus_one')
+
+IN_LIST = re.compile(r'\\bIN \\((?:[^()]|\\([^()]*\\))*\\)', re.IGNORECASE)
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\\b\\d+(?:\\.\\d+)?\\b')
+WHITESPACE = re.compile(r'\\s+')
+
+current_inspection = ContextVar('lab_query_inspection', default=None)
+
+# Các execute_wrapper của app nằm giữa code gọi query và Django
+WRAPPER_FILES = (__file__, os.path.join(os.path.dirname(__file__), 'metrics.py'))
+
+
+def fingerprint(sql):
+    """SQL chuẩn hóa (bỏ giá trị tham số) và mã băm ngắn của nó"""
+    normalized = IN_LIST.sub('IN (...)', sql)
+    normalized = STRING.sub('?', normalized)
+    normalized = NUMBER.sub('?', normalized).replace('%s', '?')
+    normalized = WHITESPACE.sub(' ', normalized).strip()
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12], normalized
+
+
+def query_source():
+    """Frame đầu tiên trong code dự án (bỏ qua Django, thư viện và các wrapper)"""
+    base = str(settings.BASE_DIR)
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base) and filename not in WRAPPER_FILES and 'site-packages' not in filename:
+            return f'{os.path.relpath(filename, base)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+def emit(event, **fields):
+    fields = {'event': event, 'ts': timezone.now().isoformat(timespec='seconds'), **fields}
+    logger.warning(json.dumps(fields, ensure_ascii=False, default=str))
+
+
+def sql_excerpt(sql):
+    limit = getattr(settings, 'QUERY_LOG_SQL_CHARS', 500)
+    return sql if len(sql) <= limit else sql[:limit] + '...'
+
+
+class RequestInspection:
+    """Các query của một request được lấy mẫu, gom theo fingerprint"""
+
+    __slots__ = ('queries', 'total')
+
+    def __init__(self):
+        self.queries = {}
+        self.total = 0
+
+    def add(self, sql, elapsed):
+        key, normalized = fingerprint(sql)
+        entry = self.queries.get(key)
+        if entry is None:
+            entry = self.queries[key] = [0, 0.0, normalized, None]
+        entry[0] += 1
+        entry[1] += elapsed
+        self.total += 1
+        if entry[0] == getattr(settings, 'QUERY_LOG_N_PLUS_ONE_THRESHOLD', 10):
+            entry[3] = query_source()
+
+    def report(self, view, method, path):
+        threshold = getattr(settings, 'QUERY_LOG_N_PLUS_ONE_THRESHOLD', 10)
+        for key, (count, elapsed, normalized, source) in self.queries.items():
+            if count >= threshold:
+                emit(
+                    'n_plus_one', view=view, method=method, path=path, fingerprint=key,
+                    count=count, total_ms=round(elapsed * 1000, 2), request_queries=self.total,
+                    source=source, sql=sql_excerpt(normalized),
+                )
+
+
+def query_logger(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        inspection = current_inspection.get()
+        if inspection is not None:
+            inspection.add(sql, elapsed)
+        if elapsed * 1000 >= getattr(settings, 'QUERY_LOG_SLOW_MS', 200):
+            key, normalized = fingerprint(sql)
+            emit(
+                'slow_query', duration_ms=round(elapsed * 1000, 2), fingerprint=key,
+                database=context['connection'].alias, many=many, source=query_source(),
+                sql=sql_excerpt(normalized),
+            )
+
+
+def start_request():
+    """Bắt đầu gom query của một request nếu được lấy mẫu"""
+    rate = getattr(settings, 'QUERY_LOG_SAMPLE_RATE', 0.05)
+    inspection = RequestInspection() if rate >= 1 or random.random() < rate else None
+    current_inspection.set(inspection)
+    return inspection
+
+
+def finish_request(inspection, view, method, path):
+    current_inspection.set(None)
+    if inspection is not None:
+        inspection.report(view, method, path)
+
+
+def connection_opened(sender, connection, **kwargs):
+    if query_logger not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_logger)
+
+
+def install():
+    """Gắn execute_wrapper cho mọi kết nối (gọi một lần trong AppConfig.ready)"""
+    from django.db.backends.signals import connection_created
+
+    if getattr(settings, 'QUERY_LOG_ENABLED', True):
+        connection_created.connect(connection_opened, dispatch_uid='lab_query_log')
+
+
+def read_events(lines, since=None):
+    """Các bản ghi JSON của module này trong file log (bỏ qua các dòng khác)"""
+    for line in lines:
+        start = line.find('{"event": ')
+        if start < 0:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            continue
+        if record.get('event') not in EVENTS:
+            continue
+        if since is not None and record.get('ts', '') < since:
+            continue
+        yield record
+'''
+
+# dnu_lab_system/lab_management/management/commands/query_report.py
+QUERY_REPORT_PY = '''
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from lab_management.querylog import read_events
+
+
+class Command(BaseCommand):
+    help = 'Summarize slow queries and N+1 patterns from the query log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='Log file (default: the "file" handler in LOGGING)')
+        parser.add_argument('--hours', type=float, help='Only records from the last N hours')
+        parser.add_argument('--top', type=int, default=10, help='Offenders to show per section')
+
+    def handle(self, *args, **options):
+        path = options['file'] or settings.LOGGING.get('handlers', {}).get('file', {}).get('filename')
+        if not path:
+            raise CommandError('No log file configured, use --file')
+        since = None
+        if options['hours']:
+            since = (timezone.now() - timedelta(hours=options['hours'])).isoformat(timespec='seconds')
+
+        slow = defaultdict(lambda: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'sources': set()})
+        repeated = defaultdict(lambda: {'requests': 0, 'queries': 0, 'max_count': 0, 'total_ms': 0.0, 'sources': set()})
+        try:
+            with open(path, encoding='utf-8', errors='replace') as log:
+                for record in read_events(log, since):
+                    if record['event'] == 'slow_query':
+                        entry = slow[record['fingerprint']]
+                        entry['count'] += 1
+                        entry['total_ms'] += record['duration_ms']
+                        entry['max_ms'] = max(entry['max_ms'], record['duration_ms'])
+                    else:
+                        entry = repeated[(record['view'], record['fingerprint'])]
+                        entry['requests'] += 1
+                        entry['queries'] += record['count']
+                        entry['max_count'] = max(entry['max_count'], record['count'])
+                        entry['total_ms'] += record['total_ms']
+                    entry['sql'] = record['sql']
+                    if record.get('source'):
+                        entry['sources'].add(record['source'])
+        except FileNotFoundError:
+            raise CommandError(f'Log file not found: {path}')
+
+        top = options['top']
+        self.stdout.write(f'🐢 Slow queries ({len(slow)} fingerprints), by total time')
+        for key, entry in sorted(slow.items(), key=lambda item: -item[1]['total_ms'])[:top]:
+            self.stdout.write(
+                f"  {key}  {entry['count']}× avg {entry['total_ms'] / entry['count']:.1f} ms, "
+                f"max {entry['max_ms']:.1f} ms"
+            )
+            self.write_details(entry)
+
+        self.stdout.write(f'🔁 N+1 patterns ({len(repeated)} view/fingerprint pairs), by total time')
+        for (view, key), entry in sorted(repeated.items(), key=lambda item: -item[1]['total_ms'])[:top]:
+            self.stdout.write(
+                f"  {view}  {key}  {entry['requests']} requests, "
+                f"avg {entry['queries'] / entry['requests']:.0f} repeats (max {entry['max_count']}), "
+                f"{entry['total_ms']:.1f} ms"
+            )
+            self.write_details(entry)
+
+        if not slow and not repeated:
+            self.stdout.write(self.style.SUCCESS('✅ No slow queries or N+1 patterns logged'))
+
+    def write_details(self, entry):
+        for source in sorted(entry['sources'])[:3]:
+            self.stdout.write(f'      at {source}')
+        self.stdout.write(self.style.HTTP_INFO(f"      {entry['sql'][:200]}"))
 '''
 
 def create_django_files():
@@ -658,12 +6298,49 @@ def create_django_files():
     files_content = {
         'dnu_lab_system/dnu_lab_system/settings.py': SETTINGS_PY,
         'dnu_lab_system/dnu_lab_system/urls.py': MAIN_URLS_PY,
+        'dnu_lab_system/dnu_lab_system/wsgi.py': WSGI_PY,
+        'dnu_lab_system/dnu_lab_system/asgi.py': ASGI_PY,
         'dnu_lab_system/lab_management/models.py': MODELS_PY,
         'dnu_lab_system/lab_management/views.py': VIEWS_PY,
         'dnu_lab_system/lab_management/forms.py': FORMS_PY,
         'dnu_lab_system/lab_management/urls.py': URLS_PY,
         'dnu_lab_system/lab_management/admin.py': ADMIN_PY,
         'dnu_lab_system/lab_management/ai_services.py': AI_SERVICES_PY,
+        'dnu_lab_system/lab_management/booking_index.py': BOOKING_INDEX_PY,
+        'dnu_lab_system/lab_management/signals.py': SIGNALS_PY,
+        'dnu_lab_system/lab_management/apps.py': APPS_PY,
+        'dnu_lab_system/lab_management/reservations.py': RESERVATIONS_PY,
+        'dnu_lab_system/lab_management/pagination.py': PAGINATION_PY,
+        'dnu_lab_system/lab_management/counters.py': COUNTERS_PY,
+        'dnu_lab_system/lab_management/management/commands/loadtest_bookings.py': LOADTEST_BOOKINGS_PY,
+        'dnu_lab_system/lab_management/management/commands/explain_queries.py': EXPLAIN_QUERIES_PY,
+        'dnu_lab_system/lab_management/tests.py': TESTS_PY,
+        'dnu_lab_system/lab_management/ai_cache.py': AI_CACHE_PY,
+        'dnu_lab_system/lab_management/ai_streaming.py': AI_STREAMING_PY,
+        'dnu_lab_system/lab_management/notifications.py': NOTIFICATIONS_PY,
+        'dnu_lab_system/lab_management/management/commands/benchmark_bulk_moderation.py': BENCHMARK_BULK_MODERATION_PY,
+        'dnu_lab_system/lab_management/analytics.py': ANALYTICS_PY,
+        'dnu_lab_system/lab_management/rollups.py': ROLLUPS_PY,
+        'dnu_lab_system/lab_management/management/commands/usage_rollups.py': USAGE_ROLLUPS_PY,
+        'dnu_lab_system/lab_management/availability.py': AVAILABILITY_PY,
+        'dnu_lab_system/lab_management/catalog.py': CATALOG_PY,
+        'dnu_lab_system/lab_management/search.py': SEARCH_PY,
+        'dnu_lab_system/lab_management/management/commands/benchmark_search.py': BENCHMARK_SEARCH_PY,
+        'dnu_lab_system/lab_management/name_index.py': NAME_INDEX_PY,
+        'dnu_lab_system/lab_management/management/commands/rebuild_name_index.py': REBUILD_NAME_INDEX_PY,
+        'dnu_lab_system/lab_management/autocomplete.py': AUTOCOMPLETE_PY,
+        'dnu_lab_system/lab_management/recommendations.py': RECOMMENDATIONS_PY,
+        'dnu_lab_system/lab_management/management/commands/recommendations.py': RECOMMENDATIONS_CMD_PY,
+        'dnu_lab_system/lab_management/management/commands/benchmark_recommendations.py': BENCHMARK_RECOMMENDATIONS_PY,
+        'dnu_lab_system/lab_management/retention.py': RETENTION_PY,
+        'dnu_lab_system/lab_management/management/commands/purge_ai_chats.py': PURGE_AI_CHATS_PY,
+        'dnu_lab_system/lab_management/chat_context.py': CHAT_CONTEXT_PY,
+        'dnu_lab_system/lab_management/ratelimit.py': RATELIMIT_PY,
+        'dnu_lab_system/lab_management/middleware.py': MIDDLEWARE_PY,
+        'dnu_lab_system/lab_management/management/commands/benchmark_ratelimit.py': BENCHMARK_RATELIMIT_PY,
+        'dnu_lab_system/lab_management/metrics.py': METRICS_PY,
+        'dnu_lab_system/lab_management/querylog.py': QUERYLOG_PY,
+        'dnu_lab_system/lab_management/management/commands/query_report.py': QUERY_REPORT_PY,
     }
     
     for file_path, content in files_content.items():
@@ -60,6 +60,7 @@ def main():
         print("9. python manage.py createsuperuser")
         print("10. python ../scripts/create_sample_data.py")
         print("11. python manage.py runserver")
+        print("    # Production (stream chat AI qua ASGI): uvicorn dnu_lab_system.asgi:application --workers 4")
         print("\n🤖 Để sử dụng AI features:")
         print("- Thêm OPENAI_API_KEY vào file .env")
         print("- Chạy: python manage.py ai_operations --generate-descriptions")
@@ -37,6 +37,9 @@ Pillow==10.0.1
 celery==5.3.4
 redis==5.0.1
 openai==1.3.5
+numpy==1.26.2
+httpx<0.28
+uvicorn==0.24.0
 python-dotenv==1.0.0
 django-extensions==3.2.3
 django-debug-toolbar==4.2.0
@@ -59,9 +62,22 @@ EMAIL_PORT=587
 EMAIL_USE_TLS=True
 EMAIL_HOST_USER=your-email@gmail.com
 EMAIL_HOST_PASSWORD=your-app-password
+NOTIFICATION_BACKEND=celery
 
 # AI Integration
 OPENAI_API_KEY=your-openai-api-key-here
+OPENAI_MODEL=gpt-3.5-turbo
+# Point at `python manage.py fake_llm_server` for load tests
+# OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+
+# Prometheus scrape token for /metrics (sent as "Authorization: Bearer <token>").
+# /metrics returns 404 when no token is set and the IP allowlist is empty.
+METRICS_TOKEN=
+# Only for scrapers that reach the app server directly (never behind a local proxy)
+# METRICS_ALLOWED_IPS=10.0.0.5
+
+# Shared cache (required when running more than one worker process)
+CACHE_URL=redis://localhost:6379/1
 
 # Celery Configuration
 CELERY_BROKER_URL=redis://localhost:6379/0